@@ -0,0 +1,77 @@
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from avatar_cache import render_thumbnail  # noqa: E402
+from avatar_store import avatar_hash, normalize_avatar  # noqa: E402
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def sample_image(width, height, image_format):
+    # Degradado con ruido: se comprime como una foto, no como un color plano
+    noise = Image.frombytes('L', (width, height), os.urandom(width * height))
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def cpu_time(function, *args, repeat=5):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = function(*args)
+    return (time.process_time() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes y CPU por cambio de imagen de perfil")
+    parser.add_argument('--recipients', type=int, default=100, help="usuarios conectados que reciben el cambio")
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--height', type=int, default=1500)
+    args = parser.parse_args()
+    if Image is None:
+        print("Este benchmark necesita Pillow")
+        return
+
+    for image_format in ('JPEG', 'PNG'):
+        image_data = sample_image(args.width, args.height, image_format)
+        image_hash = avatar_hash(image_data)
+
+        # Antes: el servidor solo valida el base64 y reenvía el original; cada cliente lo decodifica y reduce
+        server_before, _ = cpu_time(base64.b64decode, image_data)
+        client_before, _ = cpu_time(render_thumbnail, image_data, repeat=3)
+        wire_before = len(json.dumps({'type': 'user_updated', 'version': 1,
+                                      'user': {'username': 'usuario', 'profile_image': image_data}}))
+
+        # Ahora: se normaliza una vez; los clientes reciben el hash y piden una miniatura de 60x60
+        server_after, (_, variants) = cpu_time(normalize_avatar, image_data, repeat=3)
+        client_after, _ = cpu_time(render_thumbnail, variants['thumbnail'])
+        wire_after = len(json.dumps({'type': 'user_updated', 'version': 1,
+                                     'user': {'username': 'usuario', 'avatar_hash': image_hash}}))
+        wire_after += len(json.dumps({'type': 'avatar', 'avatar_hash': image_hash, 'variant': 'thumbnail',
+                                      'image': variants['thumbnail']}))
+
+        n = args.recipients
+        print(f"--- {image_format} {args.width}x{args.height}, {len(image_data) / 1024:.0f} KiB en base64, "
+              f"{n} destinatarios")
+        print(f"{'':10} {'bytes enviados':>16} {'CPU servidor':>14} {'CPU clientes (total)':>22}")
+        print(f"{'antes':10} {wire_before * n / 1024:13.0f} KiB {server_before * 1000:11.1f} ms "
+              f"{client_before * n * 1000:19.0f} ms")
+        print(f"{'ahora':10} {wire_after * n / 1024:13.0f} KiB {server_after * 1000:11.1f} ms "
+              f"{client_after * n * 1000:19.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import base64
+import hashlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from common import free_port  # noqa: E402
+from framing import (CAPABILITIES, FRAME_HELLO, PREAMBLE, PROTOCOL_V2, BinaryFrameReader, encode_frame,  # noqa: E402
+                     encode_preamble, frame_message, recv_exact)
+from message_codec import CODEC_JSON, get_codec  # noqa: E402
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CODEC = get_codec(CODEC_JSON)
+
+
+def sample_image(side):
+    # Ruido en JPEG: cada usuario sube una imagen distinta y válida, que el servidor tiene que normalizar
+    image = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def login(port, username, image, capabilities):
+    sock = socket.create_connection(('localhost', port))
+    hello = {'username': username, 'capabilities': capabilities,
+             'avatar_hash': hashlib.sha256(base64.b64decode(image)).hexdigest()}
+    sock.sendall(encode_preamble(PROTOCOL_V2, CODEC_JSON) + encode_frame(FRAME_HELLO, CODEC.encode(hello)) +
+                 frame_message(CODEC.encode({'type': 'profile_image', 'image': image}), PROTOCOL_V2))
+    return sock
+
+
+def first_user_list(sock):
+    recv_exact(sock, PREAMBLE.size)
+    reader = BinaryFrameReader(sock)
+    while True:
+        reader.fill()
+        for frame in reader.frames():
+            if frame.payload.startswith(b'{"type": "user_list"'):
+                return frame.payload
+
+
+def avatars_in(payload):
+    # Usuarios de la lista que llegan con su imagen o con su hash
+    users = CODEC.decode(payload)['users']
+    return sum(1 for user in users if user.get('profile_image') or user.get('avatar_hash'))
+
+
+def observe(port, username, image, capabilities, expected, timeout=120):
+    # Las imágenes se normalizan en segundo plano: se repite el login hasta que la lista las incluye todas
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = login(port, username, image, capabilities)
+        start = time.perf_counter()
+        payload = first_user_list(sock)
+        elapsed = time.perf_counter() - start
+        sock.close()
+        found = avatars_in(payload)
+        if found >= expected:
+            return payload, elapsed
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"La lista de usuarios solo trae {found} de {expected} imágenes de perfil")
+        time.sleep(0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamaño de la lista de usuarios con imágenes en línea o por hash")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--image-side', type=int, default=128, help="lado en píxeles de cada imagen de perfil (JPEG)")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='asyncio')
+    args = parser.parse_args()
+    if Image is None:
+        print("Este benchmark necesita Pillow")
+        return
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py'), '--engine', args.engine,
+                               '--port', str(port), '--backlog', '4096'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    sockets = []
+    image_bytes = 0
+    try:
+        time.sleep(1.0)
+        for i in range(args.users):
+            image = sample_image(args.image_side)
+            image_bytes += len(image) * 3 // 4
+            # Estos clientes no leen: con todas las capacidades cada login solo les encola un delta pequeño
+            sockets.append(login(port, f'usuario{i}', image, CAPABILITIES))
+        image = sample_image(args.image_side)
+        inline_caps = [name for name in CAPABILITIES if name != 'avatar_fetch']
+        for label, capabilities in (("imágenes en línea", inline_caps), ("solo hash (avatar_fetch)", CAPABILITIES)):
+            payload, elapsed = observe(port, f'observador-{len(capabilities)}', image, capabilities, args.users)
+            print(f"{label:26} {len(payload) / 1024:10.1f} KiB  {elapsed * 1000:7.1f} ms hasta la lista completa")
+    finally:
+        for sock in sockets:
+            sock.close()
+        server.terminate()
+        server.wait()
+    print(f"{args.users} usuarios con imágenes JPEG de {args.image_side}x{args.image_side} "
+          f"({image_bytes / max(args.users, 1) / 1024:.1f} KiB de media), motor {args.engine}")
+
+
+if __name__ == "__main__":
+    main()
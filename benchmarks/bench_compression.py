@@ -0,0 +1,97 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from compression import COMPRESSIONS, FrameCompressor  # noqa: E402
+from framing import FILE_CHUNK, PROTOCOL_V2, BinaryFrameReader, encode_file_chunk, frame_message  # noqa: E402
+
+CHUNK_SIZE = 256 * 1024
+
+
+def user_list_payload(users=500):
+    entries = [{'username': f'usuario{i}', 'avatar_hash': hashlib.sha256(str(i).encode()).hexdigest()}
+               for i in range(users)]
+    return json.dumps({'type': 'user_list', 'version': 42, 'users': entries}).encode('utf-8')
+
+
+def group_list_payload(groups=200, members=20):
+    entries = {f'grupo{i}': [f'usuario{(i * 7 + j) % 500}' for j in range(members)] for i in range(groups)}
+    return json.dumps({'type': 'group_list', 'groups': entries}).encode('utf-8')
+
+
+def chat_payload():
+    return json.dumps({'type': 'message', 'sender': 'alice', 'content': '¿Nos vemos a las cinco?'}).encode('utf-8')
+
+
+def text_chunk():
+    lines = (f"2026-10-17 12:{i // 60 % 60:02d}:{i % 60:02d} INFO conexión aceptada desde 10.0.{i % 256}.{i % 97}\n"
+             for i in range(CHUNK_SIZE // 40))
+    return ''.join(lines).encode('utf-8')[:CHUNK_SIZE]
+
+
+def media_chunk():
+    # El primer chunk de un JPEG: la firma basta para no intentarlo
+    return b'\xff\xd8\xff\xe0' + os.urandom(CHUNK_SIZE - 4)
+
+
+def random_chunk():
+    # Un chunk del medio de un vídeo o un zip: sin firma, lo descarta la muestra
+    return os.urandom(CHUNK_SIZE)
+
+
+def encode(name, payload, compressor):
+    if name.startswith('chunk'):
+        return b''.join(encode_file_chunk(1, 0, payload, compressor=compressor))
+    return frame_message(payload, PROTOCOL_V2, 0, compressor)
+
+
+def measure(name, payload, compressor, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        frame = encode(name, payload, compressor)
+    encode_time = (time.process_time() - start) / repeat
+    start = time.process_time()
+    for _ in range(repeat):
+        reader = BinaryFrameReader()
+        reader.feed(frame)
+        decoded = reader.frames()[0].payload
+    decode_time = (time.process_time() - start) / repeat
+    expected = FILE_CHUNK.pack(1, 0, len(payload)) + payload if name.startswith('chunk') else payload
+    assert decoded == expected
+    return len(frame), encode_time, decode_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes en el cable y CPU por frame con y sin compresión, y el "
+                                                 "tiempo total estimado en un enlace de la velocidad indicada")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--link-mbps', type=float, default=100, help="velocidad del enlace en Mbit/s")
+    args = parser.parse_args()
+    link = args.link_mbps * 1000 * 1000 / 8
+
+    payloads = [('lista de 500 usuarios', user_list_payload()), ('lista de 200 grupos', group_list_payload()),
+                ('mensaje de chat', chat_payload()), ('chunk de texto', text_chunk()),
+                ('chunk JPEG', media_chunk()), ('chunk aleatorio', random_chunk())]
+    compressors = [('sin comprimir', None)] + [(compression.name, FrameCompressor(compression_id))
+                                               for compression_id, compression in COMPRESSIONS.items()]
+    print(f"--- enlace de {args.link_mbps:.0f} Mbit/s; tiempo = comprimir + enviar + descomprimir")
+    print(f"{'payload':>22} {'compresión':>14} {'bytes':>9} {'ratio':>6} {'comprimir µs':>13} "
+          f"{'descomprimir µs':>16} {'total ms':>9}")
+    for label, payload in payloads:
+        name = 'chunk' if label.startswith('chunk') else 'message'
+        plain = None
+        for compressor_label, compressor in compressors:
+            size, encode_time, decode_time = measure(name, payload, compressor, args.repeat)
+            plain = plain or size
+            total = encode_time + size / link + decode_time
+            print(f"{label:>22} {compressor_label:>14} {size:9} {size / plain:6.2f} {encode_time * 1e6:13.0f} "
+                  f"{decode_time * 1e6:16.0f} {total * 1000:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
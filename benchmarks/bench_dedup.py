@@ -0,0 +1,97 @@
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from common import Session, free_port  # noqa: E402
+from file_transfer import open_data_channel, send_file_chunks  # noqa: E402
+from framing import CAPABILITIES  # noqa: E402
+
+CHUNK_SIZE = 256 * 1024
+
+
+def disk_usage(directory):
+    # Bytes ocupados de verdad: cada inodo una vez, aunque tenga varios enlaces
+    inodes = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            stat = os.lstat(os.path.join(root, name))
+            inodes[stat.st_ino] = stat.st_size
+    return sum(inodes.values())
+
+
+def send(sender, welcome, port, file_path, size, chunk_hashes, transfer_id, recipient, channels):
+    started = time.perf_counter()
+    sender.send({'type': 'file_start', 'transfer_id': transfer_id, 'recipient': recipient.username,
+                 'file_name': 'instalador.bin', 'size': size, 'chunk_size': CHUNK_SIZE, 'chunk_hashes': chunk_hashes})
+    status = sender.wait_for(lambda data: data['type'] == 'file_status' and data['transfer_id'] == transfer_id)
+    missing = status['missing']
+    sent = sum(min(end * CHUNK_SIZE, size) - start * CHUNK_SIZE for start, end in missing)
+    sockets = []
+    if missing:
+        sockets = [open_data_channel('localhost', welcome.get('data_port') or port, welcome['session_token'])
+                   for _ in range(channels)]
+        send_file_chunks(sockets, file_path, transfer_id, CHUNK_SIZE, size, missing)
+    recipient.session.wait_for(lambda data: data['type'] == 'file_available')
+    elapsed = time.perf_counter() - started
+    for sock in sockets:
+        sock.close()
+    return elapsed, sent
+
+
+class Recipient:
+    def __init__(self, port, username):
+        self.username = username
+        self.session = Session(port, username, CAPABILITIES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="El mismo archivo enviado a varios destinatarios: bytes subidos, "
+                                                 "tiempo hasta 'file_available' y espacio en disco del servidor")
+    parser.add_argument('--size', type=int, default=256, help="tamaño del archivo en MB")
+    parser.add_argument('--recipients', type=int, default=4)
+    parser.add_argument('--channels', type=int, default=4, help="conexiones de datos por subida")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    workdir = tempfile.mkdtemp(prefix='bench-dedup-')
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py'), '--engine', args.engine,
+                               '--port', str(port)], cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        file_path = os.path.join(workdir, 'instalador.bin')
+        with open(file_path, 'wb') as file:
+            file.write(os.urandom(size))
+        with open(file_path, 'rb') as file:
+            chunk_hashes = [hashlib.sha256(file.read(CHUNK_SIZE)).hexdigest() for _ in range(0, size, CHUNK_SIZE)]
+        time.sleep(1.0)
+        sender = Session(port, 'emisor', CAPABILITIES)
+        welcome = sender.wait_for(lambda data: data['type'] == 'welcome')
+        recipients = [Recipient(port, f"colega{number}") for number in range(args.recipients)]
+        print(f"--- archivo de {args.size} MB a {args.recipients} destinatarios, motor {args.engine}")
+        print(f"{'destinatario':>14} {'MB subidos':>11} {'segundos':>9}")
+        total = 0
+        for transfer_id, recipient in enumerate(recipients, 1):
+            elapsed, sent = send(sender, welcome, port, file_path, size, chunk_hashes, transfer_id, recipient,
+                                 args.channels)
+            total += sent
+            print(f"{recipient.username:>14} {sent / 1024 / 1024:11.0f} {elapsed:9.2f}")
+        stored = disk_usage(os.path.join(workdir, 'received_files'))
+        print(f"subidos {total / 1024 / 1024:.0f} MB de {args.recipients * args.size} MB; "
+              f"en disco {stored / 1024 / 1024:.0f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
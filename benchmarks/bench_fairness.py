@@ -0,0 +1,115 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from common import Session, free_port  # noqa: E402
+from file_transfer import open_data_channel, send_file_chunks  # noqa: E402
+from framing import CAPABILITIES  # noqa: E402
+
+CHUNK_SIZE = 256 * 1024
+
+
+def upload(port, file_path, size, channels, started, finished):
+    # Un usuario que sube un archivo grande por varias conexiones de datos, tan rápido como lee el servidor. Va en
+    # otro proceso para que sus hilos no compitan por el GIL con los que miden la latencia del chat
+    bulk = Session(port, 'masivo', CAPABILITIES)
+    welcome = bulk.wait_for(lambda data: data['type'] == 'welcome')
+    with open(file_path, 'rb') as file:
+        chunk_hashes = [hashlib.sha256(file.read(CHUNK_SIZE)).hexdigest() for _ in range(0, size, CHUNK_SIZE)]
+    bulk.send({'type': 'file_start', 'transfer_id': 1, 'recipient': 'receptor', 'file_name': 'masivo.bin',
+               'size': size, 'chunk_size': CHUNK_SIZE, 'chunk_hashes': chunk_hashes})
+    missing = bulk.wait_for(lambda data: data['type'] == 'file_status')['missing']
+    sockets = [open_data_channel('localhost', welcome.get('data_port') or port, welcome['session_token'])
+               for _ in range(channels)]
+    started.put(time.perf_counter())
+    send_file_chunks(sockets, file_path, 1, CHUNK_SIZE, size, missing)
+    # Cerrar la sesión antes de que el servidor lea los últimos chunks interrumpiría la transferencia
+    finished.wait(600)
+    for sock in sockets:
+        sock.close()
+    bulk.sock.close()
+
+
+def run(workdir, engine, file_path, size, channels, weight, messages, interval):
+    port = free_port()
+    command = [sys.executable, os.path.join(SRC, 'server.py'), '--engine', engine, '--port', str(port)]
+    if weight is not None:
+        command += ['--user-class', 'masivo=masivo', '--class-weight', f'masivo={weight}']
+    server = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1.0)
+        receiver = Session(port, 'receptor', CAPABILITIES)
+        sender = Session(port, 'emisor', CAPABILITIES)
+        # spawn: un fork con los hilos lectores de las sesiones ya en marcha puede heredar locks tomados
+        context = multiprocessing.get_context('spawn')
+        started = context.Queue()
+        finished = context.Event()
+        if size:
+            context.Process(target=upload, args=(port, file_path, size, channels, started, finished),
+                            daemon=True).start()
+            time.sleep(1.0)
+        sent = {}
+        for number in range(messages):
+            sent[str(number)] = time.perf_counter()
+            sender.send({'type': 'message', 'recipient': 'receptor', 'content': str(number)})
+            time.sleep(interval)
+        receiver.wait_for(lambda data: data['type'] == 'message' and data['content'] == str(messages - 1))
+        latencies = sorted((data['arrived'] - sent[data['content']]) * 1000 for data in receiver.messages
+                           if data['type'] == 'message' and data['content'] in sent)
+        elapsed = None
+        if size:
+            # El destinatario recibe 'file_available' cuando el servidor tiene el archivo completo
+            available = receiver.wait_for(lambda data: data['type'] == 'file_available')
+            elapsed = available['arrived'] - started.get()
+            finished.set()
+        receiver.sock.close()
+        sender.sock.close()
+        return latencies, elapsed
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(os.path.join(workdir, 'received_files'), ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia del chat entre dos usuarios mientras un tercero sube un "
+                                                 "archivo grande por varias conexiones de datos")
+    parser.add_argument('--size', type=int, default=512, help="tamaño del archivo en MB")
+    parser.add_argument('--channels', type=int, default=4, help="conexiones de datos del usuario masivo")
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=0.02, help="segundos entre mensajes del chat")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    workdir = tempfile.mkdtemp(prefix='bench-fairness-')
+    try:
+        file_path = os.path.join(workdir, 'masivo.bin')
+        with open(file_path, 'wb') as file:
+            file.write(os.urandom(size))
+        print(f"--- {args.messages} mensajes del chat, subida de {args.size} MB por {args.channels} conexiones, "
+              f"motor {args.engine}")
+        print(f"{'escenario':>22} {'p50 ms':>9} {'p99 ms':>9} {'máx ms':>9} {'subida MB/s':>12}")
+        scenarios = (("solo chat", 0, None), ("subida, peso 1", size, None), ("subida, peso 0.25", size, 0.25))
+        for label, upload_size, weight in scenarios:
+            latencies, elapsed = run(workdir, args.engine, file_path, upload_size, args.channels, weight,
+                                     args.messages, args.interval)
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            rate = f"{upload_size / 1024 / 1024 / elapsed:12.0f}" if elapsed else f"{'-':>12}"
+            print(f"{label:>22} {statistics.median(latencies):9.1f} {p99:9.1f} {latencies[-1]:9.1f} {rate}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
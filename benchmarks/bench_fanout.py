@@ -0,0 +1,163 @@
+import argparse
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+import logging  # noqa: E402
+
+from framing import PROTOCOL_V2, BinaryFrameReader, frame_message  # noqa: E402
+from message_codec import CODEC_JSON, get_codec  # noqa: E402
+from outbound import OutboundLimits, OutboundQueue, QueuedClient  # noqa: E402
+from server import ChatServer  # noqa: E402
+
+
+class LegacyClient:
+    # Cliente anterior: un hilo escritor por conexión y un sendall por frame
+    def __init__(self, client_socket, username, limits, stats, version, codec_id):
+        self.socket = client_socket
+        self.username = username
+        self.version = version
+        self.codec = get_codec(codec_id)
+        self.outbound = OutboundQueue(limits, stats, username)
+        self.ready = threading.Event()
+        self.outbound.on_ready = self.ready.set
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+
+    def start(self):
+        self.writer.start()
+
+    def send(self, payload, kind='chat', key=None):
+        self.outbound.put(frame_message(payload, self.version, self.codec.codec_id), kind, key)
+
+    def write_loop(self):
+        try:
+            while True:
+                self.ready.wait()
+                self.ready.clear()
+                if self.outbound.closed:
+                    break
+                while self.outbound.frame_count:
+                    for frame in self.outbound.pop_fair_batch():
+                        self.socket.sendall(frame)
+        except OSError:
+            self.outbound.close()
+
+    def close(self):
+        self.outbound.close()
+
+
+def legacy_deliver(server, recipients, message, kind='chat', key=None):
+    # Reparto anterior: se serializa una vez por códec pero se enmarca (y copia) una vez por destinatario
+    payloads = {}
+    for recipient in recipients:
+        client = server.clients[recipient]
+        payload = payloads.get(client.codec.codec_id)
+        if payload is None:
+            payload = payloads[client.codec.codec_id] = client.codec.encode(message)
+        client.send(payload, kind, key)
+
+
+class Receivers:
+    def __init__(self, sockets, messages):
+        self.selector = selectors.DefaultSelector()
+        self.readers = {}
+        self.received = {}
+        self.latencies = []
+        self.sent_at = [None] * messages
+        self.members = len(sockets)
+        self.pending = len(sockets) * messages
+        self.arrived = [0] * messages
+        self.delivered = [threading.Event() for _ in range(messages)]
+        for sock in sockets:
+            sock.setblocking(False)
+            self.readers[sock] = BinaryFrameReader(sock)
+            self.received[sock] = 0
+            self.selector.register(sock, selectors.EVENT_READ)
+
+    def run(self):
+        while self.pending:
+            for key, _ in self.selector.select(1.0):
+                sock = key.fileobj
+                reader = self.readers[sock]
+                try:
+                    reader.fill()
+                except BlockingIOError:
+                    continue
+                now = time.perf_counter()
+                for _ in reader.frames():
+                    seq = self.received[sock]
+                    self.latencies.append(now - self.sent_at[seq])
+                    self.received[sock] += 1
+                    self.pending -= 1
+                    self.arrived[seq] += 1
+                    if self.arrived[seq] == self.members:
+                        self.delivered[seq].set()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(members, messages, size, legacy):
+    server = ChatServer('localhost', 0)
+    limits = OutboundLimits(max_bytes=64 * 1024 * 1024)
+    client_class = LegacyClient if legacy else QueuedClient
+    sockets = []
+    for i in range(members):
+        server_side, client_side = socket.socketpair()
+        client = client_class(server_side, f'miembro{i}', limits, server.outbound_stats, PROTOCOL_V2, CODEC_JSON)
+        client.start()
+        server.clients[client.username] = client
+        sockets.append(client_side)
+    server.groups.create('grupo', server.clients)
+    members = list(server.groups.members_of('grupo'))
+    receivers = Receivers(sockets, messages)
+    threading.Thread(target=receivers.run, daemon=True).start()
+
+    content = 'x' * size
+    fanout = []
+    for seq in range(messages):
+        message = {'type': 'group_message', 'sender': 'emisor', 'group': 'grupo', 'content': content}
+        receivers.sent_at[seq] = start = time.perf_counter()
+        if legacy:
+            legacy_deliver(server, members, message)
+        else:
+            server.deliver(members, message)
+        fanout.append(time.perf_counter() - start)
+        # Un mensaje cada vez: se mide cuánto tarda en llegar a todo el grupo, no la cola acumulada
+        receivers.delivered[seq].wait(120)
+        time.sleep(0.05)
+
+    for client in server.clients.values():
+        client.close()
+    for sock in sockets:
+        sock.close()
+    server.server_socket.close()
+    latencies = sorted(receivers.latencies)
+    return sorted(fanout), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de entrega de un mensaje de grupo según su tamaño")
+    parser.add_argument('--members', type=int, nargs='+', default=[500, 1000, 2000, 5000])
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--size', type=int, default=16 * 1024, help="bytes del contenido del mensaje")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'miembros':>8} {'reparto':>10} {'deliver p50':>12} {'entrega p50':>12} {'entrega p99':>12}")
+    for members in args.members:
+        for label, legacy in (("antes", True), ("ahora", False)):
+            fanout, latencies = run(members, args.messages, args.size, legacy)
+            print(f"{members:8} {label:>10} {percentile(fanout, 0.5) * 1000:9.1f} ms "
+                  f"{percentile(latencies, 0.5) * 1000:9.1f} ms {percentile(latencies, 0.99) * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from common import Session, free_port  # noqa: E402
+from file_transfer import FileDownload, open_data_channel, receive_file_parallel, send_file_chunks  # noqa: E402
+from framing import parse_file_chunk  # noqa: E402
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Interrupted(Exception):
+    pass
+
+
+def server_cpu(pid):
+    # Tiempo de CPU (usuario + sistema) del proceso servidor (solo Linux)
+    with open(f'/proc/{pid}/stat') as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def write_chunk(download, payload):
+    _, offset, data = parse_file_chunk(payload)
+    download.write_at(offset, data)
+
+
+def download(port, token, available, directory, stop_at=None, channels=1):
+    target = FileDownload(directory, available['file_id'], available['file_name'], available['size'])
+
+    def handle_chunk(target, payload):
+        write_chunk(target, payload)
+        if stop_at is not None and target.received >= stop_at:
+            raise Interrupted()
+
+    sockets = [open_data_channel('localhost', port, token) for _ in range(channels)]
+    try:
+        receive_file_parallel(sockets, target, 1, available['file_id'], handle_chunk)
+    except Interrupted:
+        target.close()
+        return None
+    finally:
+        for sock in sockets:
+            sock.close()
+    return target.finish()
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Descarga de un archivo recibido: MB/s y CPU del servidor con "
+                                                 "sendfile por 1 o varias conexiones, y reanudación tras un corte")
+    parser.add_argument('--size', type=int, default=1024, help="tamaño del archivo en MB")
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 4], help="conexiones de datos por descarga")
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    workdir = tempfile.mkdtemp(prefix='bench-download-')
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py'), '--engine', args.engine, '--port',
+                               str(port)], cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        file_path = os.path.join(workdir, 'origen.bin')
+        with open(file_path, 'wb') as file:
+            for _ in range(0, size, CHUNK_SIZE):
+                file.write(os.urandom(CHUNK_SIZE))
+        expected = sha256_of(file_path)
+        time.sleep(1.0)
+        # El usuario se envía el archivo a sí mismo y luego lo descarga
+        session = Session(port, 'usuario')
+        with open(file_path, 'rb') as file:
+            chunk_hashes = [hashlib.sha256(file.read(CHUNK_SIZE)).hexdigest() for _ in range(0, size, CHUNK_SIZE)]
+        session.send({'type': 'file_start', 'transfer_id': 1, 'recipient': 'usuario', 'file_name': 'origen.bin',
+                      'size': size, 'chunk_size': CHUNK_SIZE, 'chunk_hashes': chunk_hashes})
+        missing = session.wait_for(lambda data: data['type'] == 'file_status')['missing']
+        send_file_chunks([session.sock], file_path, 1, CHUNK_SIZE, size, missing)
+        available = session.wait_for(lambda data: data['type'] == 'file_available')
+
+        print(f"--- descarga de {args.size} MB por loopback (motor {args.engine})")
+        print(f"{'conexiones':>10} {'ronda':>6} {'tiempo':>10} {'MB/s':>10} {'CPU servidor':>13}")
+        for channels in args.channels:
+            for round_number in range(1, args.rounds + 1):
+                directory = tempfile.mkdtemp(dir=workdir)
+                cpu_start = server_cpu(server.pid)
+                start = time.perf_counter()
+                path = download(port, session.token, available, directory, channels=channels)
+                elapsed = time.perf_counter() - start
+                cpu = server_cpu(server.pid) - cpu_start
+                if sha256_of(path) != expected:
+                    raise ValueError(f"Descarga con {channels} conexiones distinta del original")
+                print(f"{channels:10} {round_number:6} {elapsed:8.2f} s {args.size / elapsed:10.1f} {cpu:11.2f} s")
+                shutil.rmtree(directory)
+
+        # Se corta con la mitad recibida por varias conexiones y se reanuda: solo se piden los tramos que faltan
+        channels = max(args.channels)
+        directory = tempfile.mkdtemp(dir=workdir)
+        download(port, session.token, available, directory, stop_at=size // 2, channels=channels)
+        start = time.perf_counter()
+        path = download(port, session.token, available, directory, channels=channels)
+        elapsed = time.perf_counter() - start
+        print(f"reanudada desde la mitad: {elapsed:.2f} s, "
+              f"{'contenido idéntico' if sha256_of(path) == expected else 'CONTENIDO DISTINTO'}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from common import free_port  # noqa: E402
+from framing import (CAPABILITIES, FLAG_CODEC_MASK, FRAME_HELLO, FRAME_MESSAGE, PREAMBLE, PROTOCOL_V2,  # noqa: E402
+                     BinaryFrameReader, encode_file_chunk_header, encode_frame, encode_preamble, frame_message,
+                     recv_exact, send_buffers)
+from message_codec import CODEC_JSON, get_codec  # noqa: E402
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def connect(port, username):
+    sock = socket.create_connection(('localhost', port))
+    codec = get_codec(CODEC_JSON)
+    hello = {'username': username, 'capabilities': CAPABILITIES}
+    sock.sendall(encode_preamble(PROTOCOL_V2, CODEC_JSON) + encode_frame(FRAME_HELLO, codec.encode(hello)))
+    recv_exact(sock, PREAMBLE.size)
+    return sock
+
+
+def wait_for_file(sock, file_name, done, available):
+    # El servidor avisa al destinatario (aquí, el propio emisor) cuando el archivo está completo en disco
+    reader = BinaryFrameReader(sock)
+    try:
+        while True:
+            reader.fill()
+            for frame in reader.frames():
+                if frame.type != FRAME_MESSAGE:
+                    continue
+                data = get_codec(frame.flags & FLAG_CODEC_MASK).decode(frame.payload)
+                if data['type'] == 'file_available' and data['file_name'] == file_name:
+                    available.append(data)
+                    done.set()
+                    return
+    except (ConnectionError, OSError):
+        return
+
+
+def send_json_chunks(sock, username, file_name, block, size):
+    # Camino anterior: cada chunk va en base64 dentro de un mensaje JSON
+    total_chunks = (size - 1) // CHUNK_SIZE + 1
+    for chunk_number in range(total_chunks):
+        chunk = block[:min(CHUNK_SIZE, size - chunk_number * CHUNK_SIZE)]
+        data = {
+            'type': 'file_chunk',
+            'recipient': username,
+            'file_name': file_name,
+            'chunk_number': chunk_number,
+            'total_chunks': total_chunks,
+            'content': base64.b64encode(chunk).decode('utf-8')
+        }
+        sock.sendall(frame_message(json.dumps(data).encode('utf-8'), PROTOCOL_V2))
+
+
+def send_binary_chunks(sock, username, file_name, block, size):
+    # Con manifiesto, como el cliente: el servidor comprueba el hash de cada chunk antes de escribirlo
+    chunk_hashes = []
+    for offset in range(0, size, CHUNK_SIZE):
+        chunk_hashes.append(hashlib.sha256(block[:min(CHUNK_SIZE, size - offset)]).hexdigest())
+    start = {'type': 'file_start', 'transfer_id': 1, 'recipient': username, 'file_name': file_name, 'size': size,
+             'chunk_size': CHUNK_SIZE, 'chunk_hashes': chunk_hashes}
+    sock.sendall(frame_message(json.dumps(start).encode('utf-8'), PROTOCOL_V2))
+    offset = 0
+    while offset < size:
+        chunk = block[:min(CHUNK_SIZE, size - offset)]
+        send_buffers(sock, [encode_file_chunk_header(1, offset, len(chunk)), chunk])
+        offset += len(chunk)
+
+
+def peak_rss(pid):
+    # Pico de memoria residente del proceso servidor (solo Linux)
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float('nan')
+
+
+def run(send, size, workdir, engine):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py'), '--engine', engine, '--port', str(port)],
+                              cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1.0)
+        username = 'emisor'
+        file_name = f'{send.__name__}.bin'
+        sock = connect(port, username)
+        done = threading.Event()
+        available = []
+        threading.Thread(target=wait_for_file, args=(sock, file_name, done, available), daemon=True).start()
+        # Siempre el mismo bloque aleatorio: se mide el protocolo, no la lectura del archivo de origen
+        block = os.urandom(CHUNK_SIZE)
+        start_time = time.perf_counter()
+        cpu_start = time.process_time()
+        send(sock, username, file_name, block, size)
+        cpu = time.process_time() - cpu_start
+        if not done.wait(600):
+            raise TimeoutError("El servidor no confirmó el archivo")
+        elapsed = time.perf_counter() - start_time
+        sock.close()
+        stored = available[0]['size']
+        if stored != size:
+            raise ValueError(f"El archivo guardado tiene {stored} bytes, se enviaron {size}")
+        return elapsed, cpu, peak_rss(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MB/s al enviar un archivo por loopback: base64/JSON vs "
+                                                 "frames binarios")
+    parser.add_argument('--size', type=int, default=1024, help="tamaño del archivo en MB")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    workdir = tempfile.mkdtemp(prefix='bench-files-')
+    try:
+        print(f"{'camino':>22} {'tiempo':>10} {'MB/s':>10} {'CPU cliente':>12} {'RSS servidor':>13}")
+        for label, send in (("base64 + JSON", send_json_chunks), ("frames binarios", send_binary_chunks)):
+            elapsed, cpu, rss = run(send, size, workdir, args.engine)
+            print(f"{label:>22} {elapsed:8.1f} s {args.size / elapsed:10.1f} {cpu:10.1f} s {rss:10.0f} MB")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
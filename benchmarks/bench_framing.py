@@ -0,0 +1,103 @@
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from framing import FrameReader  # noqa: E402
+
+RECV_CHUNK = 4096
+
+
+def make_stream(frame_size, count):
+    line = b'x' * (frame_size - 1) + b'\n'
+    return line * count
+
+
+def split_reader(chunks):
+    # Implementación anterior: concatenar y partir el buffer completo en cada recv
+    frames = 0
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        while b'\n' in buffer:
+            message, buffer = buffer.split(b'\n', 1)
+            frames += 1
+    return frames
+
+
+def frame_reader(chunks):
+    frames = 0
+    reader = FrameReader()
+    for chunk in chunks:
+        reader.feed(chunk)
+        for _ in reader.frames():
+            frames += 1
+    return frames
+
+
+def bench_memory(name, stream, parser):
+    chunks = [stream[i:i + RECV_CHUNK] for i in range(0, len(stream), RECV_CHUNK)]
+    start = time.perf_counter()
+    frames = parser(chunks)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {frames:>7} frames  {len(stream) / elapsed / 1e6:10.1f} MB/s")
+
+
+def bench_socket(name, stream, use_frame_reader):
+    left, right = socket.socketpair()
+
+    def writer():
+        left.sendall(stream)
+        left.close()
+
+    threading.Thread(target=writer, daemon=True).start()
+    frames = 0
+    start = time.perf_counter()
+    if use_frame_reader:
+        reader = FrameReader(right)
+        try:
+            while True:
+                reader.fill()
+                for _ in reader.frames():
+                    frames += 1
+        except ConnectionError:
+            pass
+    else:
+        buffer = b""
+        while True:
+            chunk = right.recv(RECV_CHUNK)
+            if not chunk:
+                break
+            buffer += chunk
+            while b'\n' in buffer:
+                message, buffer = buffer.split(b'\n', 1)
+                frames += 1
+    elapsed = time.perf_counter() - start
+    right.close()
+    print(f"{name:<28} {frames:>7} frames  {len(stream) / elapsed / 1e6:10.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rendimiento del lector de frames delimitados por salto de línea")
+    parser.add_argument('--chat-lines', type=int, default=20000)
+    parser.add_argument('--file-frames', type=int, default=8)
+    args = parser.parse_args()
+
+    cases = [
+        ("chat 1 KB", make_stream(1024, args.chat_lines)),
+        ("archivo 1.4 MB", make_stream(1400 * 1024, args.file_frames)),
+    ]
+    for label, stream in cases:
+        print(f"--- {label} ({len(stream) / 1e6:.1f} MB, trozos de {RECV_CHUNK} bytes)")
+        bench_memory("split (memoria)", stream, split_reader)
+        bench_memory("FrameReader (memoria)", stream, frame_reader)
+        bench_socket("recv + split (socketpair)", stream, False)
+        bench_socket("recv_into (socketpair)", stream, True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from common import free_port  # noqa: E402
+from framing import (FLAG_CODEC_MASK, FRAME_HELLO, FRAME_MESSAGE, PREAMBLE, PROTOCOL_V2, BinaryFrameReader,  # noqa: E402
+                     CAPABILITIES, encode_frame, encode_preamble, frame_message)
+from message_codec import CODEC_JSON, get_codec  # noqa: E402
+
+IMAGE = ''
+
+
+async def login_v1(port, username):
+    reader, writer = await asyncio.open_connection('localhost', port)
+    # Igual que el cliente v1: nombre, imagen y primer mensaje en escrituras separadas sin esperar respuesta
+    writer.write(username.encode('utf-8'))
+    await writer.drain()
+    writer.write(IMAGE.encode('utf-8'))
+    await writer.drain()
+    message = {'type': 'message', 'recipient': username, 'content': 'hola'}
+    writer.write(json.dumps(message).encode('utf-8') + b'\n')
+    await writer.drain()
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Servidor cerró la conexión")
+        # Las listas de usuarios se ignoran sin decodificarlas: el benchmark comparte CPU con el servidor
+        if line.startswith(b'{"type": "message"'):
+            writer.close()
+            return
+
+
+async def login_v2(port, username):
+    reader, writer = await asyncio.open_connection('localhost', port)
+    codec = get_codec(CODEC_JSON)
+    hello = {'username': username, 'capabilities': CAPABILITIES,
+             'avatar_hash': hashlib.sha256(base64.b64decode(IMAGE)).hexdigest()}
+    message = {'type': 'message', 'recipient': username, 'content': 'hola'}
+    writer.write(encode_preamble(PROTOCOL_V2, CODEC_JSON) + encode_frame(FRAME_HELLO, codec.encode(hello)) +
+                 frame_message(codec.encode(message), PROTOCOL_V2))
+    await writer.drain()
+    await reader.readexactly(PREAMBLE.size)
+    frames = BinaryFrameReader()
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            raise ConnectionError("Servidor cerró la conexión")
+        frames.feed(chunk)
+        for frame in frames.frames():
+            if frame.type != FRAME_MESSAGE or frame.payload.startswith(b'{"type": "user_'):
+                continue
+            data = get_codec(frame.flags & FLAG_CODEC_MASK).decode(frame.payload)
+            if data['type'] == 'avatar_request':
+                writer.write(frame_message(codec.encode({'type': 'profile_image', 'image': IMAGE}), PROTOCOL_V2))
+            elif data['type'] == 'message':
+                writer.close()
+                return
+
+
+async def timed(login, port, username, timeout):
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(login(port, username), timeout)
+        return time.perf_counter() - start
+    except (asyncio.TimeoutError, ConnectionError, OSError, ValueError):
+        return None
+
+
+async def storm(login, port, clients, timeout):
+    results = await asyncio.gather(*(timed(login, port, f'usuario{i}', timeout) for i in range(clients)))
+    return [result for result in results if result is not None]
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia conexión → primer mensaje durante una avalancha de logins")
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='asyncio')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--image-size', type=int, default=64,
+                        help="bytes de la imagen de perfil; cada login reenvía la lista completa con imágenes")
+    args = parser.parse_args()
+
+    global IMAGE
+    IMAGE = base64.b64encode(os.urandom(args.image_size)).decode('utf-8')
+
+    for label, login in (("v1 (dos lecturas sin delimitar)", login_v1), ("v2 (hello con pipelining)", login_v2)):
+        port = free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py'), '--engine', args.engine,
+                                   '--port', str(port), '--backlog', '4096'],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            time.sleep(1.0)
+            start = time.perf_counter()
+            latencies = sorted(asyncio.run(storm(login, port, args.clients, args.timeout)))
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"--- {label}, motor {args.engine}, {args.clients} clientes en {elapsed:.1f}s")
+        print(f"completados: {len(latencies)}/{args.clients}")
+        if latencies:
+            print(f"p50 {percentile(latencies, 0.5) * 1000:.0f} ms  p95 {percentile(latencies, 0.95) * 1000:.0f} ms  "
+                  f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms  máx {latencies[-1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from common import LatencyProxy, Session, free_port  # noqa: E402
+from file_transfer import open_data_channel, send_file_chunks  # noqa: E402
+
+CHUNK_SIZE = 256 * 1024
+
+
+def upload(port, channels, file_path, size, transfer_id):
+    session = Session(port, f'emisor{transfer_id}')
+    file_name = os.path.basename(file_path)
+    with open(file_path, 'rb') as file:
+        chunk_hashes = [hashlib.sha256(file.read(CHUNK_SIZE)).hexdigest() for _ in range(0, size, CHUNK_SIZE)]
+    start = time.perf_counter()
+    session.send({'type': 'file_start', 'transfer_id': transfer_id, 'recipient': f'emisor{transfer_id}',
+                  'file_name': file_name, 'size': size, 'chunk_size': CHUNK_SIZE, 'chunk_hashes': chunk_hashes})
+    missing = session.wait_for(lambda data: data['type'] == 'file_status')['missing']
+    if channels > 1:
+        sockets = [open_data_channel('localhost', port, session.token) for _ in range(channels)]
+    else:
+        sockets = [session.sock]
+    send_file_chunks(sockets, file_path, transfer_id, CHUNK_SIZE, size, missing)
+    session.wait_for(lambda data: data['type'] == 'file_available' and data['file_name'] == file_name)
+    elapsed = time.perf_counter() - start
+    for sock in sockets:
+        sock.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Subida de un archivo con K conexiones a través de un proxy "
+                                                 "con latencia")
+    parser.add_argument('--size', type=int, default=32, help="tamaño del archivo en MB")
+    parser.add_argument('--rtt', type=float, default=40.0, help="tiempo de ida y vuelta añadido, en ms")
+    parser.add_argument('--window', type=int, default=256, help="KB sin confirmar por conexión y sentido")
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    workdir = tempfile.mkdtemp(prefix='bench-parallel-')
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py'), '--engine', args.engine, '--port',
+                               str(port)], cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        file_path = os.path.join(workdir, 'origen.bin')
+        with open(file_path, 'wb') as file:
+            file.write(os.urandom(size))
+        time.sleep(1.0)
+        proxy = LatencyProxy(port, args.rtt / 2000, args.window * 1024)
+        proxy.start()
+        print(f"--- {args.size} MB, RTT {args.rtt:.0f} ms, ventana {args.window} KB "
+              f"(máximo teórico por conexión: {args.window / 1024 / (args.rtt / 1000):.1f} MB/s)")
+        print(f"{'conexiones':>10} {'tiempo':>10} {'MB/s':>10}")
+        for transfer_id, channels in enumerate(args.channels, 1):
+            elapsed = upload(proxy.port, channels, file_path, size, transfer_id)
+            print(f"{channels:10} {elapsed:8.2f} s {args.size / elapsed:10.1f}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from framing import FLAG_CODEC_MASK, FRAME_MESSAGE, PROTOCOL_V2, BinaryFrameReader  # noqa: E402
+from message_codec import CODEC_JSON, get_codec  # noqa: E402
+from outbound import OutboundLimits, OutboundStats, QueuedClient  # noqa: E402
+
+
+def slow_reader(sock, rate, arrivals, done):
+    # Un destinatario con un enlace lento: lee como mucho rate bytes por segundo
+    reader = BinaryFrameReader(sock, recv_size=64 * 1024)
+    start = time.perf_counter()
+    received = 0
+    try:
+        while not done.is_set():
+            received += reader.fill()
+            for frame in reader.frames():
+                if frame.type == FRAME_MESSAGE:
+                    data = get_codec(frame.flags & FLAG_CODEC_MASK).decode(frame.payload)
+                    if data['type'] == 'message':
+                        arrivals[data['content']] = time.perf_counter()
+            ahead = received / rate - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+    except (ConnectionError, OSError):
+        return
+
+
+def run(bulk_kind, bulk_mb, rate, messages, interval):
+    server_side, client_side = socket.socketpair()
+    stats = OutboundStats()
+    limits = OutboundLimits(max_bytes=1 << 40, max_frames=1 << 30)
+    client = QueuedClient(server_side, 'destinatario', limits, stats, PROTOCOL_V2, CODEC_JSON)
+    client.start()
+    arrivals = {}
+    done = threading.Event()
+    threading.Thread(target=slow_reader, args=(client_side, rate, arrivals, done), daemon=True).start()
+    codec = get_codec(CODEC_JSON)
+    # Avatares o chunks de archivo ya encolados para este destinatario
+    bulk = codec.encode({'type': 'avatar', 'image': 'x' * (256 * 1024)})
+    for _ in range(bulk_mb * 4):
+        client.send(bulk, bulk_kind)
+    sent = {}
+    for number in range(messages):
+        sent[str(number)] = time.perf_counter()
+        client.send(codec.encode({'type': 'message', 'sender': 'emisor', 'content': str(number)}), 'chat')
+        time.sleep(interval)
+    deadline = time.perf_counter() + bulk_mb * 1024 * 1024 / rate * 2 + 5
+    while len(arrivals) < messages and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    done.set()
+    client.close()
+    server_side.close()
+    client_side.close()
+    latencies = sorted((arrivals[number] - sent[number]) * 1000 for number in sent if number in arrivals)
+    return latencies, stats.delay_snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de los mensajes del chat con MB de datos masivos en la "
+                                                 "cola de salida: una sola cola FIFO vs clases de prioridad")
+    parser.add_argument('--bulk', type=int, default=16, help="MB masivos encolados delante del chat")
+    parser.add_argument('--rate', type=float, default=20, help="MB/s que lee el destinatario")
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.02, help="segundos entre mensajes del chat")
+    args = parser.parse_args()
+    rate = args.rate * 1024 * 1024
+
+    print(f"--- {args.bulk} MB masivos en cola, destinatario a {args.rate:.0f} MB/s")
+    print(f"{'cola':>22} {'mensajes':>9} {'p50 ms':>9} {'p99 ms':>9} {'máx ms':>9}")
+    for label, bulk_kind in (("FIFO (todo 'chat')", 'chat'), ("prioridades ('file')", 'file')):
+        latencies, delays = run(bulk_kind, args.bulk, rate, args.messages, args.interval)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{label:>22} {len(latencies):9} {statistics.median(latencies):9.1f} {p99:9.1f} "
+              f"{latencies[-1]:9.1f}")
+        print(f"{'':>22} espera en cola por clase: {delays}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from framing import PROTOCOL_V1, PROTOCOL_V2, BinaryFrameReader, FrameReader, frame_message  # noqa: E402
+from message_codec import CODECS  # noqa: E402
+
+RECV_CHUNK = 4096
+
+
+def chat_message():
+    return {'type': 'message', 'sender': 'alice', 'content': 'Hola, ¿nos vemos a las cinco en la sala 3?'}
+
+
+def file_message():
+    chunk = os.urandom(1024 * 1024)
+    return {'type': 'file_chunk', 'recipient': 'bob', 'file_name': 'informe.pdf', 'chunk_number': 0,
+            'total_chunks': 12, 'content': base64.b64encode(chunk).decode('utf-8')}
+
+
+def user_list_message(users=200, image_size=2048):
+    image = base64.b64encode(os.urandom(image_size)).decode('utf-8')
+    return {'type': 'user_list', 'users': [{'username': f'usuario{i}', 'profile_image': image}
+                                           for i in range(users)]}
+
+
+def encode(message, version):
+    return frame_message(json.dumps(message).encode('utf-8'), version)
+
+
+def decode(stream, version):
+    reader = BinaryFrameReader() if version >= PROTOCOL_V2 else FrameReader()
+    messages = []
+    for offset in range(0, len(stream), RECV_CHUNK):
+        reader.feed(stream[offset:offset + RECV_CHUNK])
+        for frame in reader.frames():
+            payload = frame.payload if version >= PROTOCOL_V2 else frame
+            messages.append(json.loads(payload))
+    return messages
+
+
+def measure(message, version, repeat):
+    start = time.process_time()
+    frames = [encode(message, version) for _ in range(repeat)]
+    encode_time = time.process_time() - start
+    stream = b"".join(frames)
+    start = time.process_time()
+    decoded = decode(stream, version)
+    decode_time = time.process_time() - start
+    assert len(decoded) == repeat
+    return len(frames[0]), encode_time / repeat, decode_time / repeat
+
+
+def measure_codec(message, codec, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        payload = codec.encode(message)
+    encode_time = time.process_time() - start
+    start = time.process_time()
+    for _ in range(repeat):
+        codec.decode(payload)
+    decode_time = time.process_time() - start
+    return len(payload), encode_time / repeat, decode_time / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparación de bytes y CPU por mensaje entre protocolos")
+    parser.add_argument('--repeat', type=int, default=0, help="mensajes por caso (0 = automático)")
+    args = parser.parse_args()
+
+    cases = [
+        ("chat", chat_message(), args.repeat or 20000),
+        ("archivo (chunk 1 MB)", file_message(), args.repeat or 20),
+        ("user_list (200 usuarios)", user_list_message(), args.repeat or 50),
+    ]
+    print(f"{'caso':<26} {'protocolo':<10} {'bytes/msg':>12} {'encode µs':>12} {'decode µs':>12}")
+    for label, message, repeat in cases:
+        for version in (PROTOCOL_V1, PROTOCOL_V2):
+            size, encode_time, decode_time = measure(message, version, repeat)
+            print(f"{label:<26} {'v' + str(version):<10} {size:>12} {encode_time * 1e6:>12.1f} "
+                  f"{decode_time * 1e6:>12.1f}")
+
+    print()
+    print(f"{'caso':<26} {'códec':<10} {'bytes/msg':>12} {'encode µs':>12} {'decode µs':>12}")
+    for label, message, repeat in cases:
+        for codec in CODECS.values():
+            size, encode_time, decode_time = measure_codec(message, codec, repeat)
+            print(f"{label:<26} {codec.name:<10} {size:>12} {encode_time * 1e6:>12.1f} {decode_time * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from blob_store import BlobStore, StorageLimits  # noqa: E402
+
+
+def populate(directory, files, size):
+    # Un objeto por archivo y una entrega por objeto, repartidos entre 100 remitentes
+    store = BlobStore(directory)
+    data = os.urandom(size)
+    for number in range(files):
+        temp_path = os.path.join(directory, 'subida.part')
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(data)
+        content_id = hashlib.sha256(str(number).encode()).hexdigest()
+        store.add(temp_path, content_id, f"usuario{number % 100}", 'destino', f"archivo{number}.bin")
+    store.db.close()
+
+
+def walk(directory):
+    # Lo que haría un arranque sin índice: listar el directorio y leer el tamaño de cada archivo
+    total = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            total += os.stat(os.path.join(root, name)).st_size
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arranque del almacén de archivos recibidos con índice frente a "
+                                                 "recorrer el directorio, y coste de una pasada de expulsión")
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--size', type=int, default=1024, help="bytes por archivo")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-storage-')
+    try:
+        started = time.perf_counter()
+        populate(directory, args.files, args.size)
+        print(f"--- {args.files} archivos de {args.size} bytes ({time.perf_counter() - started:.1f} s en crearlos)")
+        # Vaciar la caché de páginas requiere root: los dos arranques se miden con la caché caliente
+        started = time.perf_counter()
+        walk(directory)
+        print(f"{'recorrer el directorio':>30} {(time.perf_counter() - started) * 1000:9.1f} ms")
+        started = time.perf_counter()
+        store = BlobStore(directory)
+        stats = store.stats()
+        print(f"{'abrir el índice y contar':>30} {(time.perf_counter() - started) * 1000:9.1f} ms "
+              f"({stats['objects']} objetos)")
+        started = time.perf_counter()
+        store.evict()
+        print(f"{'expulsión sin nada que borrar':>30} {(time.perf_counter() - started) * 1000:9.1f} ms")
+        # Cuota por usuario a la mitad de lo que ocupa cada uno: se expulsa la mitad más antigua
+        store.limits = StorageLimits(max_user_bytes=args.files // 100 * args.size // 2)
+        started = time.perf_counter()
+        evicted = store.evict()
+        print(f"{'expulsión por cuota':>30} {(time.perf_counter() - started) * 1000:9.1f} ms "
+              f"({evicted} entregas borradas)")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import hashlib
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from common import LatencyProxy, Session, free_port  # noqa: E402
+from file_transfer import send_file_chunks  # noqa: E402
+from framing import CAPABILITIES  # noqa: E402
+
+CHUNK_SIZE = 256 * 1024
+
+
+def run(proxy_port, port, file_path, size, capabilities, interval, run_number):
+    receiver = Session(port, f'receptor{run_number}', CAPABILITIES)
+    sender = Session(proxy_port, f'emisor{run_number}', capabilities)
+    with open(file_path, 'rb') as file:
+        chunk_hashes = [hashlib.sha256(file.read(CHUNK_SIZE)).hexdigest() for _ in range(0, size, CHUNK_SIZE)]
+    sender.send({'type': 'file_start', 'transfer_id': 1, 'recipient': f'receptor{run_number}',
+                 'file_name': 'origen.bin', 'size': size, 'chunk_size': CHUNK_SIZE, 'chunk_hashes': chunk_hashes})
+    missing = sender.wait_for(lambda data: data['type'] == 'file_status')['missing']
+    done = threading.Event()
+    sent = {}
+
+    def chat():
+        # Mensajes cortos del mismo usuario mientras sube el archivo por la misma conexión
+        number = 0
+        while not done.is_set():
+            sent[str(number)] = time.perf_counter()
+            sender.send({'type': 'message', 'recipient': f'receptor{run_number}', 'content': str(number)})
+            number += 1
+            time.sleep(interval)
+
+    window = sender.streams.open() if sender.streams else None
+    start = time.perf_counter()
+    chat_thread = threading.Thread(target=chat, daemon=True)
+    chat_thread.start()
+    send_file_chunks([sender.sock], file_path, 1, CHUNK_SIZE, size, missing, sender.send_lock, window)
+    receiver.wait_for(lambda data: data['type'] == 'file_available')
+    elapsed = time.perf_counter() - start
+    done.set()
+    chat_thread.join()
+    time.sleep(2.0)
+    latencies = [(data['arrived'] - sent[data['content']]) * 1000 for data in receiver.messages
+                 if data['type'] == 'message' and data['content'] in sent]
+    sender.sock.close()
+    receiver.sock.close()
+    return elapsed, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de los mensajes del chat mientras el mismo usuario sube "
+                                                 "un archivo por su conexión, con y sin streams con ventana")
+    parser.add_argument('--size', type=int, default=32, help="tamaño del archivo en MB")
+    parser.add_argument('--rtt', type=float, default=40.0, help="tiempo de ida y vuelta añadido, en ms")
+    parser.add_argument('--window', type=int, default=256, help="KB sin confirmar por sentido en el proxy")
+    parser.add_argument('--interval', type=float, default=0.1, help="segundos entre mensajes del chat")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    workdir = tempfile.mkdtemp(prefix='bench-streams-')
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(SRC, 'server.py'), '--engine', args.engine, '--port',
+                               str(port)], cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        file_path = os.path.join(workdir, 'origen.bin')
+        with open(file_path, 'wb') as file:
+            file.write(os.urandom(size))
+        time.sleep(1.0)
+        proxy = LatencyProxy(port, args.rtt / 2000, args.window * 1024)
+        proxy.start()
+        print(f"--- {args.size} MB por la conexión del chat, RTT {args.rtt:.0f} ms, ventana del proxy "
+              f"{args.window} KB")
+        print(f"{'modo':>14} {'subida':>9} {'mensajes':>9} {'p50 ms':>9} {'p99 ms':>9} {'máx ms':>9}")
+        without_streams = [name for name in CAPABILITIES if name != 'streams']
+        modes = (("sin streams", without_streams), ("con streams", CAPABILITIES))
+        for run_number, (label, capabilities) in enumerate(modes, 1):
+            elapsed, latencies = run(proxy.port, port, file_path, size, capabilities, args.interval, run_number)
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(f"{label:>14} {elapsed:7.1f} s {len(latencies):9} {statistics.median(latencies):9.0f} "
+                  f"{p99:9.0f} {latencies[-1]:9.0f}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
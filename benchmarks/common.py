@@ -0,0 +1,136 @@
+import asyncio
+import socket
+import threading
+import time
+
+from framing import (CAPABILITIES, FLAG_CODEC_MASK, FRAME_HELLO, FRAME_MESSAGE, FRAME_WINDOW_UPDATE, PREAMBLE,
+                     PROTOCOL_V2, BinaryFrameReader, encode_frame, encode_preamble, frame_message, parse_window_update,
+                     recv_exact)
+from message_codec import CODEC_JSON, get_codec
+from streams import StreamWindows
+
+# Utilidades compartidas por los benchmarks; cada script añade src/ a sys.path antes de importarlas
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+class Session:
+    # Sesión v2 con códec JSON: guarda cada mensaje recibido con su hora de llegada ('arrived')
+    def __init__(self, port, username, capabilities=CAPABILITIES):
+        self.port = port
+        self.sock = socket.create_connection(('localhost', port))
+        self.codec = get_codec(CODEC_JSON)
+        self.send_lock = threading.Lock()
+        self.messages = []
+        self.arrived = threading.Condition()
+        self.streams = None
+        hello = {'username': username, 'capabilities': capabilities}
+        self.sock.sendall(encode_preamble(PROTOCOL_V2, CODEC_JSON) +
+                          encode_frame(FRAME_HELLO, self.codec.encode(hello)))
+        recv_exact(self.sock, PREAMBLE.size)
+        threading.Thread(target=self.read_loop, daemon=True).start()
+        welcome = self.wait_for(lambda data: data['type'] == 'welcome')
+        self.token = welcome.get('session_token')
+        if welcome.get('stream_window'):
+            self.streams = StreamWindows(welcome['stream_window'])
+
+    def read_loop(self):
+        reader = BinaryFrameReader(self.sock)
+        try:
+            while True:
+                reader.fill()
+                for frame in reader.frames():
+                    if frame.type == FRAME_WINDOW_UPDATE:
+                        self.streams.release(frame.stream_id, parse_window_update(frame.payload))
+                    elif frame.type == FRAME_MESSAGE:
+                        data = get_codec(frame.flags & FLAG_CODEC_MASK).decode(frame.payload)
+                        data['arrived'] = time.perf_counter()
+                        with self.arrived:
+                            self.messages.append(data)
+                            self.arrived.notify_all()
+        except (ConnectionError, OSError):
+            return
+
+    def wait_for(self, match, timeout=600):
+        with self.arrived:
+            if not self.arrived.wait_for(lambda: any(match(data) for data in self.messages), timeout):
+                raise TimeoutError("El servidor no respondió")
+            return next(data for data in self.messages if match(data))
+
+    def send(self, data):
+        frame = frame_message(self.codec.encode(data), PROTOCOL_V2)
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+
+class LatencyProxy:
+    # Cada sentido de cada conexión se retrasa delay segundos y admite como mucho window bytes sin confirmar:
+    # como una conexión TCP real con mucha latencia, su caudal queda limitado a window / RTT
+    def __init__(self, target_port, delay, window):
+        self.target_port = target_port
+        self.delay = delay
+        self.window = window
+        self.port = free_port()
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.loop.run_until_complete, args=(self.serve(),), daemon=True).start()
+        self.ready.wait()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, 'localhost', self.port)
+        self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection('localhost', self.target_port)
+        await asyncio.gather(self.pipe(client_reader, server_writer), self.pipe(server_reader, client_writer))
+
+    async def pipe(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        released = asyncio.Event()
+        in_flight = 0
+
+        def release(size):
+            nonlocal in_flight
+            in_flight -= size
+            released.set()
+
+        async def deliver():
+            while True:
+                deliver_at, data = await queue.get()
+                await asyncio.sleep(max(0, deliver_at - loop.time()))
+                if data is None:
+                    writer.close()
+                    return
+                writer.write(data)
+                await writer.drain()
+                # La ventana se libera cuando el ACK llegaría al emisor: otro retardo de ida
+                loop.call_later(self.delay, release, len(data))
+
+        task = asyncio.create_task(deliver())
+        try:
+            while True:
+                while in_flight >= self.window:
+                    released.clear()
+                    await released.wait()
+                data = await reader.read(min(64 * 1024, self.window))
+                if not data:
+                    break
+                in_flight += len(data)
+                queue.put_nowait((loop.time() + self.delay, data))
+        except ConnectionError:
+            pass
+        queue.put_nowait((loop.time() + self.delay, None))
+        try:
+            await task
+        except ConnectionError:
+            # El otro extremo cerró mientras quedaban datos por entregar
+            pass
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+
+from file_transfer import file_range_frames
+from framing import (FRAME_MESSAGE, PREAMBLE, PROTOCOL_V1, PROTOCOL_V2, RECV_SIZE, BinaryFrameReader, FrameReader,
+                     encode_preamble, frame_message, is_preamble_start, negotiate_version, parse_preamble)
+from message_codec import CODEC_JSON, choose_codec, get_codec
+from outbound import OutboundQueue
+from server import ChatServer
+
+
+class StreamClient:
+    def __init__(self, writer, username, limits=None, stats=None, version=PROTOCOL_V1, codec_id=CODEC_JSON,
+                 fairness=None):
+        self.writer = writer
+        self.username = username
+        self.version = version
+        self.codec = get_codec(codec_id)
+        self.capabilities = set()
+        # Compresión negociada en el hello; None hasta enviar el welcome, que siempre va sin comprimir
+        self.compressor = None
+        # Ventanas de recepción por stream, si el cliente negoció 'streams'
+        self.streams = None
+        self.outbound = OutboundQueue(limits, stats, username, fairness)
+        self.ready = asyncio.Event()
+        self.outbound.on_ready = self.ready.set
+        self.outbound.on_overflow = writer.transport.abort
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.write_loop())
+
+    def send(self, payload, kind='chat', key=None):
+        return self.send_frame(frame_message(payload, self.version, self.codec.codec_id, self.compressor), kind,
+                               key)
+
+    def send_frame(self, data, kind='chat', key=None):
+        self.outbound.put(data, kind, key)
+        return len(data)
+
+    async def write_loop(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while True:
+                    batch = self.outbound.pop_fair_batch()
+                    if not batch and not self.outbound.frame_count:
+                        break
+                    if batch:
+                        self.writer.writelines(batch)
+                        # Solo este task espera a que el cliente lea; el resto del bucle sigue atendiendo
+                        await self.writer.drain()
+                    # drain no cede el bucle si el transporte tiene sitio: se cede aquí para que cada destinatario
+                    # escriba como mucho su déficit por vuelta
+                    await asyncio.sleep(0)
+                if self.outbound.closed:
+                    break
+        except (ConnectionError, OSError) as e:
+            logging.error(f"Error al escribir hacia {self.username}: {e}")
+            self.outbound.close()
+            self.writer.transport.abort()
+
+    def close(self):
+        self.outbound.close()
+
+
+class AsyncChatServer(ChatServer):
+    def __init__(self, host='localhost', port=14999, backlog=1024, reuse_port=False, outbound_limits=None,
+                 avatar_pipeline=None, data_port=None, fairness=None, compressions=None, storage_limits=None):
+        super().__init__(host, port, backlog, reuse_port, outbound_limits, avatar_pipeline, data_port, fairness,
+                         compressions, storage_limits)
+        self.loop = None
+
+    def start(self):
+        self.storage.start_eviction()
+        asyncio.run(self.serve())
+
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def run_blocking(self, function, *args, then=None):
+        # Una transacción del índice puede esperar a otro worker o a la expulsión: va en un hilo y el resultado
+        # vuelve al bucle
+        future = self.loop.run_in_executor(None, function, *args)
+        future.add_done_callback(lambda done: self.blocking_done(function, done, then))
+
+    def blocking_done(self, function, done, then):
+        if done.exception() is not None:
+            logging.error(f"Error en {function.__name__}: {done.exception()}")
+        elif then is not None:
+            then(done.result())
+
+    def finish_file_transfer(self, key):
+        # fsync, mover el archivo al almacén y la transacción del índice, que puede esperar a otro worker, van en
+        # un hilo: el bucle sigue atendiendo al resto de conexiones mientras tanto
+        transfer = self.file_transfers.pop(key, None)
+        if transfer is None:
+            return
+        future = self.loop.run_in_executor(None, transfer.finish, self.storage)
+        future.add_done_callback(lambda done: self.file_transfer_finished(transfer, done))
+
+    def file_transfer_finished(self, transfer, done):
+        if done.exception() is not None:
+            self.file_transfer_failed(transfer, done.exception())
+        else:
+            self.file_received(done.result())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        if self.router:
+            self.router.start()
+        self.server_socket.setblocking(False)
+        server = await asyncio.start_server(self.handle_client, sock=self.server_socket, backlog=self.backlog)
+        if self.data_socket:
+            self.data_socket.setblocking(False)
+            await asyncio.start_server(self.handle_client, sock=self.data_socket, backlog=self.backlog)
+        logging.info(f"Servidor asyncio iniciado en {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_frames_async(self, username, pending, received, handle_frame):
+        # Mismo turno DRR que el motor de hilos; el procesado no cede el bucle, así que el turno dura un chunk
+        await self.read_scheduler.acquire_async(username)
+        try:
+            for frame in pending:
+                handle_frame(username, frame)
+            self.read_scheduler.charge(username, received)
+        finally:
+            self.read_scheduler.release(username)
+
+    async def handle_data_channel_async(self, token, reader, writer, frames, pending):
+        username = self.data_channel_user(token)
+        received = 0
+        while True:
+            # Una descarga espera a sendfile: se sirve fuera del turno de lectura
+            downloads = [frame for frame in pending if frame.type == FRAME_MESSAGE]
+            uploads = [frame for frame in pending if frame.type != FRAME_MESSAGE]
+            await self.handle_frames_async(username, uploads, received, self.handle_data_frame)
+            for frame in downloads:
+                await self.serve_download_async(username, writer, frame)
+            chunk = await reader.read(RECV_SIZE)
+            if not chunk:
+                logging.info(f"Conexión de datos de {username} cerrada")
+                return
+            received = len(chunk)
+            frames.feed(chunk)
+            pending = frames.frames()
+
+    async def serve_download_async(self, username, writer, frame):
+        # La consulta al índice y el open van en un hilo, como el resto del almacenamiento
+        reply, download = await self.loop.run_in_executor(None, self.open_download, username, frame)
+        writer.write(reply)
+        if download:
+            file, download_id, offset, end = download
+            with file:
+                for header, chunk_offset, length in file_range_frames(download_id, offset, end):
+                    writer.write(header)
+                    await writer.drain()
+                    # Igual que en el motor de hilos, los datos pasan del archivo al socket con sendfile
+                    if await self.loop.sendfile(writer.transport, file, chunk_offset, length) != length:
+                        raise ConnectionError(f"Se enviaron menos de {length} bytes desde el offset {chunk_offset}")
+            logging.info(f"Descarga de {username} enviada: bytes {offset}-{end}")
+
+    async def handle_client(self, reader, writer):
+        username = None
+        client = None
+        address = writer.get_extra_info('peername')
+        logging.info(f"Conexión aceptada de {address}")
+        try:
+            first = await reader.read(1024)
+            if is_preamble_start(first):
+                if len(first) < PREAMBLE.size:
+                    first += await reader.readexactly(PREAMBLE.size - len(first))
+                version, codec_id = parse_preamble(first[:PREAMBLE.size])
+                version = negotiate_version(version)
+                codec_id = choose_codec(codec_id)
+                writer.write(encode_preamble(version, codec_id))
+                frames = BinaryFrameReader()
+                frames.feed(first[PREAMBLE.size:])
+                pending = frames.frames()
+                while not pending:
+                    chunk = await reader.read(RECV_SIZE)
+                    if not chunk:
+                        raise ConnectionError("Cliente desconectado.")
+                    frames.feed(chunk)
+                    pending = frames.frames()
+                hello = self.parse_hello(pending.pop(0))
+                if hello.get('data_channel'):
+                    await self.handle_data_channel_async(hello['data_channel'], reader, writer, frames, pending)
+                    return
+                username = hello['username']
+                profile_image = None
+            else:
+                # Cliente v1: nombre de usuario e imagen llegan sin delimitar
+                version = PROTOCOL_V1
+                codec_id = CODEC_JSON
+                username = first.decode('utf-8')
+                if not username:
+                    raise ValueError("No se recibió un nombre de usuario.")
+                profile_image = (await reader.read(1024 * 1024)).decode('utf-8')
+                hello = None
+                frames = FrameReader()
+                pending = []
+
+            logging.info(f"Usuario {username} conectado desde {address} "
+                         f"(protocolo v{version}, códec {get_codec(codec_id).name})")
+
+            client = StreamClient(writer, username, self.outbound_limits, self.outbound_stats, version, codec_id,
+                                  self.fairness)
+            client.start()
+            self.register_client(username, client, profile_image, hello)
+
+            handle_frame = self.handle_frame if version >= PROTOCOL_V2 else self.handle_line
+            received = 0
+            while True:
+                await self.handle_frames_async(username, pending, received, handle_frame)
+                chunk = await reader.read(RECV_SIZE)
+                if not chunk:
+                    raise ConnectionError("Cliente desconectado.")
+                received = len(chunk)
+
+                logging.debug(f"Recibido chunk de {username}")
+
+                frames.feed(chunk)
+                pending = frames.frames()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logging.info(f"Usuario {username} desconectado.")
+        except Exception as e:
+            logging.error(f"Error en la conexión con {username}: {e}")
+        finally:
+            if client:
+                client.close()
+            if username:
+                self.disconnect_client(username)
+            writer.close()
@@ -0,0 +1,83 @@
+import base64
+import io
+import logging
+import os
+import string
+import tempfile
+import tkinter as tk
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageTk
+
+THUMBNAIL_SIZE = 60
+
+
+def is_avatar_hash(image_hash):
+    # El hash llega del servidor y se usa como nombre de archivo: solo se aceptan sha256 en hexadecimal
+    return len(image_hash) == 64 and all(char in string.hexdigits for char in image_hash)
+
+
+def render_thumbnail(image_data, size=THUMBNAIL_SIZE):
+    image = Image.open(io.BytesIO(base64.b64decode(image_data))).convert('RGB')
+    image = image.resize((size, size), Image.Resampling.LANCZOS)
+    mask = Image.new('L', (size, size), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((0, 0, size, size), fill=255)
+    return Image.composite(image, Image.new('RGB', (size, size), (0, 0, 0)), mask)
+
+
+class AvatarCache:
+    def __init__(self, cache_dir, capacity=256, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.capacity = capacity
+        self.size = size
+        # PhotoImages ya creados, del menos al más recientemente usado
+        self.photos = OrderedDict()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def thumbnail_path(self, image_hash):
+        return os.path.join(self.cache_dir, f"{image_hash}-{self.size}.png")
+
+    def get(self, image_hash):
+        photo = self.photos.get(image_hash)
+        if photo is not None:
+            self.photos.move_to_end(image_hash)
+            return photo
+        if not is_avatar_hash(image_hash):
+            return None
+        path = self.thumbnail_path(image_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            # Tk lee el PNG directamente: la miniatura ya está recortada y redimensionada
+            photo = tk.PhotoImage(file=path)
+        except tk.TclError as e:
+            logging.warning(f"Miniatura en caché inválida {path}: {e}")
+            os.unlink(path)
+            return None
+        self.remember(image_hash, photo)
+        return photo
+
+    def put(self, image_hash, image_data):
+        thumbnail = render_thumbnail(image_data, self.size)
+        if is_avatar_hash(image_hash):
+            self.save(image_hash, thumbnail)
+        photo = ImageTk.PhotoImage(thumbnail)
+        self.remember(image_hash, photo)
+        return photo
+
+    def save(self, image_hash, thumbnail):
+        try:
+            # Escribir en un temporal y renombrar evita dejar miniaturas a medias si el cliente se cierra
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                thumbnail.save(file, format='PNG')
+            os.replace(temp_path, self.thumbnail_path(image_hash))
+        except OSError as e:
+            logging.error(f"No se pudo guardar la miniatura {image_hash}: {e}")
+
+    def remember(self, image_hash, photo):
+        self.photos[image_hash] = photo
+        self.photos.move_to_end(image_hash)
+        while len(self.photos) > self.capacity:
+            self.photos.popitem(last=False)
@@ -0,0 +1,136 @@
+import base64
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Tamaños que sirve el servidor: miniatura de la lista de usuarios y vista de perfil
+AVATAR_SIZES = {'thumbnail': 60, 'profile': 256}
+MAX_AVATAR_BYTES = 5 * 1024 * 1024
+MAX_AVATAR_PIXELS = 4096 * 4096
+JPEG_QUALITY = 85
+
+
+def avatar_hash(image_data):
+    # El hash se calcula sobre los bytes de la imagen, no sobre su codificación base64
+    return hashlib.sha256(base64.b64decode(image_data)).hexdigest()
+
+
+def normalize_avatar(image_data, sizes=AVATAR_SIZES, max_bytes=MAX_AVATAR_BYTES, max_pixels=MAX_AVATAR_PIXELS):
+    raw = base64.b64decode(image_data)
+    if len(raw) > max_bytes:
+        raise ValueError(f"Imagen de {len(raw)} bytes supera el máximo de {max_bytes}")
+    image_hash = hashlib.sha256(raw).hexdigest()
+    if Image is None:
+        # Sin Pillow se sirve la imagen original en todos los tamaños
+        return image_hash, {name: image_data for name in sizes}
+    image = Image.open(io.BytesIO(raw))
+    if image.width * image.height > max_pixels:
+        raise ValueError(f"Imagen de {image.width}x{image.height} supera el máximo de {max_pixels} píxeles")
+    # En JPEG el decodificador puede reducir la escala directamente: no se decodifica a tamaño completo
+    image.draft('RGB', (max(sizes.values()) * 2,) * 2)
+    image = image.convert('RGBA')
+    background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+    image = Image.alpha_composite(background, image).convert('RGB')
+    variants = {}
+    for name, size in sizes.items():
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        variants[name] = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return image_hash, variants
+
+
+class AvatarPipeline:
+    def __init__(self, workers=None, max_bytes=MAX_AVATAR_BYTES, max_pixels=MAX_AVATAR_PIXELS, sizes=AVATAR_SIZES):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.sizes = sizes
+        self.pool = None
+        self.lock = threading.Lock()
+        if Image is None:
+            logging.warning("Pillow no está instalado: los avatares se servirán sin normalizar")
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                if multiprocessing.current_process().daemon:
+                    # Un worker de ShardedServer no puede tener procesos hijos; ya es un proceso por núcleo
+                    self.pool = ThreadPoolExecutor(self.workers)
+                else:
+                    # spawn: el servidor ya tiene hilos en marcha y hacer fork de un proceso con hilos no es seguro
+                    self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.pool
+
+    def submit(self, image_data, on_done):
+        # Se rechaza antes de decodificar: el base64 ocupa 4/3 de los bytes de la imagen
+        if len(image_data) > (self.max_bytes + 2) // 3 * 4:
+            raise ValueError(f"Imagen de perfil de más de {self.max_bytes} bytes")
+        future = self.get_pool().submit(normalize_avatar, image_data, self.sizes, self.max_bytes, self.max_pixels)
+        future.add_done_callback(lambda done: self.finish(done, on_done))
+
+    def finish(self, future, on_done):
+        try:
+            image_hash, variants = future.result()
+        except Exception as e:
+            logging.error(f"No se pudo procesar la imagen de perfil: {e}")
+            return
+        on_done(image_hash, variants)
+
+
+class AvatarStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.images = {}
+        self.refs = Counter()
+
+    def acquire(self, image_hash, variants=None):
+        if not image_hash:
+            return False
+        with self.lock:
+            if image_hash not in self.images:
+                if not variants:
+                    return False
+                # Una imagen compartida por varios usuarios se guarda una sola vez
+                self.images[image_hash] = variants
+            self.refs[image_hash] += 1
+        return True
+
+    def release(self, image_hash):
+        if not image_hash:
+            return
+        with self.lock:
+            self.refs[image_hash] -= 1
+            if self.refs[image_hash] <= 0:
+                del self.refs[image_hash]
+                self.images.pop(image_hash, None)
+
+    def get(self, image_hash, variant='thumbnail'):
+        with self.lock:
+            return self.images.get(image_hash, {}).get(variant, '')
+
+    def variants(self, image_hash):
+        with self.lock:
+            return self.images.get(image_hash)
+
+    def __contains__(self, image_hash):
+        with self.lock:
+            return image_hash in self.images
+
+    def __len__(self):
+        with self.lock:
+            return len(self.images)
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(len(image_data) for variants in self.images.values() for image_data in variants.values())
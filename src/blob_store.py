@@ -0,0 +1,334 @@
+import contextlib
+import logging
+import os
+import secrets
+import sqlite3
+import string
+import threading
+import time
+from collections import Counter, defaultdict
+
+from file_transfer import PARTIAL_TRANSFER_TTL, file_content_id, prune_partial_transfers, remove_quietly
+
+INDEX_NAME = 'index.sqlite3'
+# Un archivo por contenido distinto, con el id de contenido como nombre: nunca se sobrescribe otro archivo
+OBJECTS_DIR = '.objects'
+# Archivos que los servidores anteriores guardaban con el nombre original: se importan al crear el índice
+LEGACY_PREFIX = 'received_'
+# Remitente y destinatario de lo importado: ningún cliente puede entrar con un nombre vacío
+LEGACY_OWNER = ''
+# Objetos ya fuera del índice a la espera de borrarse: el unlink de un archivo grande no se hace dentro de la
+# transacción, que el resto de workers esperan
+DELETED_SUFFIX = '.deleted'
+# Tamaño de chunk de los clientes al subir archivos: el contenido importado tiene el mismo id que si se subiera
+IMPORT_CHUNK_SIZE = 256 * 1024
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+DEFAULT_MAX_USER_BYTES = 2 * 1024 ** 3
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+DEFAULT_MAX_USER_TRANSFERS = 8
+EVICTION_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (content_id TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS deliveries (
+    file_id TEXT PRIMARY KEY, content_id TEXT NOT NULL, sender TEXT NOT NULL, recipient TEXT NOT NULL,
+    file_name TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS deliveries_content ON deliveries (content_id);
+CREATE TABLE IF NOT EXISTS grants (content_id TEXT NOT NULL, username TEXT NOT NULL,
+                                   PRIMARY KEY (content_id, username));
+CREATE TABLE IF NOT EXISTS reservations (
+    reservation_id TEXT PRIMARY KEY, sender TEXT NOT NULL, size INTEGER NOT NULL, updated REAL NOT NULL);
+"""
+
+
+class StorageLimits:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_user_bytes=DEFAULT_MAX_USER_BYTES, max_age=DEFAULT_MAX_AGE,
+                 interval=EVICTION_INTERVAL, max_user_transfers=DEFAULT_MAX_USER_TRANSFERS):
+        # max_bytes cuenta el disco (cada contenido una vez); max_user_bytes, el contenido distinto que envió cada
+        # usuario, así que mandar el mismo archivo a varios destinatarios no gasta más cuota. Las subidas en curso
+        # y los parciales reservan su tamaño en las dos cuotas hasta que terminan o se descartan
+        self.max_bytes = max_bytes
+        self.max_user_bytes = max_user_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.max_user_transfers = max_user_transfers
+
+
+class BlobStore:
+    # Archivos recibidos, guardados una vez por contenido, y entregas que los referencian. El índice (SQLite) es
+    # la única fuente de verdad: arrancar no recorre el directorio, y todos los workers lo comparten con
+    # transacciones BEGIN IMMEDIATE. Un objeto se borra en la misma transacción que su última entrega
+    def __init__(self, directory, limits=None):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, OBJECTS_DIR)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.limits = limits or StorageLimits()
+        index_path = os.path.join(directory, INDEX_NAME)
+        created = not os.path.exists(index_path)
+        # Una conexión por servidor, compartida por sus hilos bajo el lock; las transacciones se abren a mano
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(index_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self.evicted = 0
+        self.wake = threading.Event()
+        if created:
+            self.import_legacy()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def path(self, content_id):
+        return os.path.join(self.objects_dir, content_id)
+
+    def delivered(self, file_id, content_id, sender, recipient, file_name, size):
+        return {
+            'file_id': file_id,
+            'file_name': file_name,
+            'sender': sender,
+            'recipient': recipient,
+            'size': size,
+            'path': os.path.join(OBJECTS_DIR, content_id),
+            'content_id': content_id
+        }
+
+    def reserve(self, reservation_id, sender, size):
+        # Antes de recibir un byte: el archivo tiene que caber junto a lo que ya reservan las subidas en curso.
+        # Los archivos completos no cuentan aquí porque la expulsión los borra para hacer sitio. Devuelve el error
+        # para el remitente, o None. Reservar otra vez el mismo id (al reanudar) solo actualiza la reserva
+        limits = self.limits
+        with self.transaction() as db:
+            user_reserved, total_reserved = db.execute(
+                'SELECT COALESCE(SUM(CASE WHEN sender = ? THEN size END), 0), COALESCE(SUM(size), 0) '
+                'FROM reservations WHERE reservation_id != ?', (sender, reservation_id)).fetchone()
+            if user_reserved + size > limits.max_user_bytes:
+                return (f"El archivo de {size} bytes no cabe en la cuota por usuario de {limits.max_user_bytes} "
+                        f"({user_reserved} reservados por otras subidas en curso)")
+            if total_reserved + size > limits.max_bytes:
+                return (f"El archivo de {size} bytes no cabe en el espacio del servidor de {limits.max_bytes} "
+                        f"({total_reserved} reservados por otras subidas en curso)")
+            db.execute('INSERT OR REPLACE INTO reservations VALUES (?, ?, ?, ?)',
+                       (reservation_id, sender, size, time.time()))
+        # La expulsión hace sitio para lo reservado
+        self.wake.set()
+        return None
+
+    def release(self, reservation_id):
+        with self.lock:
+            self.db.execute('DELETE FROM reservations WHERE reservation_id = ?', (reservation_id,))
+
+    def add(self, temp_path, content_id, sender, recipient, file_name, reservation_id=None):
+        # Guarda el contenido recibido (o lo descarta si ya estaba), registra la entrega y libera la reserva de la
+        # subida en la misma transacción
+        path = self.path(content_id)
+        duplicate = False
+        with self.transaction() as db:
+            db.execute('DELETE FROM reservations WHERE reservation_id = ?', (reservation_id,))
+            row = db.execute('SELECT size FROM objects WHERE content_id = ?', (content_id,)).fetchone()
+            if row is not None and os.path.exists(path):
+                duplicate = True
+                size = row[0]
+            else:
+                size = os.path.getsize(temp_path)
+                os.replace(temp_path, path)
+                db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?)', (content_id, size, time.time()))
+            delivered = self.insert_delivery(db, content_id, sender, recipient, file_name, size)
+        if duplicate:
+            remove_quietly(temp_path)
+        self.wake.set()
+        return delivered
+
+    def deliver(self, content_id, sender, recipient, file_name):
+        # Nueva entrega de un contenido que el remitente ya tuvo (lo subió o lo recibió); None si hay que subirlo.
+        # Conocer los hashes no basta para obtener el archivo de otro
+        with self.transaction() as db:
+            row = db.execute('SELECT size FROM objects WHERE content_id = ?', (content_id,)).fetchone()
+            if row is None or not os.path.exists(self.path(content_id)):
+                return None
+            if not db.execute('SELECT 1 FROM grants WHERE content_id = ? AND username = ?',
+                              (content_id, sender)).fetchone():
+                return None
+            delivered = self.insert_delivery(db, content_id, sender, recipient, file_name, row[0])
+        self.wake.set()
+        return delivered
+
+    def insert_delivery(self, db, content_id, sender, recipient, file_name, size, created=None):
+        # El id es el nombre único de la entrega: dos archivos con el mismo nombre nunca se pisan
+        file_id = secrets.token_hex(16)
+        created = created or time.time()
+        db.execute('INSERT INTO deliveries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   (file_id, content_id, sender, recipient, file_name, created, created))
+        db.executemany('INSERT OR IGNORE INTO grants VALUES (?, ?)', [(content_id, sender), (content_id, recipient)])
+        return self.delivered(file_id, content_id, sender, recipient, file_name, size)
+
+    def find(self, file_id):
+        # El id llega del cliente: solo se aceptan los que genera insert_delivery
+        if not file_id or any(char not in string.hexdigits for char in file_id):
+            return None
+        with self.lock:
+            row = self.db.execute('SELECT d.content_id, d.sender, d.recipient, d.file_name, o.size '
+                                  'FROM deliveries d JOIN objects o USING (content_id) WHERE d.file_id = ?',
+                                  (file_id,)).fetchone()
+        if row is None:
+            return None
+        delivered = self.delivered(file_id, *row)
+        delivered['path'] = self.path(row[0])
+        return delivered
+
+    def touch(self, file_id):
+        # Cada descarga cuenta como uso para la expulsión LRU
+        with self.lock:
+            self.db.execute('UPDATE deliveries SET accessed = ? WHERE file_id = ?', (time.time(), file_id))
+
+    def remove(self, file_id):
+        with self.transaction() as db:
+            row = db.execute('SELECT content_id FROM deliveries WHERE file_id = ?', (file_id,)).fetchone()
+            if row is None:
+                return False
+            db.execute('DELETE FROM deliveries WHERE file_id = ?', (file_id,))
+            deleted = self.collect(db, [row[0]])
+        self.unlink(deleted)
+        return True
+
+    def collect(self, db, content_ids):
+        # Dentro de la transacción: ningún worker puede entregar el contenido entre la comprobación y el borrado.
+        # Aquí solo se renombra cada objeto, que no espera al disco; el borrado va después del commit. Si se borrase
+        # por su nombre, una subida del mismo contenido que llegue entre medias perdería su archivo
+        deleted = []
+        for content_id in set(content_ids):
+            if db.execute('SELECT 1 FROM deliveries WHERE content_id = ? LIMIT 1', (content_id,)).fetchone():
+                continue
+            db.execute('DELETE FROM objects WHERE content_id = ?', (content_id,))
+            db.execute('DELETE FROM grants WHERE content_id = ?', (content_id,))
+            path = f'{self.path(content_id)}.{secrets.token_hex(8)}{DELETED_SUFFIX}'
+            try:
+                os.replace(self.path(content_id), path)
+            except FileNotFoundError:
+                continue
+            deleted.append(path)
+        return deleted
+
+    def unlink(self, paths):
+        for path in paths:
+            remove_quietly(path)
+
+    def unlink_deleted(self):
+        # Objetos que un servidor caído renombró y no llegó a borrar
+        self.unlink(os.path.join(self.objects_dir, name) for name in os.listdir(self.objects_dir)
+                    if name.endswith(DELETED_SUFFIX))
+
+    def evict(self, now=None):
+        # Primero lo caducado; después, en orden LRU, entregas de quien supera su cuota y del almacén entero. Lo
+        # reservado por subidas en curso cuenta como ocupado. Las reservas que nadie renovó en lo que dura un
+        # parcial son de un servidor que se cayó
+        now = now or time.time()
+        limits = self.limits
+        deleted = []
+        with self.transaction() as db:
+            db.execute('DELETE FROM reservations WHERE updated < ?', (now - PARTIAL_TRANSFER_TTL,))
+            rows = db.execute('SELECT file_id, content_id, sender, created FROM deliveries '
+                              'ORDER BY accessed').fetchall()
+            sizes = dict(db.execute('SELECT content_id, size FROM objects'))
+            refs = Counter(content_id for _, content_id, _, _ in rows)
+            user_refs = Counter((sender, content_id) for _, content_id, sender, _ in rows)
+            usage = defaultdict(int)
+            for sender, content_id in user_refs:
+                usage[sender] += sizes.get(content_id, 0)
+            total = sum(sizes.get(content_id, 0) for content_id in refs)
+            for sender, reserved in db.execute('SELECT sender, SUM(size) FROM reservations GROUP BY sender'):
+                usage[sender] += reserved
+                total += reserved
+            victims = {}
+
+            def drop(file_id, content_id, sender):
+                nonlocal total
+                victims[file_id] = content_id
+                user_refs[sender, content_id] -= 1
+                if not user_refs[sender, content_id]:
+                    usage[sender] -= sizes.get(content_id, 0)
+                refs[content_id] -= 1
+                if not refs[content_id]:
+                    total -= sizes.get(content_id, 0)
+
+            for file_id, content_id, sender, created in rows:
+                if now - created > limits.max_age:
+                    drop(file_id, content_id, sender)
+            for file_id, content_id, sender, _ in rows:
+                if file_id not in victims and sender != LEGACY_OWNER and usage[sender] > limits.max_user_bytes:
+                    drop(file_id, content_id, sender)
+            for file_id, content_id, sender, _ in rows:
+                if total <= limits.max_bytes:
+                    break
+                if file_id not in victims:
+                    drop(file_id, content_id, sender)
+            if victims:
+                db.executemany('DELETE FROM deliveries WHERE file_id = ?', [(file_id,) for file_id in victims])
+                deleted = self.collect(db, victims.values())
+        self.unlink(deleted)
+        if victims:
+            self.evicted += len(victims)
+            logging.info(f"Expulsadas {len(victims)} entregas; almacén en {total} bytes")
+        return len(victims)
+
+    def start_eviction(self):
+        threading.Thread(target=self.eviction_loop, daemon=True).start()
+
+    def eviction_loop(self):
+        # Cada intervalo, o en cuanto entra un archivo nuevo; también se borran aquí los parciales caducados
+        try:
+            self.unlink_deleted()
+        except OSError as e:
+            logging.error(f"Error al liberar espacio en {self.directory}: {e}")
+        while True:
+            try:
+                self.evict()
+                prune_partial_transfers(self.directory)
+            except Exception as e:
+                logging.error(f"Error al liberar espacio en {self.directory}: {e}")
+            self.wake.wait(self.limits.interval)
+            self.wake.clear()
+
+    def stats(self):
+        with self.lock:
+            objects, total = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects').fetchone()
+            deliveries = self.db.execute('SELECT COUNT(*) FROM deliveries').fetchone()[0]
+            reserved = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM reservations').fetchone()[0]
+        return {'bytes': total, 'objects': objects, 'deliveries': deliveries, 'reserved': reserved,
+                'evicted': self.evicted}
+
+    def import_legacy(self):
+        # Solo al crear el índice: los received_<nombre> que escribían los servidores anteriores pasan al almacén.
+        # No se sabe quién los envió ni a quién, así que nadie puede descargarlos ni reenviarlos; solo cuentan para
+        # el espacio del servidor y caducan por antigüedad. El hash se calcula fuera de la transacción, que otros
+        # workers esperan
+        imported = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.startswith(LEGACY_PREFIX) or not os.path.isfile(path):
+                continue
+            try:
+                content_id = file_content_id(path, IMPORT_CHUNK_SIZE)
+                with self.transaction() as db:
+                    # Otro worker que arrancó a la vez ya pudo importarlo
+                    if not os.path.exists(path):
+                        continue
+                    size = os.path.getsize(path)
+                    created = os.path.getmtime(path)
+                    os.replace(path, self.path(content_id))
+                    db.execute('INSERT OR IGNORE INTO objects VALUES (?, ?, ?)', (content_id, size, created))
+                    self.insert_delivery(db, content_id, LEGACY_OWNER, LEGACY_OWNER, name[len(LEGACY_PREFIX):],
+                                         size, created)
+                imported += 1
+            except OSError as e:
+                logging.error(f"No se pudo importar el archivo recibido {path}: {e}")
+        if imported:
+            logging.info(f"Importados {imported} archivos recibidos de versiones anteriores en {self.objects_dir}")
@@ -3,8 +3,10 @@ import threading
 import json
 import tkinter as tk
 from tkinter import ttk, filedialog, simpledialog, messagebox
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image, ImageTk
 import io
+import hashlib
+import time
 import base64
 import os
 import logging
@@ -13,8 +15,26 @@ import pickle
 import struct
 import numpy as np
 
+from avatar_cache import AvatarCache
+from avatar_store import avatar_hash
+from compression import COMPRESSION_NAMES, FrameCompressor
+from file_transfer import (DOWNLOAD_RANGE_SIZE, FileDownload, open_data_channel, receive_file_parallel,
+                           send_file_chunks)
+from framing import (CAPABILITIES, FILE_CHUNK, FLAG_CODEC_MASK, FRAME_HELLO, FRAME_MESSAGE, FRAME_WINDOW_UPDATE,
+                     PREAMBLE, PROTOCOL_V2, PROTOCOL_VERSION, BinaryFrameReader, FrameReader, encode_frame,
+                     encode_preamble, frame_message, parse_file_chunk, parse_preamble, parse_window_update, recv_exact)
+from message_codec import CODEC_JSON, DEFAULT_CODEC, get_codec
+from streams import StreamWindows
+
 logging.basicConfig(level=logging.DEBUG)
 
+# Conexiones en paralelo al enviar un archivo grande
+DEFAULT_FILE_CHANNELS = 4
+# Chunks de los envíos con frames binarios: varios caben en la ventana de un stream
+FILE_FRAME_CHUNK_SIZE = 256 * 1024
+# Reintentos de una descarga interrumpida, cada uno desde el último byte recibido
+DOWNLOAD_ATTEMPTS = 3
+
 
 class VideoCall:
     def __init__(self, host, port, on_frame_received):
@@ -85,19 +105,44 @@ class VideoCall:
 
 
 class ChatClient:
-    def __init__(self, host='localhost', port=14999):
+    def __init__(self, host='localhost', port=14999, file_channels=DEFAULT_FILE_CHANNELS):
         self.host = host
         self.port = port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.protocol_version = PROTOCOL_VERSION
+        self.preferred_codec = DEFAULT_CODEC
+        self.codec = get_codec(CODEC_JSON)
+        self.server_capabilities = set()
+        # Compresión elegida por el servidor en el welcome; hasta entonces todo va sin comprimir
+        self.compressor = None
+        # El hilo de la interfaz y el de recepción escriben en el mismo socket: un frame no puede partirse
+        self.send_lock = threading.Lock()
+        self.next_transfer_id = 1
+        # Conexiones TCP en paralelo para enviar un archivo, autenticadas con el token de sesión del welcome
+        self.file_channels = file_channels
+        self.session_token = None
+        self.data_port = None
+        # Ventanas de crédito de los streams de datos en la conexión del chat, si el servidor las ofrece
+        self.streams = None
+        # Respuestas 'file_status' esperadas: id de transferencia → [evento, rangos de chunks que faltan, si el
+        # servidor ya tenía el contenido, por qué lo rechazó]
+        self.file_status = {}
+        self.profile_image_data = ''
         self.username = None
         self.current_chat = None
         self.users = []
+        self.user_items = {}
+        self.user_list_version = None
+        # Hashes ya pedidos al servidor, para pedir cada imagen una sola vez
+        self.avatar_requests = set()
         self.groups = {}
         self.profile_images = {}
         self.received_files_dir = "received_files"
         os.makedirs(self.received_files_dir, exist_ok=True)
 
         self.root = tk.Tk()
+        # Miniaturas por hash en memoria y en disco: sobreviven a refrescos de la lista y a reinicios
+        self.avatars = AvatarCache("avatar_cache")
         self.root.title("ChatApp")
         self.root.geometry("1200x600")
 
@@ -199,7 +244,7 @@ class ChatClient:
                     'type': 'start_video_call',
                     'recipient': self.current_chat
                 }
-                self.socket.sendall(json.dumps(data).encode('utf-8') + b'\n')
+                self.send_data(data)
 
                 self.start_local_video()
             except Exception as e:
@@ -298,43 +343,93 @@ class ChatClient:
                 self.root.quit()
                 return
             self.root.title(f"ChatApp - {self.username}")
-            self.socket.send(self.username.encode('utf-8'))
 
             default_image = Image.new('RGB', (160, 160), color='gray')
             buffered = io.BytesIO()
             default_image.save(buffered, format="PNG")
             img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            self.socket.send(img_str.encode('utf-8'))
+            self.login(img_str)
 
             threading.Thread(target=self.receive_messages, daemon=True).start()
             self.root.mainloop()
         except Exception as e:
             logging.error(f"Error de conexión: {e}")
 
+    def login(self, profile_image):
+        self.profile_image_data = profile_image
+        if self.protocol_version >= PROTOCOL_V2:
+            hello = {
+                'username': self.username,
+                'capabilities': CAPABILITIES,
+                'compression': list(COMPRESSION_NAMES),
+                'avatar_hash': avatar_hash(profile_image)
+            }
+            # Preámbulo y hello van juntos y sin esperar respuesta: los primeros mensajes pueden ir detrás
+            self.socket.sendall(encode_preamble(self.protocol_version, self.preferred_codec) +
+                                encode_frame(FRAME_HELLO, self.codec.encode(hello), flags=self.codec.codec_id))
+        else:
+            self.socket.send(self.username.encode('utf-8'))
+            self.socket.send(profile_image.encode('utf-8'))
+
+    def send_data(self, data):
+        frame = frame_message(self.codec.encode(data), self.protocol_version, self.codec.codec_id, self.compressor)
+        with self.send_lock:
+            self.socket.sendall(frame)
+
     def receive_messages(self):
-        buffer = b""
+        if self.protocol_version >= PROTOCOL_V2:
+            try:
+                version, codec_id = parse_preamble(recv_exact(self.socket, PREAMBLE.size))
+            except (ConnectionError, OSError, ValueError) as e:
+                logging.error(f"Error en la negociación con el servidor: {e}")
+                return
+            # Hasta aquí los mensajes salieron en JSON; desde ahora se usa el códec elegido por el servidor
+            self.codec = get_codec(codec_id)
+            logging.info(f"Protocolo negociado con el servidor: v{version}, códec {self.codec.name}")
+            reader = BinaryFrameReader(self.socket)
+        else:
+            reader = FrameReader(self.socket)
         while True:
             try:
-                chunk = self.socket.recv(4096)
-                if not chunk:
-                    raise ConnectionError("Desconectado del servidor.")
-
-                buffer += chunk
-                while b'\n' in buffer:
-                    message, buffer = buffer.split(b'\n', 1)
-                    try:
-                        data = json.loads(message.decode('utf-8'))
-                        self.process_message(data)
-                    except json.JSONDecodeError:
-                        logging.warning("Mensaje no JSON recibido, posiblemente un archivo.")
-                        self.process_file_chunk(message)
+                reader.fill()
+                for frame in reader.frames():
+                    if self.protocol_version >= PROTOCOL_V2:
+                        self.process_frame(frame)
+                    else:
+                        self.process_line(frame)
             except (ConnectionError, OSError) as e:
                 logging.error(f"Error de conexión: {e}")
                 break
+        if self.streams:
+            # Los envíos que esperan crédito terminan en vez de esperar a un servidor que ya no está
+            self.streams.close_all()
+
+    def process_line(self, message):
+        try:
+            data = json.loads(message)
+            self.process_message(data)
+        except json.JSONDecodeError:
+            logging.warning("Mensaje no JSON del servidor descartado")
+
+    def process_frame(self, frame):
+        if frame.type == FRAME_MESSAGE:
+            try:
+                data = get_codec(frame.flags & FLAG_CODEC_MASK).decode(frame.payload)
+            except Exception as e:
+                logging.error(f"Mensaje ilegible del servidor: {e}")
+                return
+            self.process_message(data)
+        elif frame.type == FRAME_WINDOW_UPDATE and self.streams:
+            self.streams.release(frame.stream_id, parse_window_update(frame.payload))
+        else:
+            logging.warning(f"Tipo de frame desconocido: {frame.type}")
 
     def process_message(self, data):
         if data['type'] == 'user_list':
+            self.user_list_version = data.get('version')
             self.update_user_list(data['users'])
+        elif data['type'] in ('user_joined', 'user_left', 'user_updated'):
+            self.apply_user_delta(data)
         elif data['type'] == 'message':
             if data['content'].startswith("[Archivo recibido:"):
                 self.handle_received_file(data['sender'], data['content'])
@@ -346,6 +441,31 @@ class ChatClient:
             self.add_group(data['group_name'], data['members'])
         elif data['type'] == 'start_video_call':
             self.start_video_call()
+        elif data['type'] == 'welcome':
+            self.server_capabilities = set(data['capabilities'])
+            self.session_token = data.get('session_token')
+            self.data_port = data.get('data_port')
+            if data.get('stream_window'):
+                self.streams = StreamWindows(data['stream_window'])
+            if data.get('compression') in COMPRESSION_NAMES:
+                self.compressor = FrameCompressor(COMPRESSION_NAMES[data['compression']])
+        elif data['type'] == 'avatar':
+            self.receive_avatar(data['avatar_hash'], data['image'])
+        elif data['type'] == 'file_available':
+            self.display_message(data['sender'], f"[Archivo recibido: {data['file_name']}] ({data['size']} bytes), "
+                                                 f"descargando...")
+            threading.Thread(target=self.download_file, args=(data,), daemon=True).start()
+        elif data['type'] == 'file_status':
+            status = self.file_status.get(data['transfer_id'])
+            if status:
+                status[1] = data['missing']
+                status[2] = data.get('stored', False)
+                status[3] = data.get('error')
+                status[0].set()
+        elif data['type'] == 'file_error':
+            self.display_message("Tú", f"[Archivo no entregado: {data['file_name']}] {data['error']}")
+        elif data['type'] == 'avatar_request':
+            self.send_data({'type': 'profile_image', 'image': self.profile_image_data})
 
     def handle_received_file(self, sender, message):
         file_info, file_path = message.split(". Guardado en: ")
@@ -360,7 +480,7 @@ class ChatClient:
                 'content': message
             }
             try:
-                self.socket.sendall(json.dumps(data).encode('utf-8') + b'\n')
+                self.send_data(data)
                 self.display_message("Tú", message)
                 self.message_input.delete(0, tk.END)
             except Exception as e:
@@ -378,6 +498,13 @@ class ChatClient:
             file_size = os.path.getsize(file_path)
             chunk_size = 1024 * 1024
 
+            if 'file_frames' in self.server_capabilities:
+                # Se calcula el manifiesto y se espera la respuesta del servidor sin bloquear la interfaz
+                threading.Thread(target=self.send_file_frames,
+                                 args=(file_path, file_size, FILE_FRAME_CHUNK_SIZE, self.current_chat),
+                                 daemon=True).start()
+                return
+
             try:
                 with open(file_path, 'rb') as file:
                     chunk_number = 0
@@ -395,16 +522,142 @@ class ChatClient:
                             'total_chunks': (file_size - 1) // chunk_size + 1,
                             'content': encoded_chunk
                         }
-                        message = json.dumps(data) + '\n'
-                        self.socket.sendall(message.encode('utf-8'))
+                        self.send_data(data)
                         chunk_number += 1
 
                 self.display_message("Tú", f"[Archivo enviado: {file_path.split('/')[-1]}]")
             except Exception as e:
                 logging.error(f"Error al enviar el archivo: {e}")
 
-    def process_file_chunk(self, chunk):
-        logging.info(f"Chunk de archivo recibido: {chunk[:50]}...")
+    def send_file_frames(self, file_path, file_size, chunk_size, recipient):
+        # Los bytes del archivo viajan tal cual detrás de una cabecera fija: sin base64 ni JSON por chunk
+        with self.send_lock:
+            transfer_id = self.next_transfer_id
+            self.next_transfer_id += 1
+        file_name = os.path.basename(file_path)
+        chunk_count = (file_size + chunk_size - 1) // chunk_size
+        try:
+            with open(file_path, 'rb') as file:
+                # El manifiesto (un hash por chunk) identifica la transferencia si hay que reanudarla
+                chunk_hashes = [hashlib.sha256(file.read(chunk_size)).hexdigest() for _ in range(chunk_count)]
+                status = self.file_status[transfer_id] = [threading.Event(), [[0, chunk_count]], False, None]
+                self.send_data({
+                    'type': 'file_start',
+                    'transfer_id': transfer_id,
+                    'recipient': recipient,
+                    'file_name': file_name,
+                    'size': file_size,
+                    'chunk_size': chunk_size,
+                    'chunk_hashes': chunk_hashes
+                })
+                if 'file_resume' in self.server_capabilities and not status[0].wait(30):
+                    raise TimeoutError("El servidor no respondió al inicio de la transferencia")
+            if status[3]:
+                # Sin espacio en el servidor (o por encima de la cuota): no se envía nada
+                self.display_message("Tú", f"[Archivo no enviado: {file_name}] {status[3]}")
+                return
+            missing = status[1]
+            pending = sum(end - start for start, end in missing)
+            channels = self.open_data_channels(min(self.file_channels, pending))
+            try:
+                if channels:
+                    # Varias conexiones TCP en paralelo: una sola no llena un enlace con mucha latencia
+                    send_file_chunks(channels, file_path, transfer_id, chunk_size, file_size, missing,
+                                     compressor=self.compressor)
+                else:
+                    self.send_file_on_stream(file_path, transfer_id, chunk_size, file_size, missing)
+            finally:
+                for channel in channels:
+                    channel.close()
+            if status[2]:
+                self.display_message("Tú", f"[Archivo enviado: {file_name}] (ya estaba en el servidor: no se "
+                                           f"envió ningún dato)")
+            elif pending < chunk_count:
+                self.display_message("Tú", f"[Archivo enviado: {file_name}] (reanudado: se enviaron {pending} "
+                                           f"de {chunk_count} chunks)")
+            else:
+                self.display_message("Tú", f"[Archivo enviado: {file_name}]")
+        except Exception as e:
+            logging.error(f"Error al enviar el archivo: {e}")
+        finally:
+            self.file_status.pop(transfer_id, None)
+
+    def send_file_on_stream(self, file_path, transfer_id, chunk_size, file_size, missing):
+        # En la conexión del chat el archivo va por su propio stream: los mensajes se intercalan entre sus chunks
+        # en vez de esperar detrás de todo el archivo
+        window = None
+        if self.streams and FILE_CHUNK.size + chunk_size <= self.streams.window_size:
+            window = self.streams.open()
+        try:
+            send_file_chunks([self.socket], file_path, transfer_id, chunk_size, file_size, missing, self.send_lock,
+                             window, self.compressor)
+        finally:
+            if window:
+                self.streams.close(window.stream_id)
+
+    def open_data_channels(self, count):
+        if count < 2 or not self.session_token or 'file_channels' not in self.server_capabilities:
+            return []
+        channels = []
+        try:
+            for _ in range(count):
+                channels.append(open_data_channel(self.host, self.data_port or self.port, self.session_token))
+        except OSError as e:
+            logging.warning(f"No se pudieron abrir conexiones de datos, se usará la del chat: {e}")
+            for channel in channels:
+                channel.close()
+            return []
+        return channels
+
+    def download_file(self, data):
+        # La descarga va por conexiones de datos propias, varias si el archivo da para varios tramos: el servidor
+        # envía cada tramo con sendfile
+        with self.send_lock:
+            download_id = self.next_transfer_id
+            self.next_transfer_id += 1
+        try:
+            download = FileDownload(self.received_files_dir, data['file_id'], data['file_name'], data['size'])
+        except OSError as e:
+            logging.error(f"No se pudo crear el archivo de {data['file_name']}: {e}")
+            return
+        resumed_from = download.received
+        try:
+            for attempt in range(DOWNLOAD_ATTEMPTS):
+                if download.complete:
+                    break
+                try:
+                    ranges = len(download.missing_ranges(DOWNLOAD_RANGE_SIZE))
+                    channels = self.open_data_channels(min(self.file_channels, ranges)) or [
+                        open_data_channel(self.host, self.data_port or self.port, self.session_token)]
+                    try:
+                        receive_file_parallel(channels, download, download_id, data['file_id'],
+                                              self.process_file_chunk)
+                    finally:
+                        for channel in channels:
+                            channel.close()
+                except (ConnectionError, OSError) as e:
+                    if attempt == DOWNLOAD_ATTEMPTS - 1:
+                        raise
+                    # Cada reintento pide solo los tramos que faltan
+                    logging.warning(f"Descarga de {data['file_name']} interrumpida con {download.received} bytes "
+                                    f"recibidos: {e}")
+                    time.sleep(1)
+            path = download.finish()
+            if resumed_from:
+                self.display_message("ChatApp", f"[Archivo descargado: {data['file_name']}] Guardado en: "
+                                                f"{os.path.abspath(path)} (reanudado: ya había {resumed_from} bytes)")
+            else:
+                self.display_message("ChatApp", f"[Archivo descargado: {data['file_name']}] Guardado en: "
+                                                f"{os.path.abspath(path)}")
+        except Exception as e:
+            # Lo recibido se queda en el parcial: la próxima descarga del mismo archivo sigue desde ahí
+            download.close()
+            logging.error(f"Error al descargar {data['file_name']}: {e}")
+            self.display_message("ChatApp", f"No se pudo descargar {data['file_name']}: {e}")
+
+    def process_file_chunk(self, download, payload):
+        _, offset, data = parse_file_chunk(payload)
+        download.write_at(offset, data)
 
     def display_message(self, sender, content):
         self.message_area.config(state='normal')
@@ -419,11 +672,12 @@ class ChatClient:
                 with open(file_path, 'rb') as file:
                     img_data = file.read()
                 img_str = base64.b64encode(img_data).decode('utf-8')
+                self.profile_image_data = img_str
                 data = {
                     'type': 'profile_image',
                     'image': img_str
                 }
-                self.socket.sendall(json.dumps(data).encode('utf-8') + b'\n')
+                self.send_data(data)
                 logging.info(f"Imagen de perfil enviada: {file_path}")
 
                 image = Image.open(file_path)
@@ -448,30 +702,91 @@ class ChatClient:
 
     def update_user_list(self, users):
         self.users = users
+        self.user_items = {}
         self.users_tree.delete(*self.users_tree.get_children())
         for user in users:
-            if user['username'] != self.username:
-                image = self.get_profile_image(user['username'], user['profile_image'])
-                self.users_tree.insert('', 'end', text=user['username'], image=image)
+            self.show_user(user)
         for group in self.groups:
             self.users_tree.insert('', 'end', text=group, tags=('group',))
 
-    def get_profile_image(self, username, image_str):
+    def apply_user_delta(self, data):
+        if self.user_list_version is None or data['version'] <= self.user_list_version:
+            # Sin lista base todavía, o cambio ya incluido en la última lista completa
+            return
+        if data['version'] != self.user_list_version + 1:
+            logging.warning(f"Se perdieron cambios de la lista de usuarios "
+                            f"(versión {self.user_list_version} → {data['version']}), pidiendo la lista completa")
+            self.user_list_version = None
+            self.send_data({'type': 'get_user_list'})
+            return
+        self.user_list_version = data['version']
+        if data['type'] == 'user_left':
+            self.users = [user for user in self.users if user['username'] != data['username']]
+            self.hide_user(data['username'])
+        else:
+            user = data['user']
+            self.users = [known for known in self.users if known['username'] != user['username']] + [user]
+            self.show_user(user)
+
+    def show_user(self, user):
+        username = user['username']
+        if username == self.username:
+            return
+        image = self.get_profile_image(username, user)
+        item = self.user_items.get(username)
+        if item:
+            index = self.users_tree.index(item)
+            self.users_tree.delete(item)
+        else:
+            # Los usuarios van antes que los grupos en el árbol
+            index = len(self.user_items)
+        self.user_items[username] = self.users_tree.insert('', index, text=username, image=image)
+
+    def request_avatar(self, image_hash):
+        if image_hash not in self.avatar_requests:
+            self.avatar_requests.add(image_hash)
+            self.send_data({'type': 'get_avatar', 'avatar_hash': image_hash})
+
+    def receive_avatar(self, image_hash, image_data):
+        self.avatar_requests.discard(image_hash)
+        if not image_data:
+            return
+        try:
+            self.avatars.put(image_hash, image_data)
+        except Exception as e:
+            logging.error(f"Error al procesar el avatar {image_hash}: {e}")
+            return
+        for user in self.users:
+            if user.get('avatar_hash') == image_hash:
+                self.show_user(user)
+
+    def hide_user(self, username):
+        item = self.user_items.pop(username, None)
+        if item:
+            self.users_tree.delete(item)
+        self.profile_images.pop(username, None)
+
+    def get_profile_image(self, username, user):
         if username == self.username and username in self.profile_images:
             return self.profile_images[username]
-        if image_str:
-            try:
-                image_data = base64.b64decode(image_str)
-                image = Image.open(io.BytesIO(image_data))
-                image = image.resize((60, 60), Image.Resampling.LANCZOS)
-                mask = Image.new('L', (60, 60), 0)
-                draw = ImageDraw.Draw(mask)
-                draw.ellipse((0, 0, 60, 60), fill=255)
-                output = ImageTk.PhotoImage(Image.composite(image, Image.new('RGB', (60, 60), (0, 0, 0)), mask))
-                self.profile_images[username] = output
-                return output
-            except Exception as e:
-                logging.error(f"Error al procesar la imagen de perfil de {username}: {e}")
+        image_str = user.get('profile_image', '')
+        image_hash = user.get('avatar_hash')
+        try:
+            if not image_hash:
+                if not image_str:
+                    return None
+                image_hash = avatar_hash(image_str)
+            output = self.avatars.get(image_hash)
+            if output is None and image_str:
+                output = self.avatars.put(image_hash, image_str)
+            if output is None:
+                self.request_avatar(image_hash)
+                return None
+            # Mientras el usuario se muestre, su imagen no puede liberarse aunque salga de la LRU
+            self.profile_images[username] = output
+            return output
+        except Exception as e:
+            logging.error(f"Error al procesar la imagen de perfil de {username}: {e}")
         return None
 
     def on_user_select(self, event):
@@ -515,7 +830,7 @@ class ChatClient:
                         'group_name': group_name,
                         'members': members
                     }
-                    self.socket.sendall(json.dumps(data).encode('utf-8') + b'\n')
+                    self.send_data(data)
                     user_selection_window.destroy()
                     self.display_message("ChatApp", f"Grupo '{group_name}' creado con éxito.")
                 else:
@@ -533,7 +848,7 @@ class ChatClient:
                 'content': message
             }
             try:
-                self.socket.sendall(json.dumps(data).encode('utf-8') + b'\n')
+                self.send_data(data)
                 if self.current_chat in self.groups:
                     self.display_message(f"Tú (en {self.current_chat})", message)
                 else:
@@ -0,0 +1,140 @@
+import lzma
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSION_LZ4 = 3
+
+# Por debajo de este tamaño la cabecera del formato y la CPU no compensan lo que se ahorra
+MIN_COMPRESS_SIZE = 512
+# En payloads mayores que dos muestras se comprime primero una muestra del centro para estimar la ratio
+SAMPLE_SIZE = 16 * 1024
+# Solo se envía comprimido lo que ahorra al menos un 10%
+MAX_RATIO = 0.9
+
+# Cabeceras de formatos que ya van comprimidos (imágenes, audio, vídeo, archivos comprimidos)
+COMPRESSED_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG', b'GIF8', b'RIFF', b'\x1a\x45\xdf\xa3', b'OggS', b'fLaC', b'ID3',
+                         b'PK\x03\x04', b'\x1f\x8b', b'BZh', b'\xfd7zXZ', b"7z\xbc\xaf'\x1c", b'Rar!',
+                         b'\x28\xb5\x2f\xfd', b'\x04\x22\x4d\x18')
+
+
+def is_compressed_media(data):
+    head = bytes(data[:12])
+    # MP4, MOV, HEIC y AVIF llevan 'ftyp' tras la longitud de la primera caja
+    return head.startswith(COMPRESSED_SIGNATURES) or head[4:8] == b'ftyp'
+
+
+class ZlibCompression:
+    compression_id = COMPRESSION_ZLIB
+    name = 'zlib'
+
+    def compress(self, data):
+        # Nivel 1: casi la misma ratio que el nivel por defecto en texto y JSON, a varias veces la velocidad
+        return zlib.compress(data, 1)
+
+    def decompress(self, data, max_size):
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, max_size)
+        if not decompressor.eof or decompressor.unconsumed_tail:
+            raise ValueError(f"Payload zlib truncado o de más de {max_size} bytes")
+        return result
+
+
+class LzmaCompression:
+    compression_id = COMPRESSION_LZMA
+    name = 'lzma'
+
+    def compress(self, data):
+        return lzma.compress(data, preset=1)
+
+    def decompress(self, data, max_size):
+        decompressor = lzma.LZMADecompressor()
+        result = decompressor.decompress(data, max_size)
+        if not decompressor.eof:
+            raise ValueError(f"Payload lzma truncado o de más de {max_size} bytes")
+        return result
+
+
+class Lz4Compression:
+    compression_id = COMPRESSION_LZ4
+    name = 'lz4'
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data, max_size):
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+        result = decompressor.decompress(data, max_size)
+        if not decompressor.eof:
+            raise ValueError(f"Payload lz4 truncado o de más de {max_size} bytes")
+        return result
+
+
+# En orden de preferencia: lz4 es el más rápido; lzma comprime más pero solo compensa en enlaces lentos
+COMPRESSIONS = {compression.compression_id: compression for compression in [ZlibCompression(), LzmaCompression()]}
+if lz4_frame is not None:
+    COMPRESSIONS = {COMPRESSION_LZ4: Lz4Compression(), **COMPRESSIONS}
+
+COMPRESSION_NAMES = {compression.name: compression_id for compression_id, compression in COMPRESSIONS.items()}
+
+
+def get_compression(compression_id):
+    compression = COMPRESSIONS.get(compression_id)
+    if compression is None:
+        raise ValueError(f"Compresión desconocida: {compression_id}")
+    return compression
+
+
+def choose_compression(offered, accepted=None):
+    # La primera que ofrece el cliente (en su orden de preferencia) y que el servidor acepta
+    for name in offered or []:
+        if name in COMPRESSION_NAMES and (accepted is None or name in accepted):
+            return COMPRESSION_NAMES[name]
+    return COMPRESSION_NONE
+
+
+def decompress(compression_id, data, max_size):
+    return get_compression(compression_id).decompress(data, max_size)
+
+
+class FrameCompressor:
+    def __init__(self, compression_id, min_size=MIN_COMPRESS_SIZE, sample_size=SAMPLE_SIZE, max_ratio=MAX_RATIO):
+        self.compression = get_compression(compression_id)
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.max_ratio = max_ratio
+
+    @property
+    def compression_id(self):
+        return self.compression.compression_id
+
+    def compress(self, data):
+        # Devuelve el payload que se envía y el id de compresión de sus flags (COMPRESSION_NONE si va tal cual)
+        compressed = self.try_compress(data)
+        if compressed is None:
+            return data, COMPRESSION_NONE
+        return compressed, self.compression_id
+
+    def try_compress(self, data, header=b''):
+        # header + data comprimidos, o None si no compensa. La decisión solo mira data: header es una cabecera
+        # binaria que va dentro del payload
+        if len(data) < self.min_size or is_compressed_media(data):
+            return None
+        if len(data) > 2 * self.sample_size:
+            # Si la muestra apenas se comprime, el resto tampoco. Se estima siempre con zlib rápido: lzma tarda en
+            # la muestra lo que zlib en todo el payload
+            start = (len(data) - self.sample_size) // 2
+            sample = data[start:start + self.sample_size]
+            if len(zlib.compress(sample, 1)) > self.max_ratio * len(sample):
+                return None
+        size = len(header) + len(data)
+        compressed = self.compression.compress(header + data if header else data)
+        if len(compressed) > self.max_ratio * size:
+            return None
+        return compressed
@@ -0,0 +1,161 @@
+import asyncio
+import math
+import threading
+from collections import Counter
+
+# Bytes que gana un usuario de peso 1 en cada ronda del DRR. En lectura equivale a un recv: quien sube sin parar
+# lee uno por ronda (uno cada cuatro con peso 0.25) y los usuarios del chat, con mensajes pequeños, nunca esperan
+READ_QUANTUM = 64 * 1024
+# En escritura coincide con el lote que ya sacaba el Flusher, así que con pesos 1 el reparto no cambia
+WRITE_QUANTUM = 256 * 1024
+DEFAULT_CLASS = 'default'
+
+
+class FairnessPolicy:
+    def __init__(self, class_weights=None, user_classes=None, read_quantum=READ_QUANTUM,
+                 write_quantum=WRITE_QUANTUM):
+        self.class_weights = {DEFAULT_CLASS: 1.0}
+        self.class_weights.update(class_weights or {})
+        for user_class, weight in self.class_weights.items():
+            # Con peso 0 el crédito nunca se repone: el lector esperaría rondas para siempre
+            parse_weight(weight, user_class)
+        self.user_classes = dict(user_classes or {})
+        self.read_quantum = read_quantum
+        self.write_quantum = write_quantum
+
+    def weight(self, username):
+        user_class = self.user_classes.get(username, DEFAULT_CLASS)
+        return self.class_weights.get(user_class, self.class_weights[DEFAULT_CLASS])
+
+    def read_share(self, username):
+        return self.read_quantum * self.weight(username)
+
+    def write_share(self, username):
+        return self.write_quantum * self.weight(username)
+
+
+def parse_assignments(values, convert=str):
+    # 'nombre=valor' repetido en la línea de comandos → diccionario
+    result = {}
+    for value in values or []:
+        name, separator, setting = value.partition('=')
+        if not separator or not name:
+            raise ValueError(f"Se esperaba nombre=valor y llegó {value!r}")
+        result[name] = convert(setting)
+    return result
+
+
+def parse_weight(value, user_class=None):
+    try:
+        weight = float(value)
+    except ValueError:
+        weight = math.nan
+    if not math.isfinite(weight) or weight <= 0:
+        name = f" de la clase {user_class}" if user_class else ''
+        raise ValueError(f"El peso{name} debe ser un número mayor que 0 y llegó {value!r}")
+    return weight
+
+
+class ReadScheduler:
+    # Deficit round robin entre usuarios para leer y procesar lo que llega. Un usuario con crédito lee sin esperar
+    # a nadie; el que lo gastó y aún tiene datos espera a la siguiente ronda, que empieza cuando ningún usuario con
+    # datos conserva crédito. Las conexiones de un usuario (chat y datos) comparten crédito, así que abrir más no da
+    # más parte.
+    def __init__(self, policy=None):
+        self.policy = policy or FairnessPolicy()
+        self.condition = threading.Condition()
+        self.deficits = {}
+        # Hilos con datos y crédito, usuarios con hilos esperando ronda y usuarios que leyeron en esta ronda
+        self.busy = 0
+        self.waiting = Counter()
+        self.active = set()
+        # Motor asyncio: la tarea que repone el crédito de cada usuario endeudado
+        self.refills = {}
+        self.read_bytes = Counter()
+
+    def credit(self, username):
+        # Un usuario nuevo empieza con su quantum
+        return self.deficits.setdefault(username, self.policy.read_share(username))
+
+    def acquire(self, username):
+        # El hilo tiene datos que procesar: pasa a contar como ocupado, esperando ronda si no le queda crédito
+        with self.condition:
+            self.wait_credit(username)
+            self.busy += 1
+
+    def wait_round(self, username):
+        # Sigue habiendo datos en el socket pero el crédito se gastó: de ocupado a esperando, sin hueco entre medias
+        with self.condition:
+            self.busy -= 1
+            self.wait_credit(username)
+            self.busy += 1
+
+    def wait_credit(self, username):
+        while self.credit(username) <= 0:
+            self.waiting[username] += 1
+            if self.round_over():
+                self.new_round()
+            else:
+                self.condition.wait()
+            self.waiting[username] -= 1
+            if not self.waiting[username]:
+                del self.waiting[username]
+
+    async def acquire_async(self, username):
+        # En el bucle de eventos nadie lee mientras otro procesa: una ronda es una vuelta del bucle, en la que el
+        # resto de conexiones con datos leen antes de que el usuario endeudado recupere su quantum
+        while self.credit(username) <= 0:
+            refill = self.refills.get(username)
+            if refill is not None:
+                await refill
+                continue
+            refill = self.refills[username] = asyncio.get_running_loop().create_future()
+            try:
+                while self.credit(username) <= 0:
+                    await asyncio.sleep(0)
+                    # forget pudo quitar al usuario durante la espera: credit lo repone con su quantum
+                    self.deficits[username] = self.credit(username) + self.policy.read_share(username)
+            finally:
+                del self.refills[username]
+                refill.set_result(None)
+        with self.condition:
+            self.busy += 1
+
+    def round_over(self):
+        # Nadie procesa con crédito ni queda un hilo despertado con crédito por entrar
+        return not self.busy and not any(self.deficits[name] > 0 for name in self.waiting)
+
+    def new_round(self):
+        # También gana su quantum quien leyó en esta ronda aunque ahora esté en recv. El crédito no pasa de un
+        # quantum, así que un usuario que deja de leer no lo acumula
+        for username in self.active.union(self.waiting):
+            share = self.policy.read_share(username)
+            self.deficits[username] = min(self.credit(username) + share, share)
+        self.active.clear()
+        self.condition.notify_all()
+
+    def charge(self, username, amount):
+        # Devuelve si al usuario le queda crédito
+        with self.condition:
+            self.read_bytes[username] += amount
+            self.active.add(username)
+            self.deficits[username] = self.credit(username) - amount
+            return self.deficits[username] > 0
+
+    def release(self, username):
+        # El hilo vuelve a recv sin datos pendientes
+        with self.condition:
+            self.busy -= 1
+            if self.waiting and self.round_over():
+                self.new_round()
+
+    def forget(self, username):
+        # Al desconectarse: un usuario que vuelve empieza con su quantum, como uno nuevo
+        with self.condition:
+            self.deficits.pop(username, None)
+            self.read_bytes.pop(username, None)
+            self.active.discard(username)
+
+    def top_users(self, count=5):
+        with self.condition:
+            return dict(self.read_bytes.most_common(count))
@@ -0,0 +1,570 @@
+import hashlib
+import json
+import logging
+import os
+import secrets
+import socket
+import tempfile
+import threading
+import time
+
+from compression import is_compressed_media
+from framing import (FILE_CHUNK, FLAG_CODEC_MASK, FRAME_FILE_CHUNK, FRAME_HELLO, FRAME_MESSAGE, MAX_FRAME_SIZE,
+                     PREAMBLE, PROTOCOL_V2, BinaryFrameReader, encode_file_chunk, encode_file_chunk_header,
+                     encode_frame, encode_preamble, parse_preamble, recv_exact, send_buffers)
+from message_codec import CODEC_JSON, get_codec
+
+# Tamaño de chunk que siempre usaron los clientes con mensajes 'file_chunk', que no lo indican
+LEGACY_CHUNK_SIZE = 1024 * 1024
+# El cliente elige el tamaño de chunk y el servidor guarda estado por chunk (un bit y, sin manifiesto, su hash de
+# 32 bytes): los chunks no pueden ser diminutos ni incontables
+MIN_CHUNK_SIZE = 4 * 1024
+MAX_CHUNK_SIZE = MAX_FRAME_SIZE - FILE_CHUNK.size
+MAX_CHUNK_COUNT = 256 * 1024
+# Las transferencias interrumpidas se pueden reanudar durante un día; después se borran
+PARTIAL_TRANSFER_TTL = 24 * 60 * 60
+# Cada cuánto se guarda en disco qué chunks ya llegaron
+STATE_SAVE_INTERVAL = 1.0
+STATE_PREFIX = '.received_'
+STATE_SUFFIX = '.json'
+# Las descargas se envían en frames de este tamaño, muy por debajo de MAX_FRAME_SIZE
+DOWNLOAD_FRAME_SIZE = 4 * 1024 * 1024
+# Las descargas en paralelo piden tramos de este tamaño: pocas peticiones y tramos de sobra para repartir
+DOWNLOAD_RANGE_SIZE = 8 * DOWNLOAD_FRAME_SIZE
+# Bytes de un hash SHA-256
+DIGEST_SIZE = 32
+# Segundos sin crédito del servidor tras los que se abandona un envío por stream
+STREAM_CREDIT_TIMEOUT = 60
+
+
+def chunk_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def manifest_id(sender, recipient, file_name, size, chunk_size, chunk_hashes):
+    # El mismo archivo enviado de nuevo por el mismo usuario al mismo destinatario es la misma transferencia
+    manifest = json.dumps([sender, recipient, file_name, size, chunk_size, chunk_hashes])
+    return hashlib.sha256(manifest.encode('utf-8')).hexdigest()
+
+
+def content_id(size, chunk_size, chunk_hashes):
+    # Hash de la lista de hashes del manifiesto: identifica el contenido antes de enviar un solo byte, y el servidor
+    # lo verifica chunk a chunk al recibirlo, sin releer el archivo
+    return digests_content_id(size, chunk_size, b"".join(bytes.fromhex(value) for value in chunk_hashes))
+
+
+def digests_content_id(size, chunk_size, digests):
+    # Lo mismo a partir de los hashes binarios concatenados
+    digest = hashlib.sha256(f"{size}:{chunk_size}:".encode('ascii'))
+    digest.update(digests)
+    return digest.hexdigest()
+
+
+def file_content_id(path, chunk_size):
+    chunk_hashes = []
+    size = 0
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            chunk_hashes.append(chunk_hash(chunk))
+            size += len(chunk)
+    return content_id(size, chunk_size, chunk_hashes)
+
+
+class ChunkBitmap:
+    def __init__(self, count):
+        self.count = count
+        self.missing = count
+        self.bits = bytearray((count + 7) // 8)
+
+    def __contains__(self, index):
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index):
+        if index in self:
+            return False
+        self.bits[index >> 3] |= 1 << (index & 7)
+        self.missing -= 1
+        return True
+
+    def load(self, data):
+        if len(data) != len(self.bits):
+            raise ValueError(f"Bitmap de {len(data)} bytes para {self.count} chunks")
+        self.bits = bytearray(data)
+        self.missing = self.count - sum(1 for index in range(self.count) if index in self)
+
+    def missing_ranges(self):
+        # Rangos [inicio, fin) de chunks que faltan: una lista corta aunque el archivo tenga miles de chunks
+        ranges = []
+        start = None
+        for index in range(self.count):
+            if index in self:
+                if start is not None:
+                    ranges.append([start, index])
+                    start = None
+            elif start is None:
+                start = index
+        if start is not None:
+            ranges.append([start, self.count])
+        return ranges
+
+
+def check_chunk_count(count):
+    if not isinstance(count, int) or not 0 <= count <= MAX_CHUNK_COUNT:
+        raise ValueError(f"Número de chunks inválido: {count} (máximo {MAX_CHUNK_COUNT})")
+    return count
+
+
+def check_upload(size, chunk_size, chunk_hashes=None):
+    # Se comprueba con los datos del file_start, antes de reservar cuota o crear nada. Devuelve el número de chunks
+    if not isinstance(chunk_size, int) or not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Tamaño de chunk inválido: {chunk_size} (entre {MIN_CHUNK_SIZE} y {MAX_CHUNK_SIZE} bytes)")
+    if not isinstance(size, int) or size < 0:
+        raise ValueError(f"Tamaño de archivo inválido: {size}")
+    count = check_chunk_count((size + chunk_size - 1) // chunk_size)
+    if chunk_hashes is not None and len(chunk_hashes) != count:
+        raise ValueError(f"Manifiesto con {len(chunk_hashes)} hashes para {count} chunks")
+    return count
+
+
+class IncomingFile:
+    def __init__(self, directory, file_name, sender, recipient, chunk_count, chunk_size, size=None,
+                 chunk_hashes=None, reservation_id=None):
+        self.sender = sender
+        self.recipient = recipient
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self.size = size
+        self.chunk_hashes = chunk_hashes
+        # Un bit por chunk: saber si el archivo está completo no depende de cuántos chunks tenga
+        self.chunks = ChunkBitmap(check_chunk_count(chunk_count))
+        self.fd = None
+        self.saved_at = 0
+        # Varias conexiones de datos escriben en la misma transferencia; el hash se calcula fuera del lock
+        self.lock = threading.Lock()
+        self.active = True
+        if chunk_hashes is None:
+            # Sin manifiesto no se puede reanudar: nombre temporal único que se descarta al desconectar
+            self.manifest_id = None
+            self.content_id = None
+            self.state_path = None
+            # El id de contenido se calcula con los hashes de los chunks según llegan, sin releer el archivo al final:
+            # 32 bytes por chunk en un solo bytearray
+            self.received_digests = bytearray(DIGEST_SIZE * chunk_count)
+            self.received_size = 0
+            fd, self.temp_path = tempfile.mkstemp(prefix=f"{STATE_PREFIX}{file_name}.", suffix='.part', dir=directory)
+            # El espacio en disco se ocupa con el primer chunk
+            os.close(fd)
+            # Quien crea la transferencia ya reservó su cuota con este id
+            self.reservation_id = reservation_id or secrets.token_hex(16)
+        else:
+            if len(chunk_hashes) != chunk_count:
+                raise ValueError(f"Manifiesto con {len(chunk_hashes)} hashes para {chunk_count} chunks")
+            # El nombre depende del manifiesto: tras reconectar (o reiniciar el servidor) se encuentra el parcial
+            self.manifest_id = manifest_id(sender, recipient, file_name, size, chunk_size, chunk_hashes)
+            self.received_digests = None
+            self.content_id = content_id(size, chunk_size, chunk_hashes)
+            self.temp_path = os.path.join(directory, f"{STATE_PREFIX}{self.manifest_id}.part")
+            self.state_path = os.path.join(directory, f"{STATE_PREFIX}{self.manifest_id}{STATE_SUFFIX}")
+            # Al reanudar, la subida renueva la reserva de su parcial en vez de sumar otra
+            self.reservation_id = self.manifest_id
+
+    @classmethod
+    def from_size(cls, directory, file_name, sender, recipient, size, chunk_size, chunk_hashes=None,
+                  reservation_id=None):
+        return cls(directory, file_name, sender, recipient, check_upload(size, chunk_size, chunk_hashes), chunk_size,
+                   size, chunk_hashes, reservation_id)
+
+    @classmethod
+    def load(cls, state_path):
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+        transfer = cls.from_size(os.path.dirname(state_path), state['file_name'], state['sender'],
+                                 state['recipient'], state['size'], state['chunk_size'], state['chunk_hashes'])
+        if transfer.state_path != state_path:
+            raise ValueError(f"El estado {state_path} no corresponde a su manifiesto")
+        if not os.path.exists(transfer.temp_path):
+            raise ValueError(f"Falta el archivo parcial {transfer.temp_path}")
+        transfer.chunks.load(bytes.fromhex(state['chunks']))
+        return transfer
+
+    @property
+    def resumable(self):
+        return self.manifest_id is not None
+
+    @property
+    def complete(self):
+        return self.chunks.missing == 0
+
+    def open(self):
+        self.fd = os.open(self.temp_path, os.O_RDWR | os.O_CREAT, 0o600)
+        if self.size and os.fstat(self.fd).st_size < self.size:
+            self.preallocate(self.size)
+
+    def preallocate(self, size):
+        try:
+            os.posix_fallocate(self.fd, 0, size)
+        except (AttributeError, OSError):
+            # Sin fallocate (u otro sistema de archivos) basta con fijar la longitud
+            os.ftruncate(self.fd, size)
+
+    def expected_length(self, index):
+        if self.size is None:
+            return None if index == self.chunks.count - 1 else self.chunk_size
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def write_chunk(self, index, data):
+        if not 0 <= index < self.chunks.count:
+            raise ValueError(f"Chunk {index} de {self.file_name} fuera de rango (0-{self.chunks.count - 1})")
+        expected = self.expected_length(index)
+        if expected is None:
+            if not 0 < len(data) <= self.chunk_size:
+                raise ValueError(f"Último chunk de {self.file_name} con {len(data)} bytes")
+        elif len(data) != expected:
+            raise ValueError(f"Chunk {index} de {self.file_name} con {len(data)} bytes, se esperaban {expected}")
+        if index in self.chunks:
+            # Un chunk repetido no se vuelve a escribir ni cuenta dos veces
+            return False
+        digest = hashlib.sha256(data).digest()
+        if self.chunk_hashes is not None and digest.hex() != self.chunk_hashes[index]:
+            raise ValueError(f"El chunk {index} de {self.file_name} no coincide con el hash del manifiesto")
+        with self.lock:
+            if not self.active:
+                raise ValueError(f"La transferencia de {self.file_name} ya terminó")
+            if index in self.chunks:
+                return False
+            if self.fd is None:
+                self.open()
+            offset = index * self.chunk_size
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                offset += written
+                view = view[written:]
+            self.chunks.add(index)
+            if self.received_digests is not None:
+                self.received_digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE] = digest
+                self.received_size += len(data)
+            if self.resumable and time.monotonic() - self.saved_at >= STATE_SAVE_INTERVAL:
+                self.save_state()
+        return True
+
+    def write_at(self, offset, data):
+        if offset % self.chunk_size:
+            raise ValueError(f"Offset {offset} no alineado a chunks de {self.chunk_size} bytes")
+        return self.write_chunk(offset // self.chunk_size, data)
+
+    def save_state(self):
+        # Los bits se guardan después de escribir los datos: un chunk marcado siempre está en el parcial
+        state = {
+            'file_name': self.file_name,
+            'sender': self.sender,
+            'recipient': self.recipient,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunk_hashes': self.chunk_hashes,
+            'chunks': self.chunks.bits.hex()
+        }
+        temp_state = self.state_path + '.tmp'
+        with open(temp_state, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temp_state, self.state_path)
+        self.saved_at = time.monotonic()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def deactivate(self):
+        # Después de esto ninguna conexión de datos puede escribir: el descriptor se cierra o se reutiliza
+        with self.lock:
+            self.active = False
+            if self.fd is not None and self.resumable:
+                os.fsync(self.fd)
+            self.close()
+
+    def suspend(self):
+        # La transferencia queda en disco para reanudarla desde otra conexión
+        self.deactivate()
+        self.save_state()
+
+    def finish(self, store):
+        # El archivo pasa al almacén con un nombre por contenido: dos subidas con el mismo nombre no se pisan
+        if self.size == 0:
+            # Un archivo vacío no tiene chunks: ninguna escritura creó el temporal
+            with self.lock:
+                self.open()
+        self.deactivate()
+        if self.content_id is None:
+            # Sin manifiesto el contenido solo se conoce al terminar; el mismo id que si el cliente lo hubiera enviado
+            self.content_id = digests_content_id(self.received_size, self.chunk_size, self.received_digests)
+        delivered = store.add(self.temp_path, self.content_id, self.sender, self.recipient, self.file_name,
+                              self.reservation_id)
+        if self.state_path:
+            remove_quietly(self.state_path)
+        return delivered
+
+    def discard(self):
+        self.deactivate()
+        remove_quietly(self.temp_path)
+        if self.state_path:
+            remove_quietly(self.state_path)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.error(f"No se pudo borrar {path}: {e}")
+
+
+def find_partial_transfer(directory, transfer_id):
+    state_path = os.path.join(directory, f"{STATE_PREFIX}{transfer_id}{STATE_SUFFIX}")
+    if not os.path.exists(state_path):
+        return None
+    try:
+        return IncomingFile.load(state_path)
+    except Exception as e:
+        logging.error(f"Estado de transferencia ilegible {state_path}: {e}")
+        return None
+
+
+def prune_partial_transfers(directory, max_age=PARTIAL_TRANSFER_TTL):
+    # Se borran los parciales que nadie reanudó a tiempo; el estado se reescribe mientras llegan chunks
+    now = time.time()
+    for name in os.listdir(directory):
+        if not name.startswith(STATE_PREFIX) or not name.endswith(('.part', STATE_SUFFIX)):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            expired = now - os.path.getmtime(path) > max_age
+        except OSError:
+            continue
+        if expired:
+            logging.info(f"Transferencia parcial caducada: {name}")
+            remove_quietly(path)
+
+
+def file_range_frames(download_id, offset, end):
+    # Cabecera de cada frame y el tramo del archivo que va detrás, que se envía con sendfile
+    while offset < end:
+        length = min(DOWNLOAD_FRAME_SIZE, end - offset)
+        yield encode_file_chunk_header(download_id, offset, length), offset, length
+        offset += length
+
+
+def send_file_range(sock, file, download_id, offset, end):
+    for header, chunk_offset, length in file_range_frames(download_id, offset, end):
+        sock.sendall(header)
+        # sendfile copia desde la caché de páginas al socket sin pasar los datos por el proceso
+        if sock.sendfile(file, chunk_offset, length) != length:
+            raise ConnectionError(f"Se enviaron menos de {length} bytes desde el offset {chunk_offset}")
+
+
+class FileDownload:
+    def __init__(self, directory, file_id, file_name, size):
+        self.directory = directory
+        self.file_name = os.path.basename(file_name)
+        self.size = size
+        self.temp_path = os.path.join(directory, f".download_{file_id}.part")
+        self.state_path = os.path.join(directory, f".download_{file_id}{STATE_SUFFIX}")
+        # Un bit por frame del servidor: varias conexiones escriben tramos distintos en cualquier orden
+        self.pieces = ChunkBitmap((size + DOWNLOAD_FRAME_SIZE - 1) // DOWNLOAD_FRAME_SIZE)
+        self.lock = threading.Lock()
+        self.saved_at = 0
+        self.fd = os.open(self.temp_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            with open(self.state_path) as state_file:
+                self.pieces.load(bytes.fromhex(json.load(state_file)['pieces']))
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            # Sin un estado válido no se sabe qué partes del parcial están escritas: se descarga entero
+            logging.error(f"Estado de descarga ilegible {self.state_path}: {e}")
+        os.ftruncate(self.fd, size)
+
+    @property
+    def complete(self):
+        return self.pieces.missing == 0
+
+    @property
+    def received(self):
+        received = (self.pieces.count - self.pieces.missing) * DOWNLOAD_FRAME_SIZE
+        if self.pieces.count and self.pieces.count - 1 in self.pieces:
+            # El último frame es más corto
+            received -= self.pieces.count * DOWNLOAD_FRAME_SIZE - self.size
+        return received
+
+    def missing_ranges(self, range_size=None):
+        # Rangos de bytes [inicio, fin) que faltan, partidos en tramos de como mucho range_size bytes alineados
+        # a los frames del servidor
+        step = max(1, range_size // DOWNLOAD_FRAME_SIZE) if range_size else max(1, self.pieces.count)
+        ranges = []
+        for start, end in self.pieces.missing_ranges():
+            for first in range(start, end, step):
+                last = min(first + step, end)
+                ranges.append([first * DOWNLOAD_FRAME_SIZE, min(last * DOWNLOAD_FRAME_SIZE, self.size)])
+        return ranges
+
+    def has_range(self, offset, end):
+        return all(index in self.pieces for index in range(offset // DOWNLOAD_FRAME_SIZE,
+                                                           (end + DOWNLOAD_FRAME_SIZE - 1) // DOWNLOAD_FRAME_SIZE))
+
+    def write_at(self, offset, data):
+        if offset % DOWNLOAD_FRAME_SIZE or not 0 <= offset < self.size:
+            raise ValueError(f"Datos de {self.file_name} en el offset {offset}, fuera de sus frames")
+        index = offset // DOWNLOAD_FRAME_SIZE
+        expected = min(DOWNLOAD_FRAME_SIZE, self.size - offset)
+        if len(data) != expected:
+            raise ValueError(f"Frame de {self.file_name} en el offset {offset} con {len(data)} bytes, se esperaban "
+                             f"{expected}")
+        if index in self.pieces:
+            return False
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            offset += written
+            view = view[written:]
+        with self.lock:
+            # Como al subir: el bit se guarda después de escribir los datos
+            self.pieces.add(index)
+            if time.monotonic() - self.saved_at >= STATE_SAVE_INTERVAL:
+                self.save_state()
+        return True
+
+    def save_state(self):
+        temp_state = self.state_path + '.tmp'
+        with open(temp_state, 'w') as state_file:
+            json.dump({'pieces': self.pieces.bits.hex()}, state_file)
+        os.replace(temp_state, self.state_path)
+        self.saved_at = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                # Lo recibido hasta aquí se conserva para la próxima descarga del mismo archivo
+                self.save_state()
+                os.close(self.fd)
+                self.fd = None
+
+    def finish(self):
+        self.close()
+        base, extension = os.path.splitext(self.file_name)
+        path = os.path.join(self.directory, self.file_name)
+        copy = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{base} ({copy}){extension}")
+            copy += 1
+        os.replace(self.temp_path, path)
+        remove_quietly(self.state_path)
+        return path
+
+
+def receive_file(sock, download, download_id, file_id, handle_chunk, ranges=None):
+    # Pide cada rango (por defecto, todo lo que falta) y pasa cada frame de datos a handle_chunk hasta tenerlo entero
+    codec = get_codec(CODEC_JSON)
+    reader = BinaryFrameReader(sock)
+    for offset, end in download.missing_ranges() if ranges is None else ranges:
+        request = {'type': 'get_file', 'download_id': download_id, 'file_id': file_id, 'offset': offset,
+                   'length': end - offset}
+        sock.sendall(encode_frame(FRAME_MESSAGE, codec.encode(request), flags=CODEC_JSON))
+        while not download.has_range(offset, end):
+            reader.fill()
+            for frame in reader.frames():
+                if frame.type == FRAME_MESSAGE:
+                    reply = get_codec(frame.flags & FLAG_CODEC_MASK).decode(frame.payload)
+                    if reply.get('error'):
+                        raise ValueError(reply['error'])
+                elif frame.type == FRAME_FILE_CHUNK:
+                    handle_chunk(download, frame.payload)
+
+
+def receive_file_parallel(sockets, download, download_id, file_id, handle_chunk, range_size=DOWNLOAD_RANGE_SIZE):
+    # Como send_file_chunks al subir: cada conexión pide el siguiente tramo que falta, así que las más rápidas
+    # descargan más. Una conexión que falla deja sin marcar su tramo y el siguiente intento lo vuelve a pedir
+    ranges = iter(download.missing_ranges(range_size))
+    lock = threading.Lock()
+    errors = []
+
+    def fetch(sock):
+        try:
+            while not errors:
+                with lock:
+                    next_range = next(ranges, None)
+                if next_range is None:
+                    return
+                receive_file(sock, download, download_id, file_id, handle_chunk, [next_range])
+        except Exception as e:
+            errors.append(e)
+
+    if len(sockets) == 1:
+        fetch(sockets[0])
+    else:
+        threads = [threading.Thread(target=fetch, args=(sock,), daemon=True) for sock in sockets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+
+def open_data_channel(host, port, session_token):
+    # Conexión adicional de la misma sesión: solo lleva frames FRAME_FILE_CHUNK
+    sock = socket.create_connection((host, port))
+    hello = {'data_channel': session_token}
+    sock.sendall(encode_preamble(PROTOCOL_V2, CODEC_JSON) +
+                 encode_frame(FRAME_HELLO, get_codec(CODEC_JSON).encode(hello), flags=CODEC_JSON))
+    parse_preamble(recv_exact(sock, PREAMBLE.size))
+    return sock
+
+
+def send_file_chunks(sockets, file_path, transfer_id, chunk_size, size, missing, send_lock=None, window=None,
+                     compressor=None):
+    # Cada conexión toma el siguiente chunk pendiente: las más rápidas envían más y el servidor los acepta en
+    # cualquier orden. Con window, los chunks van por su propio stream y solo se envían con crédito: en la
+    # conexión del chat nunca hay más de una ventana de datos del archivo por delante de un mensaje. La ventana
+    # cuenta bytes sin comprimir, igual que el servidor al devolver el crédito
+    stream_id = window.stream_id if window else 0
+    if compressor is not None:
+        with open(file_path, 'rb') as file:
+            if is_compressed_media(file.read(16)):
+                # Imágenes, vídeo o archivos ya comprimidos: ningún chunk se intenta comprimir
+                compressor = None
+    indexes = (index for start, end in missing for index in range(start, end))
+    lock = threading.Lock()
+    errors = []
+
+    def upload(sock):
+        try:
+            with open(file_path, 'rb') as file:
+                while not errors:
+                    with lock:
+                        index = next(indexes, None)
+                    if index is None:
+                        return
+                    offset = index * chunk_size
+                    chunk = os.pread(file.fileno(), min(chunk_size, size - offset), offset)
+                    if window:
+                        window.acquire(FILE_CHUNK.size + len(chunk), STREAM_CREDIT_TIMEOUT)
+                    buffers = encode_file_chunk(transfer_id, offset, chunk, stream_id, compressor)
+                    if send_lock is None:
+                        send_buffers(sock, buffers)
+                    else:
+                        with send_lock:
+                            send_buffers(sock, buffers)
+        except Exception as e:
+            errors.append(e)
+
+    if len(sockets) == 1:
+        upload(sockets[0])
+    else:
+        threads = [threading.Thread(target=upload, args=(sock,), daemon=True) for sock in sockets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,241 @@
+import socket
+import struct
+from collections import namedtuple
+
+from compression import decompress
+
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+RECV_SIZE = 64 * 1024
+
+# v1: JSON delimitado por salto de línea; v2: frames binarios con longitud
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+PROTOCOL_VERSION = PROTOCOL_V2
+# Un cliente v1 empieza enviando su nombre de usuario, que nunca comienza con un byte nulo
+PROTOCOL_MAGIC = b'\x00RCS'
+# magic, versión, códec preferido (cliente) o elegido (servidor)
+PREAMBLE = struct.Struct('!4sBB')
+
+# tipo, flags, stream, longitud del payload
+HEADER = struct.Struct('!BBHI')
+FRAME_MESSAGE = 1
+FRAME_HELLO = 2
+FRAME_FILE_CHUNK = 3
+# Crédito para un stream: el emisor puede enviar tantos bytes más de payload en el stream de la cabecera
+FRAME_WINDOW_UPDATE = 4
+
+# Cabecera de los datos de un archivo: id de transferencia, offset y longitud; los bytes van detrás, sin codificar
+FILE_CHUNK = struct.Struct('!IQI')
+WINDOW_UPDATE = struct.Struct('!I')
+
+# Capacidades opcionales que se anuncian en el hello; el servidor responde con las que acepta
+CAPABILITIES = ['avatar_request', 'user_deltas', 'avatar_fetch', 'file_frames', 'file_resume', 'file_channels',
+                'file_download', 'streams']
+
+# Los dos bits bajos de flags indican el códec del payload y los dos siguientes si va comprimido y con qué
+FLAG_CODEC_MASK = 0x03
+FLAG_COMPRESSION_MASK = 0x0C
+FLAG_COMPRESSION_SHIFT = 2
+
+Frame = namedtuple('Frame', ['type', 'flags', 'stream_id', 'payload'])
+
+
+def encode_preamble(version=PROTOCOL_VERSION, codec_id=0):
+    return PREAMBLE.pack(PROTOCOL_MAGIC, version, codec_id)
+
+
+def parse_preamble(data):
+    magic, version, codec_id = PREAMBLE.unpack(data)
+    if magic != PROTOCOL_MAGIC:
+        raise ValueError("Preámbulo de protocolo inválido")
+    return version, codec_id
+
+
+def negotiate_version(version):
+    # El preámbulo solo existe desde v2: una versión menor no se puede atender con frames binarios ni con líneas
+    if version < PROTOCOL_V2:
+        raise ValueError(f"Versión de protocolo {version} no soportada en el preámbulo (mínimo v{PROTOCOL_V2})")
+    return min(version, PROTOCOL_VERSION)
+
+
+def is_preamble_start(data):
+    return data[:1] == PROTOCOL_MAGIC[:1]
+
+
+def encode_frame(frame_type, payload, stream_id=0, flags=0):
+    return HEADER.pack(frame_type, flags, stream_id, len(payload)) + payload
+
+
+def compression_flags(compression_id):
+    return compression_id << FLAG_COMPRESSION_SHIFT
+
+
+def frame_message(payload, version, codec_id=0, compressor=None):
+    if version >= PROTOCOL_V2:
+        flags = codec_id
+        if compressor is not None:
+            payload, compression_id = compressor.compress(payload)
+            flags |= compression_flags(compression_id)
+        return encode_frame(FRAME_MESSAGE, payload, flags=flags)
+    return payload + b'\n'
+
+
+def encode_file_chunk_header(transfer_id, offset, length, stream_id=0):
+    # Solo la cabecera: los datos se envían tal cual a continuación, sin copiarlos a un frame nuevo
+    return (HEADER.pack(FRAME_FILE_CHUNK, 0, stream_id, FILE_CHUNK.size + length) +
+            FILE_CHUNK.pack(transfer_id, offset, length))
+
+
+def encode_file_chunk(transfer_id, offset, data, stream_id=0, compressor=None):
+    # Buffers del frame: cabecera y datos sin copiar, o cabecera y payload comprimido si compensa
+    if compressor is not None:
+        payload = compressor.try_compress(data, FILE_CHUNK.pack(transfer_id, offset, len(data)))
+        if payload is not None:
+            return [HEADER.pack(FRAME_FILE_CHUNK, compression_flags(compressor.compression_id), stream_id,
+                                len(payload)), payload]
+    return [encode_file_chunk_header(transfer_id, offset, len(data), stream_id), data]
+
+
+def parse_file_chunk(payload):
+    transfer_id, offset, length = FILE_CHUNK.unpack_from(payload)
+    data = memoryview(payload)[FILE_CHUNK.size:]
+    if len(data) != length:
+        raise ValueError(f"Chunk de archivo con {len(data)} bytes, se anunciaron {length}")
+    return transfer_id, offset, data
+
+
+def encode_window_update(stream_id, increment):
+    return encode_frame(FRAME_WINDOW_UPDATE, WINDOW_UPDATE.pack(increment), stream_id)
+
+
+def parse_window_update(payload):
+    return WINDOW_UPDATE.unpack(payload)[0]
+
+
+def send_buffers(sock, buffers):
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if views:
+            views[0] = views[0][sent:]
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Conexión cerrada por el otro extremo.")
+        data += chunk
+    return data
+
+
+class FrameReader:
+    def __init__(self, sock=None, max_frame_size=MAX_FRAME_SIZE, recv_size=RECV_SIZE):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self.recv_size = recv_size
+        self.buffer = bytearray(recv_size)
+        # Datos válidos en buffer[start:end]; scan marca hasta dónde ya se buscó un delimitador
+        self.start = 0
+        self.end = 0
+        self.scan = 0
+
+    def reserve(self, size):
+        if len(self.buffer) - self.end >= size:
+            return
+        pending = self.end - self.start
+        if pending + size <= len(self.buffer) // 2:
+            # Compactar solo cuando libera al menos la mitad del buffer mantiene el coste lineal
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        else:
+            buffer = bytearray(max(len(self.buffer) * 2, (pending + size) * 2))
+            buffer[:pending] = memoryview(self.buffer)[self.start:self.end]
+            self.buffer = buffer
+        self.scan -= self.start
+        self.start = 0
+        self.end = pending
+
+    def fill(self):
+        self.reserve(self.recv_size)
+        with memoryview(self.buffer) as view:
+            received = self.sock.recv_into(view[self.end:], self.recv_size)
+        if not received:
+            raise ConnectionError("Conexión cerrada por el otro extremo.")
+        self.end += received
+        return received
+
+    def fill_nowait(self):
+        # Solo lo que ya está en el buffer del socket; 0 si no hay nada, sin esperar
+        self.reserve(self.recv_size)
+        try:
+            with memoryview(self.buffer) as view:
+                received = self.sock.recv_into(view[self.end:], self.recv_size, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return 0
+        if not received:
+            raise ConnectionError("Conexión cerrada por el otro extremo.")
+        self.end += received
+        return received
+
+    def feed(self, data):
+        self.reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        frames = []
+        buffer = self.buffer
+        start = self.start
+        end = self.end
+        # Un solo recorrido sobre los datos nuevos: cada byte se examina y se copia una vez
+        with memoryview(buffer) as view:
+            index = buffer.find(b'\n', self.scan, end)
+            while index >= 0:
+                frames.append(bytes(view[start:index]))
+                start = index + 1
+                index = buffer.find(b'\n', start, end)
+        if start == end:
+            self.start = self.end = self.scan = 0
+        else:
+            self.start = start
+            self.scan = end
+            if end - start > self.max_frame_size:
+                raise ValueError(f"Frame de más de {self.max_frame_size} bytes sin delimitador")
+        return frames
+
+
+class BinaryFrameReader(FrameReader):
+    def frames(self):
+        frames = []
+        buffer = self.buffer
+        start = self.start
+        end = self.end
+        missing = 0
+        with memoryview(buffer) as view:
+            while end - start >= HEADER.size:
+                frame_type, flags, stream_id, length = HEADER.unpack_from(buffer, start)
+                if length > self.max_frame_size:
+                    raise ValueError(f"Frame de {length} bytes supera el máximo de {self.max_frame_size}")
+                body = start + HEADER.size
+                if end - body < length:
+                    missing = length - (end - body)
+                    break
+                payload = bytes(view[body:body + length])
+                if flags & FLAG_COMPRESSION_MASK:
+                    # Quien lee el frame ve el payload original; el tamaño descomprimido también tiene límite
+                    payload = decompress((flags & FLAG_COMPRESSION_MASK) >> FLAG_COMPRESSION_SHIFT, payload,
+                                         self.max_frame_size)
+                    flags &= ~FLAG_COMPRESSION_MASK
+                frames.append(Frame(frame_type, flags, stream_id, payload))
+                start = body + length
+        if start == end:
+            self.start = self.end = 0
+        else:
+            self.start = start
+        if missing:
+            # Reservar de una vez el resto del payload evita crecer el buffer en cada recv
+            self.reserve(missing)
+        return frames
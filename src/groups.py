@@ -0,0 +1,73 @@
+import threading
+from collections import defaultdict
+
+
+class GroupRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.members = {}
+        # Índice inverso: desconectar a un usuario solo recorre sus grupos, no todos
+        self.user_groups = defaultdict(set)
+        # Por grupo, los clientes conectados a este servidor y el resto de miembros, listos para el reparto
+        self.online_cache = {}
+
+    def __contains__(self, group_name):
+        return group_name in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def names(self):
+        with self.lock:
+            return list(self.members)
+
+    def items(self):
+        with self.lock:
+            return [(group_name, sorted(members)) for group_name, members in self.members.items()]
+
+    def members_of(self, group_name):
+        with self.lock:
+            return set(self.members[group_name])
+
+    def create(self, group_name, members):
+        with self.lock:
+            if group_name in self.members:
+                return False
+            self.members[group_name] = set(members)
+            for member in self.members[group_name]:
+                self.user_groups[member].add(group_name)
+            return True
+
+    def remove_user(self, username):
+        # Devuelve los grupos que quedaron vacíos y se eliminaron
+        removed = []
+        with self.lock:
+            for group_name in self.user_groups.pop(username, ()):
+                members = self.members[group_name]
+                members.discard(username)
+                self.online_cache.pop(group_name, None)
+                if not members:
+                    del self.members[group_name]
+                    removed.append(group_name)
+        return removed
+
+    def invalidate_user(self, username):
+        # Se llama cuando el usuario se conecta o desconecta de este servidor
+        with self.lock:
+            for group_name in self.user_groups.get(username, ()):
+                self.online_cache.pop(group_name, None)
+
+    def online(self, group_name, clients):
+        with self.lock:
+            cached = self.online_cache.get(group_name)
+            if cached is None:
+                local = []
+                remote = []
+                for member in self.members[group_name]:
+                    client = clients.get(member)
+                    if client is not None:
+                        local.append(client)
+                    else:
+                        remote.append(member)
+                cached = self.online_cache[group_name] = (local, remote)
+            return cached
@@ -0,0 +1,171 @@
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CODEC_JSON = 0
+CODEC_BINARY = 1
+CODEC_MSGPACK = 2
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_BIGINT = 4
+TAG_FLOAT = 5
+TAG_STR = 6
+TAG_SHORT_STR = 7
+TAG_BYTES = 8
+TAG_LIST = 9
+TAG_DICT = 10
+
+INT = struct.Struct('!q')
+FLOAT = struct.Struct('!d')
+LENGTH = struct.Struct('!I')
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+
+class JsonCodec:
+    codec_id = CODEC_JSON
+    name = 'json'
+
+    def encode(self, message):
+        return json.dumps(message).encode('utf-8')
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+class BinaryCodec:
+    codec_id = CODEC_BINARY
+    name = 'binary'
+
+    def encode(self, message):
+        parts = []
+        self.encode_value(message, parts.append)
+        return b"".join(parts)
+
+    def encode_value(self, value, write):
+        # bool antes que int: True y False también son instancias de int
+        if value is None:
+            write(b'\x00')
+        elif value is True:
+            write(b'\x02')
+        elif value is False:
+            write(b'\x01')
+        elif isinstance(value, str):
+            data = value.encode('utf-8')
+            if len(data) < 256:
+                write(bytes((TAG_SHORT_STR, len(data))))
+            else:
+                write(bytes((TAG_STR,)) + LENGTH.pack(len(data)))
+            write(data)
+        elif isinstance(value, int):
+            if INT_MIN <= value <= INT_MAX:
+                write(bytes((TAG_INT,)) + INT.pack(value))
+            else:
+                digits = str(value).encode('ascii')
+                write(bytes((TAG_BIGINT,)) + LENGTH.pack(len(digits)) + digits)
+        elif isinstance(value, float):
+            write(bytes((TAG_FLOAT,)) + FLOAT.pack(value))
+        elif isinstance(value, dict):
+            write(bytes((TAG_DICT,)) + LENGTH.pack(len(value)))
+            for key, item in value.items():
+                self.encode_value(key, write)
+                self.encode_value(item, write)
+        elif isinstance(value, (list, tuple)):
+            write(bytes((TAG_LIST,)) + LENGTH.pack(len(value)))
+            for item in value:
+                self.encode_value(item, write)
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            write(bytes((TAG_BYTES,)) + LENGTH.pack(len(value)))
+            write(bytes(value))
+        else:
+            raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+    def decode(self, payload):
+        value, offset = self.decode_value(payload, 0)
+        if offset != len(payload):
+            raise ValueError("Bytes sobrantes al final del mensaje")
+        return value
+
+    def decode_value(self, data, offset):
+        tag = data[offset]
+        offset += 1
+        if tag == TAG_SHORT_STR:
+            end = offset + 1 + data[offset]
+            return bytes(data[offset + 1:end]).decode('utf-8'), end
+        if tag == TAG_INT:
+            return INT.unpack_from(data, offset)[0], offset + INT.size
+        if tag == TAG_DICT:
+            count = LENGTH.unpack_from(data, offset)[0]
+            offset += LENGTH.size
+            result = {}
+            for _ in range(count):
+                key, offset = self.decode_value(data, offset)
+                result[key], offset = self.decode_value(data, offset)
+            return result, offset
+        if tag == TAG_LIST:
+            count = LENGTH.unpack_from(data, offset)[0]
+            offset += LENGTH.size
+            result = []
+            for _ in range(count):
+                item, offset = self.decode_value(data, offset)
+                result.append(item)
+            return result, offset
+        if tag in (TAG_STR, TAG_BYTES, TAG_BIGINT):
+            length = LENGTH.unpack_from(data, offset)[0]
+            start = offset + LENGTH.size
+            value = bytes(data[start:start + length])
+            if len(value) != length:
+                raise ValueError("Mensaje truncado")
+            if tag == TAG_STR:
+                return value.decode('utf-8'), start + length
+            if tag == TAG_BIGINT:
+                return int(value.decode('ascii')), start + length
+            return value, start + length
+        if tag == TAG_NONE:
+            return None, offset
+        if tag == TAG_TRUE:
+            return True, offset
+        if tag == TAG_FALSE:
+            return False, offset
+        if tag == TAG_FLOAT:
+            return FLOAT.unpack_from(data, offset)[0], offset + FLOAT.size
+        raise ValueError(f"Etiqueta desconocida en el mensaje: {tag}")
+
+
+class MsgpackCodec:
+    codec_id = CODEC_MSGPACK
+    name = 'msgpack'
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+CODECS = {codec.codec_id: codec for codec in [JsonCodec(), BinaryCodec()]}
+if msgpack is not None:
+    CODECS[CODEC_MSGPACK] = MsgpackCodec()
+
+CODEC_NAMES = {codec.name: codec_id for codec_id, codec in CODECS.items()}
+
+# Preferencia por defecto de los clientes: el backend acelerado si está instalado, si no JSON
+DEFAULT_CODEC = CODEC_MSGPACK if msgpack is not None else CODEC_JSON
+
+
+def get_codec(codec_id):
+    codec = CODECS.get(codec_id)
+    if codec is None:
+        raise ValueError(f"Códec desconocido: {codec_id}")
+    return codec
+
+
+def choose_codec(requested):
+    return requested if requested in CODECS else CODEC_JSON
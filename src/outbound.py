@@ -0,0 +1,432 @@
+import bisect
+import logging
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import Counter, deque, namedtuple
+
+from fairness import FairnessPolicy
+from framing import PROTOCOL_V1, frame_message
+from message_codec import CODEC_JSON, get_codec
+
+OutboundFrame = namedtuple('OutboundFrame', ['data', 'kind', 'key', 'queued_at'])
+
+# Tamaño máximo que un escritor saca de la cola de una vez; el resto sigue contando contra los límites
+WRITE_BATCH_BYTES = 256 * 1024
+
+# Clases de prioridad estricta, de mayor a menor; un kind desconocido cuenta como chat
+PRIORITY_CLASSES = ('control', 'chat', 'file', 'video')
+# Clases masivas: si su frame más antiguo espera demasiado, sale uno por lote aunque haya frames más prioritarios
+BULK_CLASSES = ('file', 'video')
+# Límites (ms) del histograma de espera en cola por clase
+DELAY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+def send_views(sock, views):
+    # Un solo sendmsg escribe varios frames sin copiarlos a un buffer intermedio; devuelve cuántos
+    # buffers completos se enviaron y deja en views el resto del primero a medio enviar
+    sent = sock.sendmsg(views[:IOV_MAX], [], socket.MSG_DONTWAIT)
+    index = 0
+    while sent:
+        size = len(views[index])
+        if sent >= size:
+            sent -= size
+            index += 1
+        else:
+            views[index] = views[index][sent:]
+            sent = 0
+    return index
+
+
+class EncodedMessage:
+    def __init__(self, message):
+        self.message = message
+        self.frames = {}
+
+    def frame_for(self, client):
+        # Se serializa, comprime y enmarca una vez por versión, códec y compresión; todos los destinatarios
+        # comparten los mismos bytes
+        compressor = client.compressor
+        key = (client.version, client.codec.codec_id, compressor.compression_id if compressor else None)
+        data = self.frames.get(key)
+        if data is None:
+            data = self.frames[key] = frame_message(client.codec.encode(self.message), client.version,
+                                                    client.codec.codec_id, compressor)
+        return data
+
+
+class OutboundLimits:
+    def __init__(self, max_bytes=8 * 1024 * 1024, max_frames=10000, drop_ephemeral=True, drop_video=True,
+                 disconnect_after=30.0, starvation_delay=0.2):
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.drop_ephemeral = drop_ephemeral
+        self.drop_video = drop_video
+        self.disconnect_after = disconnect_after
+        self.starvation_delay = starvation_delay
+
+
+class OutboundStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        # Por clase: frames, suma y máximo de la espera en cola, e histograma por DELAY_BUCKETS_MS
+        self.delays = {name: [0, 0.0, 0.0, [0] * (len(DELAY_BUCKETS_MS) + 1)] for name in PRIORITY_CLASSES}
+        # Bytes escritos por usuario destinatario
+        self.sent_bytes = Counter()
+
+    def record(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def record_delays(self, priority_class, delays):
+        with self.lock:
+            entry = self.delays[priority_class]
+            for delay in delays:
+                delay_ms = delay * 1000
+                entry[0] += 1
+                entry[1] += delay_ms
+                entry[2] = max(entry[2], delay_ms)
+                entry[3][bisect.bisect_left(DELAY_BUCKETS_MS, delay_ms)] += 1
+
+    def record_sent(self, username, amount):
+        with self.lock:
+            self.sent_bytes[username] += amount
+
+    def forget(self, username):
+        with self.lock:
+            self.sent_bytes.pop(username, None)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def top_users(self, count=5):
+        with self.lock:
+            return dict(self.sent_bytes.most_common(count))
+
+    def delay_snapshot(self):
+        # El p99 es el límite del intervalo del histograma en el que cae
+        snapshot = {}
+        with self.lock:
+            for name, (frames, total, maximum, histogram) in self.delays.items():
+                if not frames:
+                    continue
+                seen = 0
+                p99 = maximum
+                for bucket, count in enumerate(histogram[:-1]):
+                    seen += count
+                    if seen >= frames * 0.99:
+                        p99 = min(DELAY_BUCKETS_MS[bucket], maximum)
+                        break
+                snapshot[name] = {'frames': frames, 'avg_ms': round(total / frames, 2), 'p99_ms': round(p99, 2),
+                                  'max_ms': round(maximum, 2)}
+        return snapshot
+
+
+class OutboundQueue:
+    def __init__(self, limits=None, stats=None, username=None, fairness=None):
+        # Una cola FIFO por clase de prioridad; el orden solo se conserva dentro de cada clase
+        self.queues = {name: deque() for name in PRIORITY_CLASSES}
+        self.frame_count = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.on_ready = None
+        self.on_overflow = None
+        self.limits = limits or OutboundLimits()
+        self.stats = stats or OutboundStats()
+        self.username = username
+        self.pending_bytes = 0
+        self.over_cap_since = None
+        # Deficit round robin entre destinatarios: bytes que este puede escribir en su próxima visita del escritor
+        self.write_share = (fairness or FairnessPolicy()).write_share(username)
+        self.deficit = 0
+
+    def put(self, data, kind='chat', key=None):
+        overflow = False
+        with self.condition:
+            if self.closed:
+                return False
+            frame = OutboundFrame(data, kind, key, time.monotonic())
+            self.queues[kind if kind in self.queues else 'chat'].append(frame)
+            self.frame_count += 1
+            self.pending_bytes += len(data)
+            if self.over_cap():
+                overflow = self.apply_policies(frame)
+            else:
+                self.over_cap_since = None
+            self.condition.notify()
+        if overflow:
+            self.close()
+            if self.on_overflow:
+                self.on_overflow()
+            return False
+        if self.on_ready:
+            self.on_ready()
+        return True
+
+    def over_cap(self):
+        return self.pending_bytes > self.limits.max_bytes or self.frame_count > self.limits.max_frames
+
+    def drop_frames(self, should_drop, counter):
+        dropped = 0
+        # Primero las clases menos prioritarias; dentro de cada una de la más antigua a la más nueva, y se deja
+        # de descartar en cuanto se baja del límite
+        for name in reversed(PRIORITY_CLASSES):
+            queue = self.queues[name]
+            kept = deque()
+            while queue:
+                frame = queue.popleft()
+                if self.over_cap() and should_drop(frame):
+                    self.pending_bytes -= len(frame.data)
+                    self.frame_count -= 1
+                    dropped += 1
+                else:
+                    kept.append(frame)
+            self.queues[name] = kept
+        if dropped:
+            self.stats.record(counter, dropped)
+            logging.warning(f"Cola de salida de {self.username} llena: {dropped} frames descartados ({counter})")
+
+    def apply_policies(self, latest):
+        limits = self.limits
+        key = latest.key
+        if limits.drop_ephemeral and key is not None:
+            # Un frame efímero (lista de usuarios, de grupos...) deja obsoletos los anteriores con la misma clave
+            self.drop_frames(lambda frame: frame.key == key and frame is not latest, 'ephemeral_dropped')
+        if limits.drop_video and self.over_cap():
+            self.drop_frames(lambda frame: frame.kind == 'video', 'video_dropped')
+        if not self.over_cap():
+            self.over_cap_since = None
+            return False
+        now = time.monotonic()
+        if self.over_cap_since is None:
+            self.over_cap_since = now
+            self.stats.record('over_cap')
+            logging.warning(f"Cola de salida de {self.username} por encima del límite "
+                            f"({self.pending_bytes} bytes, {self.frame_count} frames)")
+        elif limits.disconnect_after is not None and now - self.over_cap_since > limits.disconnect_after:
+            self.stats.record('disconnected')
+            logging.warning(f"Desconectando a {self.username}: más de {limits.disconnect_after}s "
+                            f"por encima del límite de salida")
+            return True
+        return False
+
+    def starved_class(self, now):
+        for name in BULK_CLASSES:
+            queue = self.queues[name]
+            if queue and now - queue[0].queued_at > self.limits.starvation_delay:
+                return name
+        return None
+
+    def pop_batch(self, max_bytes=WRITE_BATCH_BYTES):
+        with self.condition:
+            batch = []
+            size = 0
+            now = time.monotonic()
+            delays = {}
+            order = [(name, None) for name in PRIORITY_CLASSES]
+            starved = self.starved_class(now)
+            if starved:
+                # Un frame de una clase masiva que esperó demasiado entra en el lote aunque ya esté lleno, justo
+                # detrás de control y chat; el resto sigue la prioridad estricta
+                order.insert(PRIORITY_CLASSES.index('file'), (starved, 1))
+            for name, limit in order:
+                queue = self.queues[name]
+                taken = 0
+                while queue and (not batch or size < max_bytes or limit == 1) and taken != limit:
+                    frame = queue.popleft()
+                    batch.append(frame.data)
+                    size += len(frame.data)
+                    taken += 1
+                    delays.setdefault(name, []).append(now - frame.queued_at)
+                if batch and size >= max_bytes and (starved is None or name == starved):
+                    break
+            self.frame_count -= len(batch)
+            self.pending_bytes -= size
+            if self.over_cap_since is not None and not self.over_cap():
+                self.over_cap_since = None
+        for name, class_delays in delays.items():
+            self.stats.record_delays(name, class_delays)
+        return batch
+
+    def pop_fair_batch(self):
+        # Cada visita del escritor suma el quantum ponderado del usuario; con deuda de un lote grande, la visita
+        # se pierde (lista vacía con frames pendientes) y le toca a los demás
+        self.deficit += self.write_share
+        batch = self.pop_batch(self.deficit) if self.deficit > 0 else []
+        size = sum(map(len, batch))
+        self.deficit -= size
+        if size and not self.closed:
+            self.stats.record_sent(self.username, size)
+        if not self.frame_count:
+            # Cola vacía: no acumula crédito para después, pero conserva la deuda
+            self.deficit = min(self.deficit, 0)
+        return batch
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            for queue in self.queues.values():
+                queue.clear()
+            self.frame_count = 0
+            self.pending_bytes = 0
+            self.condition.notify_all()
+        # Los bytes enviados solo se cuentan mientras el cliente sigue conectado
+        self.stats.forget(self.username)
+        if self.on_ready:
+            self.on_ready()
+
+
+class Flusher:
+    # Un solo hilo escribe en todas las conexiones: repartir un mensaje a miles de clientes no despierta
+    # miles de hilos. Los sockets llenos esperan en el selector sin bloquear al resto.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = deque()
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self.signaled = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, client):
+        with self.lock:
+            if client.scheduled or client.blocked:
+                return
+            client.scheduled = True
+            self.ready.append(client)
+            if self.signaled:
+                return
+            self.signaled = True
+        try:
+            self.wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            pass
+
+    def discard(self, client):
+        with self.lock:
+            if client.blocked:
+                client.blocked = False
+                self.selector.unregister(client.socket)
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.wakeup_reader:
+                    try:
+                        while self.wakeup_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                with self.lock:
+                    if not key.data.blocked:
+                        continue
+                    key.data.blocked = False
+                    self.selector.unregister(key.fileobj)
+                self.flush(key.data)
+            with self.lock:
+                ready = self.ready
+                self.ready = deque()
+                self.signaled = False
+            for client in ready:
+                client.scheduled = False
+                self.flush(client)
+
+    def flush(self, client):
+        state = client.flush()
+        if state == 'blocked':
+            with self.lock:
+                if not client.outbound.closed:
+                    client.blocked = True
+                    self.selector.register(client.socket, selectors.EVENT_WRITE, client)
+        elif state == 'more':
+            # Cada cliente escribe un lote por vuelta para que uno con mucha cola no retrase a los demás
+            self.schedule(client)
+
+
+shared_flusher = None
+shared_flusher_lock = threading.Lock()
+
+
+def get_flusher():
+    global shared_flusher
+    with shared_flusher_lock:
+        if shared_flusher is None:
+            shared_flusher = Flusher()
+        return shared_flusher
+
+
+class QueuedClient:
+    def __init__(self, client_socket, username, limits=None, stats=None, version=PROTOCOL_V1, codec_id=CODEC_JSON,
+                 flusher=None, fairness=None):
+        self.socket = client_socket
+        self.username = username
+        self.version = version
+        self.codec = get_codec(codec_id)
+        self.capabilities = set()
+        # Compresión negociada en el hello; None hasta enviar el welcome, que siempre va sin comprimir
+        self.compressor = None
+        # Ventanas de recepción por stream, si el cliente negoció 'streams'
+        self.streams = None
+        self.outbound = OutboundQueue(limits, stats, username, fairness)
+        self.outbound.on_overflow = self.shutdown
+        self.flusher = flusher or get_flusher()
+        # Estado que solo toca el Flusher: lote a medio enviar y si está en la cola o esperando al socket
+        self.unsent = []
+        self.scheduled = False
+        self.blocked = False
+
+    def start(self):
+        self.outbound.on_ready = lambda: self.flusher.schedule(self)
+        self.flusher.schedule(self)
+
+    def send(self, payload, kind='chat', key=None):
+        return self.send_frame(frame_message(payload, self.version, self.codec.codec_id, self.compressor), kind,
+                               key)
+
+    def send_frame(self, data, kind='chat', key=None):
+        # Solo encola: quien envía nunca espera a la ventana TCP del destinatario
+        self.outbound.put(data, kind, key)
+        return len(data)
+
+    def flush(self):
+        try:
+            if not self.unsent:
+                if self.outbound.closed:
+                    return 'idle'
+                self.unsent = [memoryview(data) for data in self.outbound.pop_fair_batch()]
+            while self.unsent:
+                # El socket sigue en modo bloqueante para el hilo lector; MSG_DONTWAIT solo afecta a este envío
+                del self.unsent[:send_views(self.socket, self.unsent)]
+        except (BlockingIOError, InterruptedError):
+            return 'blocked'
+        except OSError as e:
+            logging.error(f"Error al escribir hacia {self.username}: {e}")
+            self.unsent = []
+            self.outbound.close()
+            self.shutdown()
+            return 'idle'
+        return 'more' if self.outbound.frame_count else 'idle'
+
+    def shutdown(self):
+        try:
+            # Despierta al hilo lector para que se ejecute la desconexión normal
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.outbound.close()
+        self.flusher.discard(self)
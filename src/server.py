@@ -1,80 +1,369 @@
+import argparse
 import socket
 import threading
 import json
 import base64
 import logging
 import os
+import secrets
+import time
+
+from avatar_store import MAX_AVATAR_BYTES, AvatarPipeline, AvatarStore
+from blob_store import (DEFAULT_MAX_AGE, DEFAULT_MAX_BYTES, DEFAULT_MAX_USER_BYTES, DEFAULT_MAX_USER_TRANSFERS,
+                        BlobStore, StorageLimits)
+from compression import COMPRESSION_NAMES, COMPRESSION_NONE, FrameCompressor, choose_compression, get_compression
+from fairness import FairnessPolicy, ReadScheduler, parse_assignments, parse_weight
+from file_transfer import (LEGACY_CHUNK_SIZE, IncomingFile, check_chunk_count, check_upload, content_id,
+                           find_partial_transfer, manifest_id, send_file_range)
+from framing import (CAPABILITIES, FLAG_CODEC_MASK, FRAME_FILE_CHUNK, FRAME_HELLO, FRAME_MESSAGE, PREAMBLE, PROTOCOL_V1,
+                     PROTOCOL_V2, BinaryFrameReader, FrameReader, encode_frame, encode_preamble, encode_window_update,
+                     is_preamble_start, negotiate_version, parse_file_chunk, parse_preamble, recv_exact)
+from groups import GroupRegistry
+from message_codec import CODEC_JSON, choose_codec, get_codec
+from outbound import EncodedMessage, OutboundLimits, OutboundStats, QueuedClient
+from streams import DEFAULT_STREAM_WINDOW, ReceiveWindows
 
 logging.basicConfig(level=logging.DEBUG)
 
 
 class ChatServer:
-    def __init__(self, host='localhost', port=14999):
+    def __init__(self, host='localhost', port=14999, backlog=5, reuse_port=False, outbound_limits=None,
+                 avatar_pipeline=None, data_port=None, fairness=None, compressions=None, storage_limits=None):
         self.host = host
         self.port = port
+        self.backlog = backlog
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            # Varios procesos escuchan en el mismo puerto y el kernel reparte las conexiones
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server_socket.bind((self.host, self.port))
+        self.data_socket = None
+        if data_port is not None:
+            # Puerto propio para las conexiones de datos: con varios workers deben llegar al que tiene la sesión
+            self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.data_socket.bind((self.host, data_port))
+        # Token de sesión → usuario, para autenticar las conexiones de datos adicionales
+        self.sessions = {}
+        self.session_tokens = {}
+        self.router = None
+        # Crédito inicial de cada stream de datos en la conexión del chat, anunciado en el welcome
+        self.stream_window = DEFAULT_STREAM_WINDOW
+        self.outbound_limits = outbound_limits or OutboundLimits()
+        self.outbound_stats = OutboundStats()
+        # Reparto del tiempo de lectura y del ancho de banda de salida entre usuarios, con pesos por clase
+        self.fairness = fairness or FairnessPolicy()
+        self.read_scheduler = ReadScheduler(self.fairness)
+        # Compresiones que el servidor acepta usar al enviar (None: todas las instaladas); al recibir se acepta
+        # cualquiera que pueda descomprimir
+        self.compressions = compressions
         self.clients = {}
-        self.groups = {}
-        self.profile_images = {}
-        self.file_chunks = {}
+        self.groups = GroupRegistry()
+        # Cada imagen de perfil se guarda una vez por hash; los usuarios solo guardan el hash
+        self.avatars = AvatarStore()
+        self.avatar_hashes = {}
+        # Las imágenes subidas se decodifican y reducen una sola vez, fuera del hilo de la conexión
+        self.avatar_pipeline = avatar_pipeline or AvatarPipeline()
+        # Cada cambio en la lista de usuarios incrementa la versión; los clientes detectan huecos con ella
+        self.user_list_version = 0
+        self.user_list_lock = threading.Lock()
+        # Transferencias en curso, escritas directamente a disco: (remitente, id de transferencia) para los
+        # frames binarios y (remitente, destinatario, nombre) para los mensajes 'file_chunk'
+        self.file_transfers = {}
+        # Chunks de la API base64 que llegan mientras el primero de su archivo reserva y lo crea
+        self.opening_transfers = {}
         self.received_files_dir = "received_files"
         os.makedirs(self.received_files_dir, exist_ok=True)
+        # Los archivos completos se guardan una vez por contenido, aunque se envíen a muchos destinatarios, con
+        # cuotas y expulsión en segundo plano; el índice evita recorrer el directorio al arrancar
+        self.storage = BlobStore(self.received_files_dir, storage_limits)
 
     def start(self):
-        self.server_socket.listen(5)
+        self.server_socket.listen(self.backlog)
+        if self.router:
+            self.router.start()
+        self.storage.start_eviction()
         logging.info(f"Servidor iniciado en {self.host}:{self.port}")
+        if self.data_socket:
+            self.data_socket.listen(self.backlog)
+            threading.Thread(target=self.accept_loop, args=(self.data_socket,), daemon=True).start()
+        self.accept_loop(self.server_socket)
+
+    def accept_loop(self, listener):
         while True:
-            client_socket, address = self.server_socket.accept()
+            client_socket, address = listener.accept()
             logging.info(f"Conexión aceptada de {address}")
             threading.Thread(target=self.handle_client, args=(client_socket,)).start()
 
     def handle_client(self, client_socket):
+        username = None
+        client = None
         try:
-            username = client_socket.recv(1024).decode('utf-8')
-            if not username:
-                raise ValueError("No se recibió un nombre de usuario.")
-
-            logging.info(f"Usuario {username} conectado desde {client_socket.getpeername()}")
-
-            self.clients[username] = client_socket
+            first = client_socket.recv(1024)
+            if is_preamble_start(first):
+                if len(first) < PREAMBLE.size:
+                    first += recv_exact(client_socket, PREAMBLE.size - len(first))
+                version, codec_id = parse_preamble(first[:PREAMBLE.size])
+                version = negotiate_version(version)
+                codec_id = choose_codec(codec_id)
+                client_socket.sendall(encode_preamble(version, codec_id))
+                reader = BinaryFrameReader(client_socket)
+                reader.feed(first[PREAMBLE.size:])
+                frames = reader.frames()
+                while not frames:
+                    reader.fill()
+                    frames = reader.frames()
+                hello = self.parse_hello(frames.pop(0))
+                if hello.get('data_channel'):
+                    self.handle_data_channel(hello['data_channel'], reader, frames)
+                    return
+                username = hello['username']
+                profile_image = None
+            else:
+                # Cliente v1: nombre de usuario e imagen llegan sin delimitar
+                version = PROTOCOL_V1
+                codec_id = CODEC_JSON
+                username = first.decode('utf-8')
+                if not username:
+                    raise ValueError("No se recibió un nombre de usuario.")
+                profile_image = client_socket.recv(1024 * 1024).decode('utf-8')
+                hello = None
+                reader = FrameReader(client_socket)
+                frames = []
 
-            profile_image = client_socket.recv(1024 * 1024).decode('utf-8')
-            self.profile_images[username] = profile_image
+            logging.info(f"Usuario {username} conectado desde {client_socket.getpeername()} "
+                         f"(protocolo v{version}, códec {get_codec(codec_id).name})")
 
-            self.broadcast_user_list()
+            client = QueuedClient(client_socket, username, self.outbound_limits, self.outbound_stats, version,
+                                  codec_id, fairness=self.fairness)
+            client.start()
+            self.register_client(username, client, profile_image, hello)
 
-            buffer = b""
+            handle_frame = self.handle_frame if version >= PROTOCOL_V2 else self.handle_line
+            received = 0
             while True:
-                chunk = client_socket.recv(4096)
-                if not chunk:
-                    raise ConnectionError("Cliente desconectado.")
+                self.handle_frames(username, reader, frames, received, handle_frame)
+                received = reader.fill()
 
                 logging.debug(f"Recibido chunk de {username}")
 
-                buffer += chunk
-                while b'\n' in buffer:
-                    message, buffer = buffer.split(b'\n', 1)
-                    try:
-                        data = json.loads(message.decode('utf-8'))
-                        self.process_message(username, data)
-                    except json.JSONDecodeError:
-                        # Si no es JSON, asumimos que es un chunk de archivo
-                        self.handle_file_chunk(username, message)
+                frames = reader.frames()
         except ConnectionError:
             logging.info(f"Usuario {username} desconectado.")
         except Exception as e:
             logging.error(f"Error en la conexión con {username}: {e}")
         finally:
-            self.disconnect_client(username)
+            if client:
+                client.close()
+            if username:
+                self.disconnect_client(username)
             client_socket.close()
 
+    def parse_hello(self, frame):
+        if frame.type != FRAME_HELLO:
+            raise ValueError(f"Se esperaba un frame hello y llegó el tipo {frame.type}")
+        hello = get_codec(frame.flags & FLAG_CODEC_MASK).decode(frame.payload)
+        if not hello.get('username') and not hello.get('data_channel'):
+            raise ValueError("No se recibió un nombre de usuario.")
+        return hello
+
+    def data_channel_user(self, token):
+        username = self.sessions.get(token)
+        if username is None:
+            raise ValueError("Conexión de datos con un token de sesión desconocido")
+        logging.info(f"Conexión de datos de {username} abierta")
+        return username
+
+    def handle_frames(self, username, reader, frames, received, handle_frame):
+        # Deficit round robin entre usuarios: se sigue leyendo mientras el socket ya tenga datos, y cuando el usuario
+        # gasta su crédito espera a la siguiente ronda. Quien sube sin parar se salta rondas y su socket se llena,
+        # así que TCP frena al emisor
+        self.read_scheduler.acquire(username)
+        try:
+            while True:
+                for frame in frames:
+                    handle_frame(username, frame)
+                has_credit = self.read_scheduler.charge(username, received)
+                received = reader.fill_nowait()
+                if not received:
+                    break
+                frames = reader.frames()
+                if not has_credit:
+                    self.read_scheduler.wait_round(username)
+        finally:
+            self.read_scheduler.release(username)
+
+    def handle_data_channel(self, token, reader, frames):
+        username = self.data_channel_user(token)
+        downloads = []
+
+        def handle_frame(username, frame):
+            if frame.type == FRAME_MESSAGE:
+                # Una descarga bloquea en sendfile: se sirve fuera del turno de lectura
+                downloads.append(frame)
+            else:
+                self.handle_data_frame(username, frame)
+
+        received = 0
+        try:
+            while True:
+                self.handle_frames(username, reader, frames, received, handle_frame)
+                while downloads:
+                    self.serve_download(username, reader.sock, downloads.pop(0))
+                received = reader.fill()
+                frames = reader.frames()
+        except ConnectionError:
+            logging.info(f"Conexión de datos de {username} cerrada")
+
+    def serve_download(self, username, sock, frame):
+        reply, download = self.open_download(username, frame)
+        sock.sendall(reply)
+        if download:
+            file, download_id, offset, end = download
+            with file:
+                send_file_range(sock, file, download_id, offset, end)
+            logging.info(f"Descarga de {username} enviada: bytes {offset}-{end}")
+
+    def open_download(self, username, frame):
+        # Devuelve la respuesta para el cliente y, si la petición es válida, el archivo y el rango a enviar
+        codec = get_codec(frame.flags & FLAG_CODEC_MASK)
+        data = codec.decode(frame.payload)
+        reply = {'type': 'file_download', 'download_id': data.get('download_id')}
+        file = None
+        try:
+            if data.get('type') != 'get_file':
+                raise ValueError(f"Mensaje {data.get('type')} en una conexión de datos")
+            delivered = self.storage.find(data['file_id'])
+            if delivered is None or delivered['recipient'] != username:
+                raise ValueError(f"Archivo desconocido: {data['file_id']}")
+            file = open(delivered['path'], 'rb')
+            self.storage.touch(data['file_id'])
+            size = os.fstat(file.fileno()).st_size
+            if size != delivered['size']:
+                raise ValueError(f"El archivo {delivered['file_name']} cambió en el servidor")
+            offset = data.get('offset', 0)
+            end = size if data.get('length') is None else min(size, offset + data['length'])
+            if not 0 <= offset <= end:
+                raise ValueError(f"Rango inválido para {delivered['file_name']}: {offset}-{end}")
+            reply.update({'file_id': data['file_id'], 'size': size, 'offset': offset, 'end': end})
+            download = (file, data['download_id'], offset, end)
+        except Exception as e:
+            logging.error(f"Descarga rechazada para {username}: {e}")
+            if file is not None:
+                file.close()
+            reply['error'] = str(e)
+            download = None
+        return encode_frame(FRAME_MESSAGE, codec.encode(reply), flags=codec.codec_id), download
+
+    def handle_data_frame(self, username, frame):
+        # Las conexiones de datos solo transportan chunks de archivo de transferencias ya iniciadas
+        if frame.type == FRAME_FILE_CHUNK:
+            self.handle_file_data(username, frame.payload)
+        else:
+            logging.warning(f"Frame de tipo {frame.type} en una conexión de datos de {username}")
+
+    def register_client(self, username, client, profile_image, hello=None):
+        avatar_hash = None
+        if hello is not None:
+            client.capabilities = {name for name in hello.get('capabilities', []) if name in CAPABILITIES}
+            welcome = {
+                'type': 'welcome',
+                'username': username,
+                'capabilities': sorted(client.capabilities)
+            }
+            if {'file_channels', 'file_download'} & client.capabilities:
+                welcome['session_token'] = self.open_session(username)
+                if self.data_socket:
+                    welcome['data_port'] = self.data_socket.getsockname()[1]
+            if 'streams' in client.capabilities:
+                client.streams = ReceiveWindows(self.stream_window)
+                welcome['stream_window'] = self.stream_window
+            compression_id = choose_compression(hello.get('compression'), self.compressions)
+            if compression_id != COMPRESSION_NONE:
+                welcome['compression'] = get_compression(compression_id).name
+            client.send(client.codec.encode(welcome), 'control')
+            if compression_id != COMPRESSION_NONE:
+                client.compressor = FrameCompressor(compression_id)
+            avatar_hash = hello.get('avatar_hash')
+        self.clients[username] = client
+        self.groups.invalidate_user(username)
+        known_avatar = self.assign_avatar(username, avatar_hash)
+        if self.router:
+            self.router.publish_join(username, self.avatar_hashes.get(username, ''))
+        self.publish_user_event('user_joined', username)
+        if profile_image:
+            # Cliente v1: la imagen llegó con el login y se procesa como cualquier otra subida
+            self.update_profile_image(username, profile_image)
+        elif avatar_hash and not known_avatar and 'avatar_request' in client.capabilities:
+            # Solo se sube la imagen si nadie conectado tiene ya la misma
+            client.send(client.codec.encode({'type': 'avatar_request', 'avatar_hash': avatar_hash}), 'control')
+
+    def open_session(self, username):
+        token = secrets.token_hex(16)
+        self.close_session(username)
+        self.sessions[token] = username
+        self.session_tokens[username] = token
+        return token
+
+    def close_session(self, username):
+        self.sessions.pop(self.session_tokens.pop(username, None), None)
+
+    def assign_avatar(self, username, image_hash, variants=None):
+        # Se adquiere antes de liberar la anterior para no descartar una imagen que se repite
+        if not self.avatars.acquire(image_hash, variants):
+            return False
+        self.forget_profile_image(username)
+        self.avatar_hashes[username] = image_hash
+        return True
+
+    def forget_profile_image(self, username):
+        self.avatars.release(self.avatar_hashes.pop(username, ''))
+
+    def handle_line(self, username, message):
+        try:
+            data = json.loads(message)
+            self.process_message(username, data)
+        except json.JSONDecodeError:
+            logging.warning(f"Mensaje no JSON de {username} descartado")
+
+    def handle_frame(self, username, frame):
+        if frame.type == FRAME_MESSAGE:
+            try:
+                data = get_codec(frame.flags & FLAG_CODEC_MASK).decode(frame.payload)
+            except Exception as e:
+                logging.error(f"Mensaje ilegible de {username}: {e}")
+                return
+            self.process_message(username, data)
+        elif frame.type == FRAME_FILE_CHUNK:
+            if frame.stream_id:
+                self.handle_stream_data(username, frame)
+            else:
+                self.handle_file_data(username, frame.payload)
+        else:
+            logging.warning(f"Tipo de frame desconocido de {username}: {frame.type}")
+
+    def handle_stream_data(self, username, frame):
+        # Datos con control de flujo: se procesan y se devuelve el crédito para que el cliente envíe más
+        client = self.clients.get(username)
+        streams = client.streams if client else None
+        if streams is None:
+            logging.warning(f"Frame del stream {frame.stream_id} de {username}, que no negoció streams")
+            return
+        if not streams.receive(frame.stream_id, len(frame.payload)):
+            # Quien ignora la ventana pierde el frame; el crédito no se le devuelve
+            logging.warning(f"{username} superó la ventana del stream {frame.stream_id}: frame descartado")
+            return
+        try:
+            self.handle_file_data(username, frame.payload)
+        finally:
+            streams.consume(frame.stream_id, len(frame.payload))
+            client.send_frame(encode_window_update(frame.stream_id, len(frame.payload)), 'control')
+
     def process_message(self, sender, data):
         try:
             if data['type'] == 'message':
                 recipient = data['recipient']
                 content = data['content']
-                if recipient in self.clients:
+                if self.is_online(recipient):
                     self.send_message(sender, recipient, content)
                 elif recipient in self.groups:
                     self.send_group_message(sender, recipient, content)
@@ -85,129 +374,563 @@ class ChatServer:
                 members = data['members']
                 self.create_group(group_name, members)
             elif data['type'] == 'file_chunk':
-                self.handle_file_chunk(sender, json.dumps(data).encode('utf-8'))
+                self.handle_file_chunk(sender, data)
+            elif data['type'] == 'file_start':
+                self.start_file_transfer(sender, data)
+            elif data['type'] == 'delete_file':
+                self.run_blocking(self.delete_file, sender, data['file_id'])
             elif data['type'] == 'profile_image':
                 self.update_profile_image(sender, data['image'])
+            elif data['type'] == 'get_avatar':
+                self.send_avatar(sender, data['avatar_hash'], data.get('variant', 'thumbnail'))
+            elif data['type'] == 'get_user_list':
+                with self.user_list_lock:
+                    self.send_user_list([sender])
             elif data['type'] == 'start_video_call':
                 recipient = data['recipient']
-                if recipient in self.clients:
+                if self.is_online(recipient):
                     self.send_message(sender, recipient, '[Videollamada iniciada]')
         except Exception as e:
             logging.error(f"Error al procesar el mensaje de {sender}: {e}")
 
+    def call_soon(self, callback, *args):
+        # Punto de entrada para eventos que llegan desde otros hilos (p. ej. el router entre workers)
+        callback(*args)
+
+    def run_blocking(self, function, *args, then=None):
+        # Llamadas que esperan al disco o al índice compartido con otros workers. Cada conexión tiene su hilo, así
+        # que solo espera el cliente que las pidió; then recibe el resultado
+        result = function(*args)
+        if then is not None:
+            then(result)
+
+    def is_online(self, username):
+        return username in self.clients or (self.router is not None and self.router.has_user(username))
+
+    def deliver(self, recipients, message, forward=True, kind='chat', key=None):
+        local = []
+        remote = []
+        for recipient in recipients:
+            client = self.clients.get(recipient)
+            if client is None:
+                remote.append(recipient)
+            else:
+                local.append(client)
+        self.deliver_local(local, message, kind, key)
+        if remote and forward and self.router:
+            self.router.forward(remote, message, kind, key)
+
+    def deliver_local(self, clients, message, kind='chat', key=None, exclude=None):
+        encoded = EncodedMessage(message)
+        for client in clients:
+            if client is exclude:
+                continue
+            try:
+                # Cada cola recibe una referencia al mismo frame, sin copias por destinatario
+                client.send_frame(encoded.frame_for(client), kind, key)
+            except Exception as e:
+                logging.error(f"Error al enviar a {client.username}: {e}")
+
+    def get_stats(self):
+        clients = list(self.clients.values())
+        return {
+            'clients': len(clients),
+            'outbound_bytes': sum(client.outbound.pending_bytes for client in clients),
+            'outbound_frames': sum(client.outbound.frame_count for client in clients),
+            'avatars': len(self.avatars),
+            'avatar_bytes': self.avatars.total_bytes(),
+            'backpressure': self.outbound_stats.snapshot(),
+            'queue_delay': self.outbound_stats.delay_snapshot(),
+            'read_bytes': self.read_scheduler.top_users(),
+            'sent_bytes': self.outbound_stats.top_users(),
+            'storage': self.storage.stats(),
+        }
+
+    def log_stats(self, interval):
+        while True:
+            time.sleep(interval)
+            logging.info(f"Estadísticas del servidor: {self.get_stats()}")
+
     def send_message(self, sender, recipient, content):
         try:
-            message = json.dumps({
+            self.deliver([recipient], {
                 'type': 'message',
                 'sender': sender,
                 'content': content
             })
-            self.clients[recipient].send(message.encode('utf-8') + b'\n')
             logging.info(f"Mensaje enviado de {sender} a {recipient}")
         except Exception as e:
             logging.error(f"Error al enviar el mensaje de {sender} a {recipient}: {e}")
 
     def send_group_message(self, sender, group, content):
         try:
-            message = json.dumps({
+            local, remote = self.groups.online(group, self.clients)
+            message = {
                 'type': 'group_message',
                 'sender': sender,
                 'group': group,
                 'content': content
-            })
-            for member in self.groups[group]:
-                if member in self.clients and member != sender:
-                    self.clients[member].send(message.encode('utf-8') + b'\n')
+            }
+            self.deliver_local(local, message, exclude=self.clients.get(sender))
+            if self.router:
+                self.router.forward([member for member in remote if member != sender], message)
             logging.info(f"Mensaje grupal enviado de {sender} al grupo {group}")
         except Exception as e:
             logging.error(f"Error al enviar el mensaje grupal de {sender} al grupo {group}: {e}")
 
-    def handle_file_chunk(self, username, chunk):
+    def handle_file_chunk(self, username, data):
         try:
-            data = json.loads(chunk.decode('utf-8'))
             recipient = data['recipient']
-            file_name = data['file_name']
-            chunk_number = data['chunk_number']
-            total_chunks = data['total_chunks']
-            content = base64.b64decode(data['content'])
-
-            if recipient not in self.file_chunks:
-                self.file_chunks[recipient] = {}
-            if file_name not in self.file_chunks[recipient]:
-                self.file_chunks[recipient][file_name] = [None] * total_chunks
-
-            self.file_chunks[recipient][file_name][chunk_number] = content
-
-            if all(self.file_chunks[recipient][file_name]):
-                file_content = b"".join(self.file_chunks[recipient][file_name])
-                safe_filename = os.path.join(self.received_files_dir, f"received_{file_name}")
-                with open(safe_filename, "wb") as f:
-                    f.write(file_content)
-                full_path = os.path.abspath(safe_filename)
-                self.send_message(username, recipient, f"[Archivo recibido: {file_name}]. Guardado en: {full_path}")
-                logging.info(f"Archivo {file_name} reensamblado para {recipient} y guardado en {full_path}")
-                del self.file_chunks[recipient][file_name]
-        except json.JSONDecodeError:
-            logging.error(f"Error al decodificar chunk de archivo de {username}")
+            file_name = os.path.basename(data['file_name'])
+            key = (username, recipient, file_name)
+            if key in self.opening_transfers:
+                # El primer chunk aún está reservando y creando el archivo: este se escribe cuando termine
+                self.opening_transfers[key].append(data)
+                return
+            transfer = self.file_transfers.get(key)
+            if transfer is None:
+                error = self.check_file_transfer(username, recipient, key)
+                if error:
+                    raise ValueError(error)
+                total_chunks = check_chunk_count(data['total_chunks'])
+                self.opening_transfers[key] = [data]
+                self.run_blocking(self.open_legacy_transfer, username, recipient, file_name, total_chunks,
+                                  then=lambda opened: self.legacy_transfer_opened(key, opened))
+                return
+            self.write_legacy_chunk(key, transfer, data)
+        except Exception as e:
+            logging.error(f"Error al procesar chunk de archivo de {username}: {e}")
+
+    def open_legacy_transfer(self, username, recipient, file_name, total_chunks):
+        # Sin tamaño en el mensaje se reserva el máximo que ocupan sus chunks, antes de crear nada. Devuelve la
+        # transferencia y el error, sin lanzar: los chunks que esperan se descartan en cualquier caso
+        reservation_id = secrets.token_hex(16)
+        reserved = False
+        try:
+            error = self.storage.reserve(reservation_id, username, total_chunks * LEGACY_CHUNK_SIZE)
+            if error:
+                return None, error
+            reserved = True
+            return IncomingFile(self.received_files_dir, file_name, username, recipient, total_chunks,
+                                LEGACY_CHUNK_SIZE, reservation_id=reservation_id), None
+        except Exception as e:
+            if reserved:
+                self.storage.release(reservation_id)
+            return None, str(e)
+
+    def legacy_transfer_opened(self, key, opened):
+        username = key[0]
+        transfer, error = opened
+        pending = self.opening_transfers.pop(key, [])
+        if error:
+            logging.error(f"Error al procesar chunk de archivo de {username}: {error}")
+            return
+        if username not in self.clients:
+            # El remitente se desconectó mientras se creaba el archivo
+            self.run_blocking(self.discard_file_transfer, transfer)
+            return
+        self.file_transfers[key] = transfer
+        for data in pending:
+            if self.file_transfers.get(key) is not transfer:
+                # Ya se completó: lo que queda son chunks repetidos
+                break
+            try:
+                self.write_legacy_chunk(key, transfer, data)
+            except Exception as e:
+                logging.error(f"Error al procesar chunk de archivo de {username}: {e}")
+
+    def write_legacy_chunk(self, key, transfer, data):
+        transfer.write_chunk(data['chunk_number'], base64.b64decode(data['content']))
+        if transfer.complete:
+            self.finish_file_transfer(key)
+
+    def file_received(self, delivered):
+        self.notify_file_received(delivered)
+        full_path = os.path.abspath(os.path.join(self.received_files_dir, delivered['path']))
+        logging.info(f"Archivo {delivered['file_name']} reensamblado para {delivered['recipient']} y guardado en "
+                     f"{full_path}")
+
+    def notify_file_received(self, delivered, forward=True):
+        recipient = delivered['recipient']
+        client = self.clients.get(recipient)
+        if client is None and forward and self.router and self.router.has_user(recipient):
+            # Solo el worker del destinatario sabe si su cliente puede descargar el archivo
+            self.router.forward_file(delivered)
+        elif client is not None and 'file_download' in client.capabilities:
+            self.deliver([recipient], {
+                'type': 'file_available',
+                'sender': delivered['sender'],
+                'file_id': delivered['file_id'],
+                'file_name': delivered['file_name'],
+                'size': delivered['size']
+            }, forward=False)
+        else:
+            full_path = os.path.abspath(os.path.join(self.received_files_dir, delivered['path']))
+            self.send_message(delivered['sender'], recipient,
+                              f"[Archivo recibido: {delivered['file_name']}]. Guardado en: {full_path}")
+
+    def start_file_transfer(self, sender, data):
+        # Los metadatos van en un mensaje normal; los datos llegan después en frames FRAME_FILE_CHUNK
+        try:
+            file_name = os.path.basename(data['file_name'])
+            recipient = data['recipient']
+            size = data['size']
+            chunk_size = data.get('chunk_size', LEGACY_CHUNK_SIZE)
+            chunk_hashes = data.get('chunk_hashes')
+            key = (sender, data['transfer_id'])
+            # Nada se crea en disco ni en memoria antes de saber que el destinatario existe, que el archivo está bien
+            # troceado y que el remitente tiene hueco
+            error = self.check_file_transfer(sender, recipient, key)
+            if error is None:
+                try:
+                    check_upload(size, chunk_size, chunk_hashes)
+                except ValueError as e:
+                    error = str(e)
+            if error:
+                self.reject_file_transfer(sender, data['transfer_id'], file_name, error)
+                return
+            previous = self.file_transfers.pop(key, None)
+            manifest = None if chunk_hashes is None else manifest_id(sender, recipient, file_name, size, chunk_size,
+                                                                     chunk_hashes)
+            existing = self.active_file_transfer(manifest, previous) if manifest else None
+            if previous is not None and previous is not existing:
+                self.run_blocking(self.release_file_transfer, previous)
+            self.run_blocking(self.prepare_file_transfer, sender, data, manifest, existing,
+                              then=lambda prepared: self.file_transfer_prepared(sender, data, prepared))
+        except Exception as e:
+            logging.error(f"Error al iniciar la transferencia de archivo de {sender}: {e}")
+
+    def prepare_file_transfer(self, sender, data, manifest, existing):
+        # La parte que espera al índice y al disco: parcial guardado, contenido ya almacenado, reserva y archivo
+        # nuevo. Devuelve (transferencia, entrega, error) sin lanzar
+        file_name = os.path.basename(data['file_name'])
+        recipient = data['recipient']
+        size = data['size']
+        chunk_size = data.get('chunk_size', LEGACY_CHUNK_SIZE)
+        chunk_hashes = data.get('chunk_hashes')
+        # Al reanudar, la subida renueva la reserva de su parcial en vez de sumar otra
+        reservation_id = manifest or secrets.token_hex(16)
+        reserved = False
+        try:
+            if manifest and existing is None:
+                existing = self.find_file_transfer(manifest)
+            if chunk_hashes is not None:
+                delivered = self.storage.deliver(content_id(size, chunk_size, chunk_hashes), sender, recipient,
+                                                 file_name)
+                if delivered is not None:
+                    if existing is not None:
+                        # Un parcial del mismo envío ya no hace falta
+                        self.discard_file_transfer(existing)
+                    return None, delivered, None
+            error = self.storage.reserve(reservation_id, sender, size)
+            if error:
+                if existing is not None and existing.chunks.missing < existing.chunks.count:
+                    # Un parcial reanudado se conserva: puede caber más tarde
+                    existing.suspend()
+                elif existing is not None:
+                    self.discard_file_transfer(existing)
+                return None, None, error
+            reserved = True
+            if existing is not None:
+                return existing, None, None
+            return IncomingFile.from_size(self.received_files_dir, file_name, sender, recipient, size, chunk_size,
+                                          chunk_hashes, reservation_id), None, None
+        except Exception as e:
+            logging.error(f"Error al iniciar la transferencia de archivo de {sender}: {e}")
+            if existing is not None:
+                self.release_file_transfer(existing)
+            elif reserved:
+                self.storage.release(reservation_id)
+            return None, None, str(e)
+
+    def file_transfer_prepared(self, sender, data, prepared):
+        transfer, delivered, error = prepared
+        transfer_id = data['transfer_id']
+        file_name = os.path.basename(data['file_name'])
+        try:
+            if error:
+                self.reject_file_transfer(sender, transfer_id, file_name, error)
+                return
+            if delivered is not None:
+                # El contenido ya estaba en el servidor: no falta ningún chunk y no se envía ningún byte
+                logging.info(f"{file_name} de {sender} ya estaba en el servidor: entrega sin subida")
+                self.file_received(delivered)
+                self.deliver([sender], {
+                    'type': 'file_status',
+                    'transfer_id': transfer_id,
+                    'missing': [],
+                    'stored': True
+                }, forward=False, kind='control')
+                return
+            if sender not in self.clients:
+                # El remitente se desconectó mientras se preparaba la transferencia
+                self.run_blocking(self.release_file_transfer, transfer)
+                return
+            key = (sender, transfer_id)
+            previous = self.file_transfers.get(key)
+            self.file_transfers[key] = transfer
+            if previous is not None and previous is not transfer:
+                # Otro file_start con el mismo id terminó de prepararse antes
+                self.run_blocking(self.release_file_transfer, previous)
+            # El cliente solo envía los chunks que faltan
+            self.deliver([sender], {
+                'type': 'file_status',
+                'transfer_id': transfer_id,
+                'missing': transfer.chunks.missing_ranges()
+            }, forward=False, kind='control')
+            if transfer.complete:
+                self.finish_file_transfer(key)
+        except Exception as e:
+            logging.error(f"Error al iniciar la transferencia de archivo de {sender}: {e}")
+
+    def check_file_transfer(self, sender, recipient, key):
+        if not self.is_online(recipient):
+            return f"Usuario desconocido: {recipient}"
+        # Cada transferencia abierta ocupa un descriptor y su reserva; la misma clave sustituye a la anterior
+        active = sum(1 for other in list(self.file_transfers) if other[0] == sender and other != key)
+        if active >= self.storage.limits.max_user_transfers:
+            return f"Demasiadas transferencias en curso ({active}); espera a que termine alguna"
+        return None
+
+    def reject_file_transfer(self, sender, transfer_id, file_name, error):
+        # El cliente no envía nada: no falta ningún chunk pero el archivo no se entrega
+        logging.warning(f"Archivo {file_name} de {sender} rechazado: {error}")
+        self.deliver([sender], {
+            'type': 'file_status',
+            'transfer_id': transfer_id,
+            'missing': [],
+            'error': error
+        }, forward=False, kind='control')
+
+    def active_file_transfer(self, manifest, previous=None):
+        # La transferencia con este manifiesto que sigue abierta, o None
+        if previous is not None and previous.manifest_id == manifest:
+            return previous
+        for key, active in list(self.file_transfers.items()):
+            if active.manifest_id == manifest:
+                # La misma transferencia sigue abierta por una conexión anterior que aún no se cerró
+                del self.file_transfers[key]
+                return active
+        return None
+
+    def find_file_transfer(self, manifest):
+        # La transferencia con este manifiesto que quedó en disco, o None si empieza de cero
+        partial = find_partial_transfer(self.received_files_dir, manifest)
+        if partial is not None:
+            logging.info(f"Reanudando {partial.file_name} de {partial.sender}: "
+                         f"{partial.chunks.count - partial.chunks.missing} de {partial.chunks.count} chunks ya "
+                         f"recibidos")
+        return partial
+
+    def handle_file_data(self, username, payload):
+        try:
+            transfer_id, offset, data = parse_file_chunk(payload)
+            key = (username, transfer_id)
+            transfer = self.file_transfers.get(key)
+            if transfer is None:
+                logging.warning(f"Chunk de una transferencia desconocida de {username}: {transfer_id}")
+                return
+            transfer.write_at(offset, data)
+            if transfer.complete:
+                self.finish_file_transfer(key)
         except Exception as e:
             logging.error(f"Error al procesar chunk de archivo de {username}: {e}")
 
+    def finish_file_transfer(self, key):
+        transfer = self.file_transfers.pop(key, None)
+        if transfer is None:
+            # Otra conexión de datos recibió el último chunk a la vez y ya la cerró
+            return
+        try:
+            delivered = transfer.finish(self.storage)
+        except Exception as e:
+            self.file_transfer_failed(transfer, e)
+            return
+        self.file_received(delivered)
+
+    def file_transfer_failed(self, transfer, error):
+        # El remitente ya envió todos los chunks: sin este aviso creería que el archivo se entregó
+        logging.error(f"Error al guardar {transfer.file_name} de {transfer.sender}: {error}")
+        self.run_blocking(self.discard_file_transfer, transfer)
+        self.deliver([transfer.sender], {
+            'type': 'file_error',
+            'recipient': transfer.recipient,
+            'file_name': transfer.file_name,
+            'error': f"El servidor no pudo guardar el archivo: {error}"
+        }, forward=False, kind='control')
+
+    def release_file_transfer(self, transfer):
+        try:
+            if transfer.resumable:
+                transfer.suspend()
+                logging.info(f"Transferencia de {transfer.sender} interrumpida: {transfer.file_name}, "
+                             f"faltan {transfer.chunks.missing} chunks; se puede reanudar")
+            else:
+                self.discard_file_transfer(transfer)
+                logging.info(f"Transferencia incompleta de {transfer.sender} descartada: {transfer.file_name}")
+        except Exception as e:
+            logging.error(f"Error al guardar la transferencia {transfer.file_name} de {transfer.sender}: {e}")
+
+    def discard_file_transfer(self, transfer):
+        transfer.discard()
+        self.storage.release(transfer.reservation_id)
+
+    def release_file_transfers(self, username):
+        for key in [key for key in list(self.file_transfers) if key[0] == username]:
+            self.run_blocking(self.release_file_transfer, self.file_transfers.pop(key))
+
+    def delete_file(self, username, file_id):
+        try:
+            delivered = self.storage.find(file_id)
+            if delivered is None or delivered['recipient'] != username:
+                raise ValueError(f"Archivo desconocido: {file_id}")
+            # Solo se quita esta entrega; el contenido se borra cuando ninguna otra lo referencia
+            self.storage.remove(file_id)
+            logging.info(f"{username} borró {delivered['file_name']} del servidor")
+        except Exception as e:
+            logging.error(f"Error al borrar el archivo {file_id} de {username}: {e}")
+
     def update_profile_image(self, username, image_data):
         try:
-            # Verificar que image_data es una cadena válida en base64
-            base64.b64decode(image_data)
-            self.profile_images[username] = image_data
+            self.avatar_pipeline.submit(image_data, lambda image_hash, variants: self.call_soon(
+                self.finish_profile_image, username, image_hash, variants))
+        except Exception as e:
+            logging.error(f"Error al actualizar la imagen de perfil de {username}: {e}")
+
+    def finish_profile_image(self, username, image_hash, variants):
+        try:
+            if username not in self.clients:
+                return
+            self.assign_avatar(username, image_hash, variants)
+            if self.router:
+                self.router.publish_join(username, image_hash)
             logging.info(f"Imagen de perfil actualizada para {username}")
-            self.broadcast_user_list()
+            self.publish_user_event('user_updated', username)
         except Exception as e:
             logging.error(f"Error al actualizar la imagen de perfil de {username}: {e}")
 
-    def broadcast_user_list(self):
+    def send_avatar(self, username, image_hash, variant='thumbnail'):
+        image_data = self.avatars.get(image_hash, variant)
+        if not image_data:
+            logging.warning(f"{username} pidió un avatar desconocido: {image_hash}")
+        # Se responde también si no existe para que el cliente no se quede esperando
+        self.deliver([username], {
+            'type': 'avatar',
+            'avatar_hash': image_hash,
+            'variant': variant,
+            'image': image_data
+        }, forward=False, kind='file')
+
+    def user_avatar_hash(self, username):
+        # None si el usuario ya se fue: el router quita a los remotos desde su hilo sin esperar a esta lista
+        if username in self.clients:
+            return self.avatar_hashes.get(username, '')
+        entry = self.router.remote_users.get(username) if self.router else None
+        return None if entry is None else entry[1]
+
+    def user_entry(self, username, inline_avatar=True, image_hash=None):
+        image_hash = self.user_avatar_hash(username) if image_hash is None else image_hash
+        if image_hash is None:
+            return None
+        if inline_avatar:
+            return {'username': username, 'profile_image': self.avatars.get(image_hash)}
+        return {'username': username, 'avatar_hash': image_hash}
+
+    def split_by_capability(self, recipients, capability):
+        capable = []
+        legacy = []
+        for username in recipients:
+            client = self.clients.get(username)
+            if client is not None and capability in client.capabilities:
+                capable.append(username)
+            else:
+                legacy.append(username)
+        return capable, legacy
+
+    def deliver_user_message(self, recipients, build_message, key=None):
+        # Los clientes con 'avatar_fetch' reciben solo el hash y piden la imagen si no la tienen
+        fetch, inline = self.split_by_capability(recipients, 'avatar_fetch')
+        for group, inline_avatar in ((fetch, False), (inline, True)):
+            if group:
+                self.deliver(group, build_message(inline_avatar), forward=False, kind='control', key=key)
+
+    def send_user_list(self, recipients):
         try:
-            user_list = [{
-                'username': username,
-                'profile_image': self.profile_images.get(username, '')
-            } for username in self.clients.keys()]
-            message = json.dumps({
+            usernames = list(self.clients)
+            if self.router:
+                usernames.extend(self.router.remote_usernames())
+            self.deliver_user_message(recipients, lambda inline_avatar: {
                 'type': 'user_list',
-                'users': user_list
-            })
-            for client in self.clients.values():
-                client.send(message.encode('utf-8') + b'\n')
-            logging.info("Lista de usuarios actualizada y enviada a todos los clientes")
+                'version': self.user_list_version,
+                'users': [entry for entry in (self.user_entry(username, inline_avatar) for username in usernames)
+                          if entry is not None]
+            }, key='user_list')
         except Exception as e:
             logging.error(f"Error al enviar la lista de usuarios: {e}")
 
+    def publish_user_event(self, event_type, username):
+        try:
+            with self.user_list_lock:
+                self.user_list_version += 1
+                version = self.user_list_version
+                deltas = []
+                snapshots = []
+                for name, client in list(self.clients.items()):
+                    # Quien acaba de entrar y los clientes sin 'user_deltas' reciben la lista completa
+                    if 'user_deltas' in client.capabilities and not (event_type == 'user_joined' and name == username):
+                        deltas.append(name)
+                    else:
+                        snapshots.append(name)
+                image_hash = None if event_type == 'user_left' else self.user_avatar_hash(username)
+                if event_type == 'user_left':
+                    self.deliver(deltas, {'type': event_type, 'version': version, 'username': username},
+                                 forward=False, kind='control')
+                elif image_hash is not None:
+                    # Si ya se fue, su user_left llega detrás y los clientes piden la lista completa al ver el hueco
+                    self.deliver_user_message(deltas, lambda inline_avatar: {
+                        'type': event_type,
+                        'version': version,
+                        'user': self.user_entry(username, inline_avatar, image_hash)
+                    })
+                if snapshots:
+                    self.send_user_list(snapshots)
+            logging.info(f"Cambio en la lista de usuarios ({event_type} {username}) enviado a los clientes")
+        except Exception as e:
+            logging.error(f"Error al notificar el cambio en la lista de usuarios: {e}")
+
     def disconnect_client(self, username):
         try:
-            if username in self.clients:
-                del self.clients[username]
-            if username in self.profile_images:
-                del self.profile_images[username]
-            # Remover al usuario de todos los grupos
-            for group_name, members in self.groups.items():
-                if username in members:
-                    members.remove(username)
-                    if not members:  # Si el grupo queda vacío, eliminarlo
-                        del self.groups[group_name]
-            self.broadcast_user_list()
-            self.broadcast_group_list()
+            self.clients.pop(username, None)
+            self.close_session(username)
+            self.read_scheduler.forget(username)
+            self.groups.invalidate_user(username)
+            self.forget_profile_image(username)
+            self.release_file_transfers(username)
+            if self.router:
+                self.router.publish_leave(username)
+            removed_groups = self.remove_from_groups(username)
+            self.publish_user_event('user_left', username)
+            if removed_groups:
+                self.broadcast_group_list()
             logging.info(f"Cliente {username} desconectado y eliminado")
         except Exception as e:
             logging.error(f"Error al desconectar al cliente {username}: {e}")
 
+    def remove_from_groups(self, username):
+        # Remover al usuario de sus grupos; los que quedan vacíos se eliminan
+        return self.groups.remove_user(username)
+
     def create_group(self, group_name, members):
         try:
-            if group_name not in self.groups:
-                self.groups[group_name] = members
-                message = json.dumps({
+            if self.groups.create(group_name, members):
+                members = sorted(self.groups.members_of(group_name))
+                if self.router:
+                    self.router.publish_group(group_name, members)
+                self.deliver(members, {
                     'type': 'group_created',
                     'group_name': group_name,
                     'members': members
-                })
-                for member in members:
-                    if member in self.clients:
-                        self.clients[member].send(message.encode('utf-8') + b'\n')
+                }, kind='control')
                 logging.info(f"Grupo '{group_name}' creado con miembros: {', '.join(members)}")
                 self.broadcast_group_list()
             else:
@@ -217,18 +940,102 @@ class ChatServer:
 
     def broadcast_group_list(self):
         try:
-            group_list = list(self.groups.keys())
-            message = json.dumps({
+            group_list = self.groups.names()
+            self.deliver(list(self.clients), {
                 'type': 'group_list',
                 'groups': group_list
-            })
-            for client in self.clients.values():
-                client.send(message.encode('utf-8') + b'\n')
+            }, forward=False, kind='control', key='group_list')
             logging.info("Lista de grupos actualizada y enviada a todos los clientes")
         except Exception as e:
             logging.error(f"Error al enviar la lista de grupos: {e}")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Servidor de chat")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=14999)
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help="threads: un hilo por conexión; asyncio: un solo bucle de eventos")
+    parser.add_argument('--backlog', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="número de procesos que comparten el puerto con SO_REUSEPORT")
+    parser.add_argument('--max-outbound-bytes', type=int, default=8 * 1024 * 1024,
+                        help="bytes pendientes de envío por conexión antes de aplicar las políticas")
+    parser.add_argument('--max-outbound-frames', type=int, default=10000)
+    parser.add_argument('--slow-client-timeout', type=float, default=30.0,
+                        help="segundos por encima del límite antes de desconectar al cliente")
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help="si es mayor que 0, registra las estadísticas cada N segundos")
+    parser.add_argument('--avatar-workers', type=int, default=None,
+                        help="procesos que normalizan las imágenes de perfil (por defecto, uno por núcleo)")
+    parser.add_argument('--max-avatar-bytes', type=int, default=MAX_AVATAR_BYTES,
+                        help="tamaño máximo de una imagen de perfil subida")
+    parser.add_argument('--user-class', action='append', metavar='USUARIO=CLASE',
+                        help="clase de un usuario para el reparto de lectura y escritura (repetible)")
+    parser.add_argument('--class-weight', action='append', metavar='CLASE=PESO',
+                        help="peso de una clase de usuarios; la clase 'default' pesa 1 (repetible)")
+    parser.add_argument('--compression', action='append', choices=sorted(COMPRESSION_NAMES) + ['none'],
+                        help="compresión que el servidor puede usar al enviar (repetible; por defecto, todas las "
+                             "instaladas; 'none' la desactiva)")
+    parser.add_argument('--max-storage-bytes', type=int, default=DEFAULT_MAX_BYTES,
+                        help="espacio máximo de los archivos recibidos; al superarlo se borran los menos usados")
+    parser.add_argument('--max-user-storage-bytes', type=int, default=DEFAULT_MAX_USER_BYTES,
+                        help="espacio máximo de los archivos que envió cada usuario")
+    parser.add_argument('--max-file-age-days', type=float, default=DEFAULT_MAX_AGE / (24 * 60 * 60),
+                        help="días que un archivo recibido se guarda en el servidor")
+    parser.add_argument('--max-user-transfers', type=int, default=DEFAULT_MAX_USER_TRANSFERS,
+                        help="subidas en curso por usuario")
+    args = parser.parse_args()
+    try:
+        parse_assignments(args.class_weight, parse_weight)
+        parse_assignments(args.user_class)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def outbound_limits_from_args(args):
+    return OutboundLimits(args.max_outbound_bytes, args.max_outbound_frames,
+                          disconnect_after=args.slow_client_timeout)
+
+
+def compressions_from_args(args):
+    if args.compression is None:
+        return None
+    return [name for name in args.compression if name != 'none']
+
+
+def storage_limits_from_args(args):
+    return StorageLimits(args.max_storage_bytes, args.max_user_storage_bytes, args.max_file_age_days * 24 * 60 * 60,
+                         max_user_transfers=args.max_user_transfers)
+
+
+def fairness_from_args(args):
+    return FairnessPolicy(parse_assignments(args.class_weight, parse_weight), parse_assignments(args.user_class))
+
+
 if __name__ == "__main__":
-    server = ChatServer()
+    args = parse_args()
+    limits = outbound_limits_from_args(args)
+    fairness = fairness_from_args(args)
+    compressions = compressions_from_args(args)
+    storage_limits = storage_limits_from_args(args)
+    if args.workers > 1:
+        from sharding import ShardedServer
+        server = ShardedServer(args.host, args.port, args.workers, args.engine, args.backlog, limits,
+                               args.stats_interval, args.avatar_workers, args.max_avatar_bytes, fairness,
+                               compressions, storage_limits)
+    elif args.engine == 'asyncio':
+        from async_server import AsyncChatServer
+        avatar_pipeline = AvatarPipeline(args.avatar_workers, args.max_avatar_bytes)
+        server = AsyncChatServer(args.host, args.port, args.backlog or 1024, outbound_limits=limits,
+                                 avatar_pipeline=avatar_pipeline, fairness=fairness, compressions=compressions,
+                                 storage_limits=storage_limits)
+    else:
+        avatar_pipeline = AvatarPipeline(args.avatar_workers, args.max_avatar_bytes)
+        server = ChatServer(args.host, args.port, args.backlog or 5, outbound_limits=limits,
+                            avatar_pipeline=avatar_pipeline, fairness=fairness, compressions=compressions,
+                            storage_limits=storage_limits)
+    if args.workers <= 1 and args.stats_interval > 0:
+        threading.Thread(target=server.log_stats, args=(args.stats_interval,), daemon=True).start()
     server.start()
@@ -0,0 +1,239 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from avatar_store import MAX_AVATAR_BYTES, AvatarPipeline
+from framing import FrameReader
+from server import ChatServer
+
+
+class WorkerRouter:
+    def __init__(self, server, worker_id, workers, socket_dir):
+        self.server = server
+        self.worker_id = worker_id
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.remote_users = {}
+        self.outboxes = {}
+        self.lock = threading.Lock()
+
+    def socket_path(self, worker_id):
+        return os.path.join(self.socket_dir, f"worker-{worker_id}.sock")
+
+    def start(self):
+        path = self.socket_path(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(self.workers)
+        threading.Thread(target=self.accept_peers, args=(listener,), daemon=True).start()
+        for worker_id in range(self.workers):
+            if worker_id != self.worker_id:
+                # Al (re)arrancar pedimos a cada worker su estado actual
+                self.send_event(worker_id, {'op': 'hello', 'worker': self.worker_id})
+        logging.info(f"Worker {self.worker_id} escuchando eventos en {path}")
+
+    def accept_peers(self, listener):
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=self.handle_peer, args=(conn,), daemon=True).start()
+
+    def handle_peer(self, conn):
+        reader = FrameReader(conn)
+        try:
+            while True:
+                reader.fill()
+                for line in reader.frames():
+                    self.server.call_soon(self.handle_event, json.loads(line))
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logging.error(f"Error en el canal entre workers: {e}")
+        finally:
+            conn.close()
+
+    def send_event(self, worker_id, event):
+        with self.lock:
+            outbox = self.outboxes.get(worker_id)
+            if outbox is None:
+                outbox = queue.Queue()
+                self.outboxes[worker_id] = outbox
+                threading.Thread(target=self.write_events, args=(worker_id, outbox), daemon=True).start()
+        outbox.put(json.dumps(event).encode('utf-8') + b'\n')
+
+    def write_events(self, worker_id, outbox):
+        # Un hilo por worker vecino: quien publica nunca bloquea en el socket Unix
+        conn = None
+        while True:
+            line = outbox.get()
+            for attempt in range(50):
+                try:
+                    if conn is None:
+                        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        conn.connect(self.socket_path(worker_id))
+                    conn.sendall(line)
+                    break
+                except OSError:
+                    if conn is not None:
+                        conn.close()
+                    conn = None
+                    time.sleep(0.1)
+            else:
+                logging.error(f"Evento descartado: el worker {worker_id} no responde")
+
+    def publish(self, event):
+        for worker_id in range(self.workers):
+            if worker_id != self.worker_id:
+                self.send_event(worker_id, event)
+
+    def publish_join(self, username, image_hash):
+        # Se envían las imágenes ya procesadas para que ningún otro worker repita el trabajo
+        self.publish({'op': 'join', 'worker': self.worker_id, 'username': username,
+                      'avatar_hash': image_hash, 'avatar': self.server.avatars.variants(image_hash)})
+
+    def publish_leave(self, username):
+        self.publish({'op': 'leave', 'worker': self.worker_id, 'username': username})
+
+    def publish_group(self, group_name, members):
+        self.publish({'op': 'group', 'group_name': group_name, 'members': members})
+
+    def has_user(self, username):
+        return username in self.remote_users
+
+    def remote_usernames(self):
+        return list(self.remote_users)
+
+    def forward(self, recipients, message, kind='chat', key=None):
+        by_worker = {}
+        for recipient in recipients:
+            entry = self.remote_users.get(recipient)
+            if entry:
+                by_worker.setdefault(entry[0], []).append(recipient)
+        for worker_id, worker_recipients in by_worker.items():
+            self.send_event(worker_id, {'op': 'deliver', 'recipients': worker_recipients, 'message': message,
+                                        'kind': kind, 'key': key})
+
+    def forward_file(self, delivered):
+        entry = self.remote_users.get(delivered['recipient'])
+        if entry:
+            self.send_event(entry[0], {'op': 'file_received', 'file': delivered})
+
+    def handle_event(self, event):
+        try:
+            op = event['op']
+            if op == 'deliver':
+                self.server.deliver(event['recipients'], event['message'], forward=False,
+                                    kind=event.get('kind', 'chat'), key=event.get('key'))
+            elif op == 'file_received':
+                # El descriptor está en el directorio compartido: este worker puede servir la descarga
+                self.server.notify_file_received(event['file'], forward=False)
+            elif op == 'join':
+                # Un join de un usuario ya conocido es un cambio de imagen de perfil
+                previous = self.remote_users.get(event['username'])
+                # La imagen se guarda en el almacén local para servir los get_avatar de nuestros clientes
+                image_hash = event['avatar_hash']
+                if not self.server.avatars.acquire(image_hash, event['avatar']):
+                    image_hash = ''
+                self.remote_users[event['username']] = (event['worker'], image_hash)
+                if previous:
+                    self.server.avatars.release(previous[1])
+                self.server.publish_user_event('user_updated' if previous else 'user_joined', event['username'])
+            elif op == 'leave':
+                if self.remote_users.get(event['username'], (None,))[0] == event['worker']:
+                    _, image_hash = self.remote_users.pop(event['username'])
+                    self.server.avatars.release(image_hash)
+                    self.server.publish_user_event('user_left', event['username'])
+                if self.server.remove_from_groups(event['username']):
+                    self.server.broadcast_group_list()
+            elif op == 'group':
+                if self.server.groups.create(event['group_name'], event['members']):
+                    self.server.broadcast_group_list()
+            elif op == 'hello':
+                worker_id = event['worker']
+                for username in list(self.server.clients):
+                    image_hash = self.server.avatar_hashes.get(username, '')
+                    self.send_event(worker_id, {'op': 'join', 'worker': self.worker_id, 'username': username,
+                                                'avatar_hash': image_hash,
+                                                'avatar': self.server.avatars.variants(image_hash)})
+                for group_name, members in self.server.groups.items():
+                    self.send_event(worker_id, {'op': 'group', 'group_name': group_name, 'members': members})
+        except Exception as e:
+            logging.error(f"Error al procesar el evento {event.get('op')} del router: {e}")
+
+
+def run_worker(host, port, worker_id, workers, engine, backlog, socket_dir, outbound_limits, stats_interval,
+               avatar_workers=None, max_avatar_bytes=MAX_AVATAR_BYTES, fairness=None, compressions=None,
+               storage_limits=None):
+    # El pipeline de avatares (lock y pool) se construye aquí: no se puede enviar al hijo con spawn/forkserver
+    avatar_pipeline = AvatarPipeline(avatar_workers, max_avatar_bytes)
+    # data_port=0: cada worker escucha además en un puerto propio para las conexiones de datos de sus sesiones
+    if engine == 'asyncio':
+        from async_server import AsyncChatServer
+        server = AsyncChatServer(host, port, backlog or 1024, reuse_port=True, outbound_limits=outbound_limits,
+                                 avatar_pipeline=avatar_pipeline, data_port=0, fairness=fairness,
+                                 compressions=compressions, storage_limits=storage_limits)
+    else:
+        server = ChatServer(host, port, backlog or 5, reuse_port=True, outbound_limits=outbound_limits,
+                            avatar_pipeline=avatar_pipeline, data_port=0, fairness=fairness, compressions=compressions,
+                            storage_limits=storage_limits)
+    server.router = WorkerRouter(server, worker_id, workers, socket_dir)
+    if stats_interval:
+        threading.Thread(target=server.log_stats, args=(stats_interval,), daemon=True).start()
+    logging.info(f"Worker {worker_id} (pid {os.getpid()}) arrancando")
+    server.start()
+
+
+class ShardedServer:
+    def __init__(self, host='localhost', port=14999, workers=None, engine='threads', backlog=None,
+                 outbound_limits=None, stats_interval=0, avatar_workers=None, max_avatar_bytes=MAX_AVATAR_BYTES,
+                 fairness=None, compressions=None, storage_limits=None):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.engine = engine
+        self.backlog = backlog
+        self.outbound_limits = outbound_limits
+        self.stats_interval = stats_interval
+        self.avatar_workers = avatar_workers
+        self.max_avatar_bytes = max_avatar_bytes
+        self.fairness = fairness
+        self.compressions = compressions
+        # Todos los workers comparten received_files y su índice; cada uno expulsa con los mismos límites
+        self.storage_limits = storage_limits
+        self.socket_dir = tempfile.mkdtemp(prefix='chat-workers-')
+        self.processes = []
+
+    def start(self):
+        for worker_id in range(self.workers):
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(self.host, self.port, worker_id, self.workers, self.engine, self.backlog, self.socket_dir,
+                      self.outbound_limits, self.stats_interval, self.avatar_workers, self.max_avatar_bytes,
+                      self.fairness, self.compressions, self.storage_limits),
+                daemon=True)
+            process.start()
+            self.processes.append(process)
+        logging.info(f"Servidor con {self.workers} workers iniciado en {self.host}:{self.port}")
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        try:
+            for process in self.processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
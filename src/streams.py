@@ -0,0 +1,98 @@
+import threading
+
+# Bytes que un stream puede tener enviados y sin confirmar; acota lo que un mensaje del chat tiene delante
+DEFAULT_STREAM_WINDOW = 1024 * 1024
+MAX_STREAM_ID = 0xFFFF
+
+
+class CreditWindow:
+    def __init__(self, stream_id, size):
+        self.stream_id = stream_id
+        self.size = size
+        self.credit = size
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self, amount, timeout=None):
+        if amount > self.size:
+            raise ValueError(f"Frame de {amount} bytes mayor que la ventana de {self.size} del stream "
+                             f"{self.stream_id}")
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.closed or self.credit >= amount, timeout):
+                raise TimeoutError(f"El stream {self.stream_id} no recibió crédito a tiempo")
+            if self.closed:
+                raise ConnectionError(f"Stream {self.stream_id} cerrado")
+            self.credit -= amount
+
+    def release(self, amount):
+        with self.condition:
+            self.credit = min(self.size, self.credit + amount)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class StreamWindows:
+    # Lado que envía: una ventana por stream abierto, que se recarga con los WINDOW_UPDATE del otro extremo
+    def __init__(self, window_size=DEFAULT_STREAM_WINDOW):
+        self.window_size = window_size
+        self.windows = {}
+        # El stream 0 lleva los mensajes del chat y de control, sin control de flujo; nunca se abre aquí
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def open(self):
+        with self.lock:
+            for _ in range(MAX_STREAM_ID):
+                stream_id = self.next_id
+                self.next_id = self.next_id % MAX_STREAM_ID + 1
+                if stream_id not in self.windows:
+                    window = self.windows[stream_id] = CreditWindow(stream_id, self.window_size)
+                    return window
+        raise ValueError("No quedan streams libres en la conexión")
+
+    def release(self, stream_id, amount):
+        window = self.windows.get(stream_id)
+        if window is not None:
+            window.release(amount)
+
+    def close(self, stream_id):
+        with self.lock:
+            window = self.windows.pop(stream_id, None)
+        if window is not None:
+            window.close()
+
+    def close_all(self):
+        with self.lock:
+            windows = list(self.windows.values())
+            self.windows.clear()
+        for window in windows:
+            window.close()
+
+
+class ReceiveWindows:
+    # Lado que recibe: cuenta lo pendiente de cada stream y rechaza a quien envía más de lo que se le concedió
+    def __init__(self, window_size=DEFAULT_STREAM_WINDOW):
+        self.window_size = window_size
+        self.outstanding = {}
+        self.lock = threading.Lock()
+
+    def receive(self, stream_id, amount):
+        with self.lock:
+            outstanding = self.outstanding.get(stream_id, 0) + amount
+            if outstanding > self.window_size:
+                return False
+            self.outstanding[stream_id] = outstanding
+            return True
+
+    def consume(self, stream_id, amount):
+        # Datos ya procesados: el crédito vuelve al emisor
+        with self.lock:
+            outstanding = self.outstanding.get(stream_id, 0) - amount
+            if outstanding > 0:
+                self.outstanding[stream_id] = outstanding
+            else:
+                self.outstanding.pop(stream_id, None)
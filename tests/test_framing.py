@@ -0,0 +1,95 @@
+import socket
+import zlib
+
+import pytest
+
+from compression import COMPRESSION_ZLIB
+from framing import (FRAME_FILE_CHUNK, FRAME_MESSAGE, HEADER, BinaryFrameReader, Frame, FrameReader,
+                     compression_flags, encode_frame)
+from message_codec import CODEC_BINARY
+
+
+def test_lines_split_across_feeds():
+    reader = FrameReader(recv_size=16)
+    reader.feed(b'{"a": 1}\n{"b"')
+    assert reader.frames() == [b'{"a": 1}']
+    reader.feed(b': 2}')
+    assert reader.frames() == []
+    reader.feed(b'\n{"c": 3}\n')
+    assert reader.frames() == [b'{"b": 2}', b'{"c": 3}']
+    assert reader.start == reader.end == 0
+
+
+def test_line_without_delimiter_over_max_size():
+    reader = FrameReader(max_frame_size=8, recv_size=4)
+    reader.feed(b'12345678')
+    assert reader.frames() == []
+    reader.feed(b'9')
+    with pytest.raises(ValueError):
+        reader.frames()
+
+
+def test_binary_frames_split_byte_by_byte():
+    data = encode_frame(FRAME_MESSAGE, b'hola') + encode_frame(FRAME_FILE_CHUNK, b'x' * 100, stream_id=3)
+    reader = BinaryFrameReader(recv_size=8)
+    frames = []
+    for index in range(len(data)):
+        reader.feed(data[index:index + 1])
+        frames += reader.frames()
+    assert frames == [Frame(FRAME_MESSAGE, 0, 0, b'hola'), Frame(FRAME_FILE_CHUNK, 0, 3, b'x' * 100)]
+    assert reader.start == reader.end == 0
+
+
+def test_binary_partial_header_and_payload():
+    data = encode_frame(FRAME_MESSAGE, b'payload')
+    reader = BinaryFrameReader()
+    reader.feed(data[:HEADER.size - 1])
+    assert reader.frames() == []
+    reader.feed(data[HEADER.size - 1:-1])
+    assert reader.frames() == []
+    reader.feed(data[-1:])
+    assert reader.frames() == [Frame(FRAME_MESSAGE, 0, 0, b'payload')]
+
+
+def test_binary_partial_payload_reserves_the_rest():
+    reader = BinaryFrameReader(recv_size=16)
+    data = encode_frame(FRAME_MESSAGE, b'y' * 1000)
+    reader.feed(data[:100])
+    assert reader.frames() == []
+    assert len(reader.buffer) - reader.start >= len(data)
+
+
+def test_binary_oversized_frame():
+    reader = BinaryFrameReader(max_frame_size=64)
+    reader.feed(HEADER.pack(FRAME_MESSAGE, 0, 0, 65))
+    with pytest.raises(ValueError):
+        reader.frames()
+
+
+def test_binary_oversized_decompressed_payload():
+    reader = BinaryFrameReader(max_frame_size=64)
+    reader.feed(encode_frame(FRAME_MESSAGE, zlib.compress(b'z' * 65), flags=compression_flags(COMPRESSION_ZLIB)))
+    with pytest.raises(ValueError):
+        reader.frames()
+
+
+def test_binary_compressed_frame():
+    reader = BinaryFrameReader()
+    flags = compression_flags(COMPRESSION_ZLIB) | CODEC_BINARY
+    reader.feed(encode_frame(FRAME_MESSAGE, zlib.compress(b'z' * 1000), flags=flags))
+    assert reader.frames() == [Frame(FRAME_MESSAGE, CODEC_BINARY, 0, b'z' * 1000)]
+
+
+def test_fill_from_socket_and_closed_connection():
+    left, right = socket.socketpair()
+    with left, right:
+        reader = BinaryFrameReader(right, recv_size=4)
+        left.sendall(encode_frame(FRAME_MESSAGE, b'abc'))
+        frames = []
+        while not frames:
+            reader.fill()
+            frames = reader.frames()
+        assert frames == [Frame(FRAME_MESSAGE, 0, 0, b'abc')]
+        left.shutdown(socket.SHUT_WR)
+        with pytest.raises(ConnectionError):
+            reader.fill()